@@ -0,0 +1,81 @@
+"""
+Scaling benchmark of the cleaning of the data-set partitioned by country
+(DataManager.prepare_dataset_and_panel with several workers) on synthetic
+SHARE-like data-sets. Every run is checked against the serial run, and the
+results are appended as json lines to a results file:
+
+    python -m benchmarks.partitioned --rows 100000 1000000 --workers 1 2 4 8
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import time
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from benchmarks.run import DEFAULT_DATA_DIR, dataset_paths, git_commit
+from longevity.data_manager import DataManager
+
+DEFAULT_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'partitioned_results.jsonl')
+
+
+def time_cleaning(raw: pd.DataFrame, workers: int) -> Dict[str, Any]:
+    """
+    Clean a data-set and create its panel
+    :param raw: the data-set, as returned by DataManager.read_dataset
+    :param workers: the number of worker processes
+    :return: the wall time, the cleaned data-set and the panel
+    """
+    dm = DataManager.from_frame(raw.copy(), verbose=False)
+    wall_time = time.perf_counter()
+    df, panel_df = dm.prepare_dataset_and_panel(workers=workers)
+    return {'wall_time': time.perf_counter() - wall_time, 'df': df, 'panel_df': panel_df}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the partitioned cleaning of the data-set')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000],
+                        help='approximate numbers of EasyShare rows')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='numbers of worker processes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='where generated data-sets are kept')
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help='json lines file where results are appended')
+    args = parser.parse_args()
+
+    environment = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+    for rows in args.rows:
+        raw = DataManager.read_dataset(*dataset_paths(rows, args.seed, args.data_dir))
+        serial = time_cleaning(raw, 1)
+        for workers in args.workers:
+            run = serial if workers == 1 else time_cleaning(raw, workers)
+            assert_frame_equal(run['df'], serial['df'])
+            assert_frame_equal(run['panel_df'], serial['panel_df'])
+            result = {
+                'rows': rows,
+                'seed': args.seed,
+                'workers': workers,
+                'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                **environment,
+                'wall_time': run['wall_time'],
+                'speedup': serial['wall_time'] / run['wall_time'],
+            }
+            with open(args.results, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+            print('rows: {}, workers: {}, wall time: {:.2f}s, speedup: {:.2f}'.format(
+                rows, workers, result['wall_time'], result['speedup']))
+
+
+if __name__ == '__main__':
+    main()
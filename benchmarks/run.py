@@ -0,0 +1,197 @@
+"""
+Scaling benchmark of the longevity pipeline on synthetic SHARE-like data-sets.
+
+Each size runs in a fresh process, so that the peak memory of a run is not hidden
+by the one of a previous run, and every stage is measured with longevity.profiling.
+Results are appended as json lines to a results file for regression tracking, and
+compared with the last recorded run of the same size:
+
+    python -m benchmarks.run --rows 10000 100000 1000000
+
+With --compare-rowwise, the cleaning (DataManager.prepare_dataset) is also timed against
+the row-wise reference implementation of benchmarks.rowwise on the same data-set.
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import rowwise
+from longevity import synthetic
+from longevity.cache import ModelCache
+from longevity.data_manager import DataManager
+from longevity.estimates import LongevityEstimator
+from longevity.profiling import Profiler, peak_memory
+
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), 'longevity-benchmarks')
+DEFAULT_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl')
+
+
+def dataset_paths(rows: int, seed: int, data_dir: str) -> List[str]:
+    """
+    Get the paths of a synthetic data-set, generating it if it does not exist yet
+    :param rows: the approximate number of EasyShare rows
+    :param seed: the seed of the generator
+    :param data_dir: directory where the generated data-sets are kept
+    :return: the paths of the EasyShare and of the cover screens data-sets
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    prefix = os.path.join(data_dir, 'share_{}_{}'.format(rows, seed))
+    paths = [prefix + '_easy.dta', prefix + '_cv.dta']
+    if not all(os.path.exists(path) for path in paths):
+        synthetic.write(paths[0], paths[1], rows, seed)
+    return paths
+
+
+def run_pipeline(easy_share_dta_path: str, share_death_dta_path: str, trace_memory: bool = True) -> Dict[str, Any]:
+    """
+    Run and profile the whole pipeline once
+    :param easy_share_dta_path: path to the EasyShare data-set
+    :param share_death_dta_path: path to the cover screens data-set
+    :param trace_memory: whether to measure the peak memory of each stage with tracemalloc (slower)
+    :return: the profile of each stage and the peak memory of the process
+    """
+    profiler = Profiler(trace_memory)
+    dm = DataManager(easy_share_dta_path, share_death_dta_path, verbose=False, profiler=profiler)
+    df = dm.prepare_dataset()
+    with profiler.stage('create_panel_dataset', rows=len(df)) as record:
+        panel_df = DataManager.create_panel_dataset(df)
+        record.rows_out = len(panel_df)
+    # a fresh model cache, so that the fit of the hazard model is measured
+    estimator = LongevityEstimator(df, panel_df, 'female', int(np.nanmedian(df['income_dcl'].to_numpy(
+        dtype=float, na_value=np.nan))), model_cache=ModelCache())
+    for healthy_life_only in (True, False):
+        with profiler.stage('compute_lifetime_estimates', rows=len(panel_df)):
+            estimator.compute_lifetime_estimates(healthy_life_only)
+    return {'stages': profiler.to_dict(), 'peak_memory': peak_memory()}
+
+
+def time_cleaning(easy_share_dta_path: str, share_death_dta_path: str) -> Dict[str, float]:
+    """
+    Time the cleaning of a data-set by DataManager.prepare_dataset and by the row-wise
+    reference implementation, checking that they keep the same rows
+    :param easy_share_dta_path: path to the EasyShare data-set
+    :param share_death_dta_path: path to the Share cover screens data-set
+    :return: the wall time of both cleanings and the speedup of the vectorized one
+    """
+    raw = DataManager.read_dataset(easy_share_dta_path, share_death_dta_path)
+    wall_time = time.perf_counter()
+    df = DataManager.from_frame(raw.copy(deep=False), verbose=False).prepare_dataset()
+    vectorized = time.perf_counter() - wall_time
+
+    wall_time = time.perf_counter()
+    expected, _ = rowwise.prepare_dataset(raw)
+    reference = time.perf_counter() - wall_time
+    assert df['mergeid'].astype(str).tolist() == expected['mergeid'].astype(str).tolist()
+    return {'vectorized': vectorized, 'rowwise': reference, 'speedup': reference / vectorized}
+
+
+def _run_in_fresh_process(paths: List[str], trace_memory: bool) -> Dict[str, Any]:
+    """
+    Run the pipeline in a new process
+    """
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(run_pipeline, (*paths, trace_memory))
+
+
+def git_commit() -> Optional[str]:
+    """
+    Get the commit the benchmark runs on, if any
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def last_results(path: str) -> Dict[int, Dict[str, Any]]:
+    """
+    Read the last recorded result of each size
+    :param path: the results file
+    :return: the last result by number of rows
+    """
+    results = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                result = json.loads(line)
+                results[result['rows']] = result
+    return results
+
+
+def summary(result: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Summarize a result by stage, with the wall time relative to the previous result of the same size
+    :param result: the result of a run
+    :param previous: the previous result of the same size, if any
+    :return: a DataFrame with one row per stage
+    """
+    def by_stage(stages):
+        # the times of stages that run several times (e.g. compute_lifetime_estimates) are summed
+        return pd.DataFrame(stages).groupby('name', sort=False)[['wall_time', 'cpu_time', 'traced_peak_memory',
+                                                                 'rows_in', 'rows_out']].agg(
+            {'wall_time': 'sum', 'cpu_time': 'sum', 'traced_peak_memory': 'max', 'rows_in': 'first',
+             'rows_out': 'first'})
+
+    table = by_stage(result['stages'])
+    if previous is not None:
+        table['vs_previous'] = table['wall_time'] / by_stage(previous['stages'])['wall_time']
+    return table
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the longevity pipeline on synthetic data-sets')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='approximate numbers of EasyShare rows')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='where generated data-sets are kept')
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help='json lines file where results are appended')
+    parser.add_argument('--no-trace-memory', dest='trace_memory', action='store_false',
+                        help='do not measure the peak memory of each stage (faster, only the process peak)')
+    parser.add_argument('--compare-rowwise', action='store_true',
+                        help='also time the cleaning against the row-wise reference implementation (slow)')
+    args = parser.parse_args()
+
+    previous = last_results(args.results)
+    environment = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+    for rows in args.rows:
+        paths = dataset_paths(rows, args.seed, args.data_dir)
+        result = {
+            'rows': rows,
+            'seed': args.seed,
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'trace_memory': args.trace_memory,
+            **environment,
+            **_run_in_fresh_process(paths, args.trace_memory)
+        }
+        if args.compare_rowwise:
+            result['cleaning'] = time_cleaning(*paths)
+        with open(args.results, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+        if result['peak_memory'] is not None:
+            print('rows: {}, peak memory: {:.1f} MB'.format(rows, result['peak_memory'] / 2 ** 20))
+        if 'cleaning' in result:
+            print('cleaning: {vectorized:.2f}s vectorized, {rowwise:.2f}s row-wise, speedup: {speedup:.1f}'.format(
+                **result['cleaning']))
+        print(summary(result, previous.get(rows)).to_string(), end='\n\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Startup benchmark of the scoring of lifetime estimates. Each run is a fresh
+interpreter, as on short-lived workers: it either imports longevity.estimates, or
+imports longevity.scoring, loads a scoring artifact and computes one estimate. The
+artifact is exported from an estimator fitted on a synthetic SHARE-like data-set,
+and the results are appended as json lines to a results file (benchmarks/startup_results.jsonl
+by default, which is not tracked). It runs as a module from the root of the repository, so that
+the longevity and benchmarks packages are importable:
+
+    python -m benchmarks.startup --repeat 10
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.run import DEFAULT_DATA_DIR, dataset_paths, git_commit
+
+DEFAULT_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_results.jsonl')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# modules a scoring process is expected not to import
+HEAVY_MODULES = ['pandas', 'scipy', 'sklearn']
+
+SCENARIOS = {
+    'import_estimates': 'import longevity.estimates',
+    # the cost of the fitting path, which imports sklearn (as importing longevity.estimates used to)
+    'build_hazard_model': 'from longevity.estimates import LongevityEstimator\n'
+                          'LongevityEstimator.build_hazard_model()',
+    'score': 'from longevity.scoring import load_artifact, score\n'
+             'score(load_artifact({artifact!r}), "female", 5)',
+}
+# the scenario the wall times are relative to
+BASELINE = 'build_hazard_model'
+REPORT = ('\nimport json, sys\n'
+          'print(json.dumps([module for module in {heavy!r} if module in sys.modules]))')
+
+
+def export_artifact(rows: int, seed: int, data_dir: str, path: str) -> None:
+    """
+    Fit an estimator on a synthetic data-set and export its scoring artifact
+    :param rows: the approximate number of EasyShare rows
+    :param seed: the seed of the synthetic data-set
+    :param data_dir: where generated data-sets are kept
+    :param path: destination path of the artifact
+    """
+    from longevity.data_manager import DataManager
+    from longevity.estimates import LongevityEstimator
+
+    dm = DataManager(*dataset_paths(rows, seed, data_dir), verbose=False)
+    df, panel_df = dm.prepare_dataset_and_panel()
+    LongevityEstimator(df, panel_df, 'female', 5).export_scoring_artifact(path)
+
+
+def time_startup(code: str, repeat: int) -> Dict[str, Any]:
+    """
+    Run some code in fresh interpreters
+    :param code: the code to run
+    :param repeat: the number of runs
+    :return: the wall time of each run and the heavy modules the code imported
+    """
+    wall_times: List[float] = []
+    for _ in range(repeat):
+        wall_time = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code + REPORT.format(heavy=HEAVY_MODULES)],
+                                check=True, capture_output=True, text=True, cwd=ROOT).stdout
+        wall_times.append(time.perf_counter() - wall_time)
+    return {'wall_times': wall_times, 'heavy_modules': json.loads(output.splitlines()[-1])}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the startup of the scoring of lifetime estimates')
+    parser.add_argument('--rows', type=int, default=10000, help='approximate number of EasyShare rows of the model')
+    parser.add_argument('--repeat', type=int, default=10, help='fresh interpreters per scenario')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='where generated data-sets are kept')
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help='json lines file where results are appended')
+    args = parser.parse_args()
+
+    environment = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        artifact = os.path.join(directory, 'hazard.json')
+        export_artifact(args.rows, args.seed, args.data_dir, artifact)
+        runs = {name: time_startup(code.format(artifact=artifact), args.repeat) for name, code in SCENARIOS.items()}
+
+    baseline = np.median(runs[BASELINE]['wall_times'])
+    for name, run in runs.items():
+        result = {
+            'scenario': name,
+            'rows': args.rows,
+            'repeat': args.repeat,
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            **environment,
+            'wall_time': float(np.median(run['wall_times'])),
+            'wall_time_min': min(run['wall_times']),
+            'relative': float(np.median(run['wall_times']) / baseline),
+            'heavy_modules': run['heavy_modules'],
+        }
+        with open(args.results, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+        print('{}: {:.3f}s (median of {}), {:.0%} of {}, heavy modules: {}'.format(
+            name, result['wall_time'], args.repeat, result['relative'], BASELINE,
+            ', '.join(run['heavy_modules']) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
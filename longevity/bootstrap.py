@@ -0,0 +1,166 @@
+import os
+import tempfile
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from longevity import cache
+from longevity.estimates import GENDERS, HAZARD_FEATURES, LongevityEstimator
+from longevity.prevalence import PREVALENCE_MAX_AGE
+
+# the only columns LongevityEstimator.compute_grid_estimates reads, and so the only ones shared with the workers
+DF_COLUMNS = ['mergeid', 'age', 'income_dcl', 'disabled', 'is_aged']
+PANEL_COLUMNS = ['mergeid'] + HAZARD_FEATURES + ['y']
+
+# state of a worker process, set once by _init_worker
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(directory: str, genders: Sequence[str], income_dcls: Sequence[int], ages: Sequence[int],
+                 coeffs: Optional[dict], settings: Dict[str, Any]) -> None:
+    """
+    Memory map the base data written by the parent process, so that it is shared
+    by all the workers rather than pickled to each of them
+    :param directory: directory containing the df and panel frames saved with longevity.cache.save_frame
+    :param genders: the genders of the grid
+    :param income_dcls: the income deciles of the grid
+    :param ages: the ages of the grid
+    :param coeffs: optionally the coefficients of the LR
+    :param settings: the other keyword arguments of compute_grid_estimates (prevalence_max_age,
+                     smooth_prevalence and hazard_model), the same as for the point estimates
+    """
+    df = cache.load_frame(os.path.join(directory, 'df'))
+    panel_df = cache.load_frame(os.path.join(directory, 'panel'))
+    _worker.update(
+        df=df.drop(columns='cluster'),
+        df_clusters=df['cluster'].to_numpy(),
+        panel_df=panel_df.drop(columns='cluster'),
+        panel_clusters=panel_df['cluster'].to_numpy(),
+        clusters=int(df['cluster'].max()) + 1,
+        genders=genders,
+        income_dcls=income_dcls,
+        ages=ages,
+        coeffs=coeffs,
+        settings=settings,
+        # the model of a resampled panel is never reused, a disabled cache does not hash nor keep it
+        model_cache=cache.ModelCache(maxsize=0)
+    )
+
+
+def resample_clusters(df: pd.DataFrame, clusters: np.array, counts: np.array) -> pd.DataFrame:
+    """
+    Build a cluster bootstrap sample of a dataframe: all the rows of each cluster
+    are repeated as many times as the cluster was drawn
+    :param df: the dataframe to resample
+    :param clusters: the cluster (0 to n - 1) of each row of df
+    :param counts: the number of times each cluster was drawn
+    :return: the resampled dataframe
+    """
+    return df.take(np.repeat(np.arange(len(df)), counts[clusters]))
+
+
+def _replicate(seed: np.random.SeedSequence) -> np.array:
+    """
+    Compute one bootstrap replicate of the grid estimates in a worker process
+    :param seed: the seed of the replicate
+    :return: the mean remaining lifetime, in the row order of compute_grid_estimates
+    """
+    rng = np.random.default_rng(seed)
+    n = _worker['clusters']
+    counts = np.bincount(rng.integers(0, n, n), minlength=n)
+    df = resample_clusters(_worker['df'], _worker['df_clusters'], counts)
+    panel_df = resample_clusters(_worker['panel_df'], _worker['panel_clusters'], counts)
+    estimates = LongevityEstimator.compute_grid_estimates(df, panel_df, _worker['genders'], _worker['income_dcls'],
+                                                          _worker['coeffs'], _worker['ages'],
+                                                          model_cache=_worker['model_cache'], **_worker['settings'])
+    return estimates['mean'].to_numpy()
+
+
+def _intervals(estimates: pd.DataFrame, replicates: np.array, confidence: float) -> pd.DataFrame:
+    """
+    Add the percentile intervals of the bootstrap replicates to the point estimates. A replicate
+    can have no estimate (NaN) for a row, e.g. when its resample leaves a prevalence cell with only
+    disabled observations, the intervals of a row are computed on its valid replicates only
+    :param estimates: the point estimates, as returned by compute_grid_estimates
+    :param replicates: the replicates computed so far (replicates x rows of estimates)
+    :param confidence: the confidence level of the intervals
+    :return: the point estimates with the lower and upper bounds and the number of valid replicates of each row
+    """
+    tail = (1 - confidence) / 2 * 100
+    with warnings.catch_warnings():
+        # rows without any valid replicate have NaN bounds
+        warnings.simplefilter('ignore', RuntimeWarning)
+        lower, upper = np.nanpercentile(replicates, [tail, 100 - tail], axis=0)
+    return estimates.assign(lower=lower, upper=upper, replicates=np.isfinite(replicates).sum(axis=0))
+
+
+def bootstrap_lifetime_estimates(df: pd.DataFrame, panel_df: pd.DataFrame, replicates: int = 1000,
+                                 confidence: float = 0.95, genders: Optional[Sequence[str]] = None,
+                                 income_dcls: Optional[Sequence[int]] = None, coeffs: dict = None, seed: int = 0,
+                                 workers: Optional[int] = None, report_every: int = 50,
+                                 prevalence_max_age: Optional[int] = PREVALENCE_MAX_AGE,
+                                 smooth_prevalence: bool = False, hazard_model: Any = None) -> Iterator[pd.DataFrame]:
+    """
+    Compute bootstrap confidence intervals of the healthy and total life expectancy of every
+    (gender, income_dcl) subgroup. Each replicate resamples individuals (mergeid clusters) with
+    replacement from both df and panel_df, refits the hazard model and recomputes the estimates.
+    Replicates run on a process pool: the base data is written once to a temporary directory and
+    memory mapped by the workers. Replicate i always uses the i-th seed spawned from `seed`, so the
+    final intervals do not depend on the number of workers or on the order replicates finish in
+    :param df: a dataframe resulting from a call to longevity.DataManager.prepare_dataset
+    :param panel_df: a dataframe resulting from a call to longevity.DataManager.create_panel_dataset on df
+    :param replicates: the number of bootstrap replicates
+    :param confidence: the confidence level of the percentile intervals
+    :param genders: the genders of the grid, "male" and "female" by default
+    :param income_dcls: the income deciles of the grid, all the deciles in df by default
+    :param coeffs: optionally pass the coefficients of the LR
+    :param seed: the seed from which the seed of each replicate is spawned
+    :param workers: the number of worker processes, all the cores by default
+    :param report_every: the number of finished replicates between two yielded results
+    :param prevalence_max_age: disability is only measured on observations younger than this age
+    :param smooth_prevalence: whether to smooth the disability prevalence curves (see PrevalenceTable.smoothed)
+    :param hazard_model: optionally, the (unfitted) hazard model (see LongevityEstimator), `build_hazard_model`
+                         by default
+    :return: a generator of dataframes, as returned by compute_grid_estimates with the lower and upper
+             bounds of the mean and the number of valid replicates they are based on. The last one uses
+             all the replicates
+    """
+    settings = {'prevalence_max_age': prevalence_max_age, 'smooth_prevalence': smooth_prevalence,
+                'hazard_model': hazard_model}
+    genders = GENDERS if genders is None else list(genders)
+    if income_dcls is None:
+        income_dcls = np.sort(df.income_dcl.dropna().unique())
+    income_dcls = [int(income_dcl) for income_dcl in income_dcls]
+    # the grid is fixed on the full sample, a replicate may miss the youngest or the oldest ages
+    ages = list(range(int(df.age.min()), int(df.age.max()) + 1))
+    estimates = LongevityEstimator.compute_grid_estimates(df, panel_df, genders, income_dcls, coeffs, ages, **settings)
+
+    ids = pd.Index(df['mergeid'].unique())
+    seeds = np.random.SeedSequence(seed).spawn(replicates)
+    results = np.empty((replicates, len(estimates)))
+    finished = np.zeros(replicates, dtype=bool)
+    done = 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache.save_frame(df[DF_COLUMNS].reset_index(drop=True).assign(cluster=ids.get_indexer(df['mergeid'])),
+                         os.path.join(directory, 'df'))
+        cache.save_frame(panel_df[PANEL_COLUMNS].reset_index(drop=True).assign(
+            cluster=ids.get_indexer(panel_df['mergeid'])), os.path.join(directory, 'panel'))
+
+        executor = ProcessPoolExecutor(workers, initializer=_init_worker,
+                                       initargs=(directory, genders, income_dcls, ages, coeffs, settings))
+        try:
+            futures = {executor.submit(_replicate, replicate_seed): i for i, replicate_seed in enumerate(seeds)}
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                finished[i] = True
+                done += 1
+                if done % report_every == 0 or done == replicates:
+                    yield _intervals(estimates, results[finished], confidence)
+        finally:
+            # stop the pending replicates if the caller stops iterating early
+            executor.shutdown(cancel_futures=True)
@@ -0,0 +1,517 @@
+import copy
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+FRAME_FORMAT_VERSION = 2
+HASH_CHUNK_SIZE = 1 << 24
+
+
+def _atomic_write_json(obj: Any, path: str) -> None:
+    """
+    Write a json file atomically, so that concurrent readers never see a partial file
+    :param obj: the object to serialize
+    :param path: destination path
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def content_hash(path: str) -> str:
+    """
+    Compute the sha256 of the content of a file, reading it in chunks
+    :param path: path of the file
+    :return: the hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path: str, cache_dir: str) -> Dict[str, Any]:
+    """
+    Fingerprint a source file by path, size, mtime and content hash. The
+    content hash is remembered in `cache_dir` for a given (path, size, mtime),
+    so unchanged files are not read again
+    :param path: path of the file
+    :param cache_dir: directory where known content hashes are stored
+    :return: a dictionary with the path, size, mtime and sha256 of the file
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    fingerprint = {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+    index_path = os.path.join(cache_dir, 'file_hashes.json')
+    try:
+        with open(index_path) as f:
+            known = json.load(f)
+    except (OSError, ValueError):
+        known = {}
+
+    entry = known.get(path)
+    if entry is not None and entry['size'] == fingerprint['size'] and entry['mtime'] == fingerprint['mtime']:
+        fingerprint['sha256'] = entry['sha256']
+        return fingerprint
+
+    fingerprint['sha256'] = content_hash(path)
+    known[path] = fingerprint
+    _atomic_write_json(known, index_path)
+    return fingerprint
+
+
+def dataset_key(paths: Sequence[str], cache_dir: str, **params: Any) -> str:
+    """
+    Compute the cache key of a dataset built from a set of source files
+    :param paths: the source files of the dataset
+    :param cache_dir: directory where known content hashes are stored
+    :param params: any other parameter the dataset depends on (must be json serializable)
+    :return: a hex key identifying the dataset
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    description = {
+        'format': FRAME_FORMAT_VERSION,
+        'files': [file_fingerprint(path, cache_dir) for path in paths],
+        'params': params,
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def _to_json_value(value: Any) -> Any:
+    """
+    Convert numpy scalars to their python equivalent so that they can be json serialized
+    """
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _save_array(values: pd.Series, directory: str, name: str) -> Dict[str, Any]:
+    """
+    Save a column as one (or two, if it has a mask) `.npy` files
+    :param values: the column to save
+    :param directory: destination directory
+    :param name: file name stem of the column
+    :return: the schema entry describing how to load the column back
+    """
+    dtype = values.dtype
+    entry = {'name': _to_json_value(values.name), 'dtype': str(dtype)}
+
+    if isinstance(dtype, pd.CategoricalDtype):
+        entry['kind'] = 'categorical'
+        entry['ordered'] = bool(dtype.ordered)
+        entry['categories'] = [_to_json_value(c) for c in dtype.categories]
+        entry['categories_dtype'] = str(dtype.categories.dtype)
+        np.save(os.path.join(directory, name + '.npy'), values.cat.codes.to_numpy())
+    elif isinstance(dtype, np.dtype) and dtype.kind in 'biufcmM':
+        entry['kind'] = 'numpy'
+        np.save(os.path.join(directory, name + '.npy'), values.to_numpy())
+    elif isinstance(dtype, pd.api.extensions.ExtensionDtype) and dtype.kind in 'biuf':
+        # nullable (masked) arrays: the values, with missing values zeroed, and the mask
+        entry['kind'] = 'masked'
+        mask = values.isna().to_numpy()
+        np.save(os.path.join(directory, name + '.npy'), values.to_numpy(dtype=dtype.numpy_dtype, na_value=0))
+        np.save(os.path.join(directory, name + '.mask.npy'), mask)
+    elif pd.api.types.infer_dtype(values, skipna=True) in ('string', 'empty'):
+        # fixed width unicode arrays can be memory mapped, missing values are kept in a mask
+        entry['kind'] = 'string'
+        mask = values.isna().to_numpy()
+        np.save(os.path.join(directory, name + '.npy'), values.fillna('').to_numpy().astype('U'))
+        np.save(os.path.join(directory, name + '.mask.npy'), mask)
+    else:
+        entry['kind'] = 'object'
+        np.save(os.path.join(directory, name + '.npy'), values.to_numpy(dtype=object), allow_pickle=True)
+    return entry
+
+
+def _load_array(entry: Dict[str, Any], directory: str, name: str, mmap: bool) -> pd.Series:
+    """
+    Load a column saved with `_save_array`
+    :param entry: the schema entry of the column
+    :param directory: directory containing the column files
+    :param name: file name stem of the column
+    :param mmap: whether to memory map the column files
+    :return: the column as a pd.Series
+    """
+    path = os.path.join(directory, name + '.npy')
+
+    def load(file_path):
+        # plain ndarray views over the memory map, pandas does not expect np.memmap instances
+        return np.load(file_path, mmap_mode='r' if mmap else None).view(np.ndarray)
+
+    if entry['kind'] == 'categorical':
+        categories = pd.Index(entry['categories'], dtype=entry['categories_dtype'])
+        values = pd.Categorical.from_codes(load(path), categories=categories,
+                                           ordered=entry['ordered'])
+    elif entry['kind'] == 'numpy':
+        values = load(path)
+    elif entry['kind'] == 'masked':
+        array_type = pd.api.types.pandas_dtype(entry['dtype']).construct_array_type()
+        values = array_type(load(path), load(os.path.join(directory, name + '.mask.npy')))
+    elif entry['kind'] == 'string':
+        values = load(path).astype(object)
+        values[np.load(os.path.join(directory, name + '.mask.npy'))] = np.nan
+        values = pd.array(values, dtype=entry['dtype'])
+    else:
+        values = np.load(path, allow_pickle=True)
+    return pd.Series(values, name=entry['name'], copy=False)
+
+
+def save_frame(df: pd.DataFrame, directory: str, replace: bool = True) -> None:
+    """
+    Save a DataFrame in a columnar binary format: one `.npy` file per column
+    plus a json schema. The directory is written atomically
+    :param df: the DataFrame to save
+    :param directory: destination directory
+    :param replace: whether to replace the destination directory if it exists. Caches keyed on the
+                    content pass False: another writer has then saved the same frame, which is kept
+    """
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp_directory = tempfile.mkdtemp(dir=parent, suffix='.tmp')
+
+    index = df.index.to_series(index=pd.RangeIndex(len(df)))
+    schema = {
+        'format': FRAME_FORMAT_VERSION,
+        'rows': len(df),
+        'index': None if df.index.equals(pd.RangeIndex(len(df))) else _save_array(index, tmp_directory, 'index'),
+        'columns': [_save_array(df.iloc[:, i], tmp_directory, str(i)) for i in range(df.shape[1])],
+    }
+    with open(os.path.join(tmp_directory, 'schema.json'), 'w') as f:
+        json.dump(schema, f)
+
+    _publish_directory(tmp_directory, directory, replace)
+
+
+def _publish_directory(tmp_directory: str, directory: str, replace: bool) -> None:
+    """
+    Move a fully written temporary directory to its destination. Readers never see a partial directory
+    :param tmp_directory: the written directory
+    :param directory: its destination
+    :param replace: whether an existing destination is replaced (it is moved aside, the written
+                    directory is moved in and the old one is removed) or kept, discarding the written one
+    """
+    try:
+        os.rename(tmp_directory, directory)
+        return
+    except OSError:
+        # renaming onto a non-empty directory fails
+        if not os.path.isdir(directory):
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+            raise
+    if not replace:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        return
+
+    old_directory = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(directory)), suffix='.old')
+    os.rename(directory, os.path.join(old_directory, 'old'))
+    os.rename(tmp_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+
+
+def load_frame(directory: str, mmap: bool = True) -> pd.DataFrame:
+    """
+    Load a DataFrame saved with `save_frame`. With `mmap`, numeric columns
+    and category codes are memory mapped (read-only) rather than read
+    :param directory: directory written by `save_frame`
+    :param mmap: whether to memory map the column files
+    :return: the DataFrame
+    """
+    with open(os.path.join(directory, 'schema.json')) as f:
+        schema = json.load(f)
+
+    columns: List[pd.Series] = [_load_array(entry, directory, str(i), mmap) for i, entry in
+                                enumerate(schema['columns'])]
+    # build the frame column by column so that memory mapped arrays are not consolidated (i.e. copied)
+    df = pd.DataFrame({i: column for i, column in enumerate(columns)}, index=pd.RangeIndex(schema['rows']), copy=False)
+    df.columns = [entry['name'] for entry in schema['columns']]
+    if schema['index'] is not None:
+        df.index = pd.Index(_load_array(schema['index'], directory, 'index', mmap), name=schema['index']['name'])
+    return df
+
+
+def frame_fingerprint(*frames: Any) -> str:
+    """
+    Fingerprint the content of some DataFrames or Series (values, dtypes and column
+    names, not the index), so that equal data gets the same fingerprint whatever object holds it
+    :param frames: the DataFrames or Series
+    :return: a hex digest of their content
+    """
+    digest = hashlib.sha256()
+    for frame in frames:
+        frame = frame.to_frame() if isinstance(frame, pd.Series) else frame
+        digest.update(json.dumps([[str(name), str(dtype)] for name, dtype in frame.dtypes.items()]).encode())
+        digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _source_hash(function: Callable) -> str:
+    """
+    Hash the source of a function, or its bytecode and constants when the source is not available
+    """
+    try:
+        code = inspect.getsource(function).encode()
+    except (OSError, TypeError):
+        code = function.__code__.co_code + repr(function.__code__.co_consts).encode()
+    return hashlib.sha256(code).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _file_hash(path: str) -> str:
+    """
+    Hash the content of a source file
+    """
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def code_version(function: Callable) -> str:
+    """
+    Version a function by its code and by the source of its module, so that cached outputs are
+    invalidated when the function, the helpers it calls or the constants it reads in the same module
+    (e.g. the SCHEMA of longevity.data_manager) are edited. Functions of other modules are not hashed
+    :param function: a function, or a bound method
+    :return: a hex digest of the code of the function and of its module
+    """
+    # a bound method is versioned by its function, the cache does not keep the instance alive
+    function = getattr(function, '__func__', function)
+    try:
+        module = _file_hash(inspect.getsourcefile(function))
+    except (OSError, TypeError):
+        module = None
+    return hashlib.sha256(json.dumps([_source_hash(function), module]).encode()).hexdigest()
+
+
+def model_config(model: Any) -> Dict[str, str]:
+    """
+    Describe the configuration of a sklearn-like (unfitted) model by its deep parameters,
+    nested models and functions being described by their qualified name, so that the
+    description is the same in every process
+    :param model: a model implementing get_params
+    :return: a json serializable description of the model
+    """
+    def describe(value):
+        if hasattr(value, 'get_params'):
+            return type(value).__module__ + '.' + type(value).__qualname__
+        if callable(value) and hasattr(value, '__qualname__'):
+            return value.__module__ + '.' + value.__qualname__
+        return repr(value)
+
+    config = {name: describe(value) for name, value in model.get_params(deep=True).items() if name != 'steps'}
+    config['class'] = describe(model)
+    library = sys.modules.get(type(model).__module__.split('.')[0])
+    config['version'] = str(getattr(library, '__version__', None))
+    return config
+
+
+class ModelCache:
+    """
+    Cache of fitted models, keyed on the fingerprint of the training data and the
+    configuration of the model. Models are kept in an in-process LRU and, optionally,
+    pickled in a directory so that they are reused by later runs
+    """
+
+    def __init__(self, maxsize: int = 32, directory: Optional[str] = None):
+        """
+        Initialize a ModelCache object. Without any model kept in memory nor directory, the
+        cache is disabled: every fit is a miss and the training data is not even fingerprinted
+        :param maxsize: the number of fitted models kept in memory
+        :param directory: optionally, a directory where fitted models are stored
+        """
+        self.maxsize = maxsize
+        self.directory = directory
+        self.models: OrderedDict = OrderedDict()
+        self.hits = self.misses = 0
+
+    def key(self, model: Any, X: pd.DataFrame, y: pd.Series) -> str:
+        """
+        Compute the cache key of a model fitted on some data
+        :param model: the unfitted model
+        :param X: the features
+        :param y: the target
+        :return: a hex key
+        """
+        description = {'data': frame_fingerprint(X, y), 'model': model_config(model)}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def _remember(self, key: str, model: Any) -> None:
+        """
+        Keep a fitted model in memory, evicting the least recently used ones
+        """
+        self.models[key] = model
+        self.models.move_to_end(key)
+        while len(self.models) > self.maxsize:
+            self.models.popitem(last=False)
+
+    def fit(self, model: Any, X: pd.DataFrame, y: pd.Series) -> Any:
+        """
+        Get a copy of `model` fitted on X and y, fitting it only if it is not cached.
+        The returned model is shared with other callers and must not be refitted
+        :param model: the unfitted model, left untouched
+        :param X: the features
+        :param y: the target
+        :return: the fitted model
+        """
+        if not self.maxsize and not self.directory:
+            self.misses += 1
+            return copy.deepcopy(model).fit(X, y)
+        key = self.key(model, X, y)
+        if key in self.models:
+            self.hits += 1
+            self.models.move_to_end(key)
+            return self.models[key]
+
+        path = os.path.join(self.directory, key + '.pkl') if self.directory else None
+        if path and os.path.exists(path):
+            self.hits += 1
+            with open(path, 'rb') as f:
+                fitted = pickle.load(f)
+        else:
+            self.misses += 1
+            fitted = copy.deepcopy(model).fit(X, y)
+            if path:
+                os.makedirs(self.directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(fitted, f)
+                # the key depends only on the content, an existing model was stored by another writer
+                if os.path.exists(path):
+                    os.remove(tmp_path)
+                else:
+                    os.replace(tmp_path, path)
+        self._remember(key, fitted)
+        return fitted
+
+    def clear(self) -> None:
+        """
+        Forget the models kept in memory (the ones stored in the directory are kept)
+        """
+        self.models.clear()
+
+
+class StageCache:
+    """
+    Cache of the outputs of the stages of a pipeline (e.g. DataManager.prepare_dataset). The key
+    of a stage chains the key of the previous stage (or the fingerprint of the input) with the
+    name and the parameters of the stage, so that runs with different parameters share the
+    stages before the first one whose parameters differ. Each output is stored with the events
+    (e.g. dropped rows) recorded by the stages up to it, so that they can be replayed on a hit.
+    Outputs are kept in an in-process LRU and, optionally, in a directory in the columnar
+    format of `save_frame`, so that they are reused by later runs
+    """
+
+    def __init__(self, maxsize: int = 16, directory: Optional[str] = None):
+        """
+        Initialize a StageCache object
+        :param maxsize: the number of stage outputs kept in memory
+        :param directory: optionally, a directory where stage outputs are stored
+        """
+        self.maxsize = maxsize
+        self.directory = directory
+        self.outputs: OrderedDict = OrderedDict()
+        self.hits = self.misses = 0
+        # one entry per stage looked up: its name, key and whether it was a 'hit' or a 'miss'
+        self.lookups: List[Dict[str, str]] = []
+
+    @staticmethod
+    def chain_key(key: str, name: str, params: Sequence[Any] = (), function: Optional[Callable] = None) -> str:
+        """
+        Compute the key of a stage
+        :param key: the key of the previous stage, or the fingerprint of the input of the first one
+        :param name: the name of the stage
+        :param params: the parameters of the stage
+        :param function: optionally, the function of the stage, whose code and module are part of the key (see
+                         `code_version`) so that editing them invalidates the stage and the following ones
+        :return: a hex key
+        """
+        description = [key, name, [_to_json_value(param) for param in params], FRAME_FORMAT_VERSION,
+                       code_version(function) if function is not None else None]
+        return hashlib.sha256(json.dumps(description).encode()).hexdigest()
+
+    def _remember(self, key: str, output: Any) -> None:
+        """
+        Keep a stage output in memory, evicting the least recently used ones
+        """
+        self.outputs[key] = output
+        self.outputs.move_to_end(key)
+        while len(self.outputs) > self.maxsize:
+            self.outputs.popitem(last=False)
+
+    def get(self, key: str, name: str) -> Optional[Tuple[pd.DataFrame, List[tuple]]]:
+        """
+        Get the output of a stage, if it is cached. Only hits are counted, the stages which
+        are then computed are counted with `miss`
+        :param key: the key of the stage
+        :param name: the name of the stage, for the report
+        :return: the output of the stage and the events recorded up to it, None if it is not cached
+        """
+        output = self.outputs.get(key)
+        path = os.path.join(self.directory, key) if self.directory else None
+        if output is None and path and os.path.isdir(path):
+            with open(os.path.join(path, 'events.json')) as f:
+                events = [tuple(event[:3]) + (tuple(event[3]),) if event[0] == 'drop' else tuple(event)
+                          for event in json.load(f)]
+            output = (load_frame(os.path.join(path, 'frame')), events)
+        if output is None:
+            return None
+
+        self.hits += 1
+        self.lookups.append({'stage': name, 'key': key, 'status': 'hit'})
+        self._remember(key, output)
+        # a shallow copy, so that assigning columns does not change the cached frame
+        return output[0].copy(deep=False), list(output[1])
+
+    def miss(self, key: str, name: str) -> None:
+        """
+        Count a stage which is not cached and has to be computed
+        :param key: the key of the stage
+        :param name: the name of the stage, for the report
+        """
+        self.misses += 1
+        self.lookups.append({'stage': name, 'key': key, 'status': 'miss'})
+
+    def put(self, key: str, df: pd.DataFrame, events: List[tuple]) -> None:
+        """
+        Store the output of a stage
+        :param key: the key of the stage
+        :param df: the output of the stage, its values must not be modified in place afterwards
+        :param events: the events recorded up to the stage
+        """
+        self._remember(key, (df.copy(deep=False), list(events)))
+        if self.directory:
+            path = os.path.join(self.directory, key)
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = tempfile.mkdtemp(dir=self.directory, suffix='.tmp')
+            save_frame(df, os.path.join(tmp_path, 'frame'))
+            with open(os.path.join(tmp_path, 'events.json'), 'w') as f:
+                json.dump([[_to_json_value(value) for value in event[:3]] + [
+                    [_to_json_value(value) for value in event[3]] if event[0] == 'drop' else _to_json_value(event[3])]
+                    for event in events], f)
+            # the key depends only on the content, an existing output was saved by another writer
+            _publish_directory(tmp_path, path, replace=False)
+
+    def report(self) -> pd.DataFrame:
+        """
+        Report the lookups of stages
+        :return: a DataFrame with the stage, key and status ('hit' or 'miss') of every lookup
+        """
+        return pd.DataFrame(self.lookups, columns=['stage', 'key', 'status'])
+
+    def clear(self) -> None:
+        """
+        Forget the outputs kept in memory (the ones stored in the directory are kept)
+        """
+        self.outputs.clear()
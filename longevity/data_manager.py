@@ -1,6 +1,234 @@
+import contextlib
+import functools
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import numpy as np
-from tqdm import tqdm
+from pandas.api.types import union_categoricals
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
+
+from longevity import cache
+from longevity.cache import StageCache
+from longevity.profiling import Profiler, StageRecord
+
+# subset of columns used from the EasyShare and the cover screens data-sets
+COLUMNS = ['mergeid', 'wave', 'country', 'female', 'age', 'adla', 'income_pct_w1', 'income_pct_w2',
+           'income_pct_w4', 'income_pct_w5', 'income_pct_w6', 'int_year', 'thinc_m', 'dn004_mod']
+DEATH_COLUMNS = ['deceased_age']
+
+# compact dtypes of the columns of the data-set, every step of the pipeline keeps to this schema
+SCHEMA = {
+    # raw columns
+    'mergeid': 'category',
+    'wave': 'int8',
+    'country': 'category',
+    'female': 'category',
+    'age': 'float64',
+    'adla': 'int8',
+    'int_year': 'int16',
+    'thinc_m': 'float64',
+    'dn004_mod': 'category',
+    'deceased_age': 'Int16',
+    # derived columns
+    'deceased_status': 'category',
+    'gender': 'category',
+    'gender_num': 'int8',
+    'disabled': 'int8',
+    'income_dcl': 'Int8',
+    'income': 'float64',
+    'deceased_age_int': 'Int32',
+    'age_int': 'Int16',
+    'born_in_country': 'bool',
+    'is_dead': 'int8',
+    'is_aged': 'Int16',
+    'y': 'int8',
+}
+
+# values of `deceased_status`: the numeric `deceased_age` is only set for the deceased
+DECEASED = 'Deceased'
+ALIVE = 'Not applicable'
+
+# message logged when rows are dropped, by reason (None when the drop is not logged)
+DROP_MESSAGES = {
+    'excluded_country': None,
+    'missing_age': 'We drop {} observations because there is no information about age',
+    'below_start_age': 'We drop {} observations because they are younger than {} years old',
+    'above_end_age': 'We drop {} observations because they are older than {} years old',
+    'missing_adla': 'We drop {} observations because there is no information about adla',
+    'missing_thinc_m': None,
+    'missing_income': 'We drop {} observations because there is no information about income',
+    'missing_deceased_age': 'We drop {} observations because there is no information about their deceased age',
+    'deceased_before_interview': 'We drop {} observations because their age at death is less than their age at '
+                                 'interview',
+    'missing_birthplace': 'We drop {} observations because there is no information about where they were born',
+    'immigrant': 'We drop {} observations because there where not born in the country',
+}
+
+
+def _recode(series: pd.Series, func: Callable[[pd.Series], pd.Series], categorical: bool = False) -> pd.Series:
+    """
+    Apply a column-wise transformation to a series. Categorical columns (as
+    returned by `pd.read_stata`) are transformed on their categories only
+    and the result is then gathered through the category codes
+    :param series: the series to transform
+    :param func: a vectorized function taking and returning a series
+    :param categorical: whether to return a categorical series
+    :return: the transformed series, aligned with the input
+    """
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        recoded = func(series)
+        return recoded.astype('category') if categorical else recoded
+
+    # the extra trailing value is picked up by missing values (code -1)
+    distinct = pd.Series(np.append(series.cat.categories.to_numpy(dtype=object), np.nan))
+    recoded = func(distinct)
+    codes = series.cat.codes.to_numpy()
+    if categorical:
+        recoded_codes, categories = pd.factorize(recoded)
+        return pd.Series(pd.Categorical.from_codes(recoded_codes[codes], categories), index=series.index)
+    return pd.Series(recoded.to_numpy()[codes], index=series.index)
+
+
+def _to_numeric(series: pd.Series) -> pd.Series:
+    """
+    Convert a series to numbers, coded values such as '-15. no information' become missing
+    :param series: the series to convert
+    :return: a float series
+    """
+    return _recode(series, lambda s: pd.to_numeric(s, errors='coerce').astype(float))
+
+
+def _apply_schema(df: pd.DataFrame, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Cast columns of a DataFrame to their dtype in `SCHEMA`
+    :param df: the DataFrame to cast
+    :param columns: the columns to cast (by default all the columns in `SCHEMA`)
+    :return: the DataFrame with compact dtypes
+    """
+    df = df.copy(deep=False)
+    for column in (columns or df.columns):
+        if column in SCHEMA and column in df and df[column].dtype != SCHEMA[column]:
+            df[column] = df[column].astype(SCHEMA[column])
+    return df
+
+
+def _drop_unused_categories(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Drop the categories no longer used by the rows left in a DataFrame (e.g. the mergeid of dropped individuals)
+    :param df: the DataFrame to compact
+    :return: the DataFrame with only the used categories
+    """
+    df = df.copy(deep=False)
+    for column in df.columns[df.dtypes == 'category']:
+        df[column] = df[column].cat.remove_unused_categories()
+    if isinstance(df.index, pd.CategoricalIndex):
+        df.index = df.index.remove_unused_categories()
+    return df
+
+
+def _stata_order(categories: pd.Index, value_labels: Dict[str, Dict[int, str]]) -> Optional[List[Any]]:
+    """
+    Sort the categories of a labelled Stata column by their Stata code, as `pd.read_stata` does
+    when it reads the whole file: unlabelled values are their own code, labels are looked up in
+    the value label set which has all of them
+    :param categories: the categories of the column
+    :param value_labels: the value label sets of the file, as returned by StataReader.value_labels
+    :return: the sorted categories, None if the code of a category is not known
+    """
+    labels = [category for category in categories if isinstance(category, str)]
+    codes = {}
+    for value_label in value_labels.values():
+        inverse = {label: int(code) for code, label in value_label.items()}
+        if all(label in inverse for label in labels):
+            if codes and any(codes[label] != inverse[label] for label in labels):
+                # two label sets give different codes to the labels of the column
+                return None
+            codes = {label: inverse[label] for label in labels}
+    if len(codes) < len(labels):
+        return None
+    return sorted(categories, key=lambda category: codes[category] if isinstance(category, str) else category)
+
+
+def _concat_chunks(chunks: List[pd.DataFrame], value_labels: Optional[Dict[str, Dict[int, str]]] = None,
+                   release: bool = False) -> pd.DataFrame:
+    """
+    Concatenate the chunks of a Stata file. The categories of a labelled column
+    can differ from chunk to chunk, they are unioned instead of falling back
+    to an object column. Ordered categories stay ordered, in the order of the
+    Stata codes when the value labels are given, so that the result has the
+    dtypes `pd.read_stata` gives when it reads the whole file
+    :param chunks: the chunks to concatenate, all with the same columns
+    :param value_labels: optionally, the value label sets of the file (see `_stata_order`)
+    :param release: pop each column from the chunks once it is concatenated and empty the list at the end,
+                    so that the chunks are freed as the result is built rather than held next to it. The
+                    peak is then that of the chunks plus one concatenated column (the numerical columns of
+                    a chunk share a block, which is only freed with the last of them)
+    :return: the concatenated DataFrame
+    """
+    columns = {}
+    for column in list(chunks[0].columns):
+        parts = [chunk.pop(column) if release else chunk[column] for chunk in chunks]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            dtypes = {part.dtype for part in parts}
+            ordered = all(part.cat.ordered for part in parts)
+            if len({part.cat.categories.dtype for part in parts}) > 1:
+                # e.g. only labels in one chunk, labels and numbers in another one
+                parts = [pd.Categorical.from_codes(part.cat.codes, part.cat.categories.astype(object))
+                         for part in parts]
+            values = union_categoricals(parts, ignore_order=True)
+            if len(dtypes) == 1:
+                values = values.astype(dtypes.pop())
+            elif ordered:
+                order = _stata_order(values.categories, value_labels) if value_labels is not None else None
+                values = values.as_ordered() if order is None else values.set_categories(order, ordered=True)
+            columns[column] = values
+        else:
+            columns[column] = pd.concat(parts, ignore_index=True).array
+        del parts
+    index = chunks[0].index.append([chunk.index for chunk in chunks[1:]])
+    if release:
+        chunks.clear()
+    # without a copy, the concatenated columns are not consolidated into new blocks
+    return pd.DataFrame(columns, index=index, copy=False)
+
+
+def _trim_mergeid(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Drop the unused categories of the mergeid column and index of a partition of the data-set,
+    so that the identifiers of every individual are not pickled with each partition
+    :param df: a partition of the data-set
+    :return: the partition with only its own identifiers as categories
+    """
+    df = df.copy(deep=False)
+    df['mergeid'] = df['mergeid'].cat.remove_unused_categories()
+    if isinstance(df.index, pd.CategoricalIndex):
+        df.index = df.index.remove_unused_categories()
+    return df
+
+
+def _concat_partitions(partitions: List[pd.DataFrame], like: pd.DataFrame) -> pd.DataFrame:
+    """
+    Concatenate partitions of the data-set, restoring the mergeid categories of the full data-set
+    :param partitions: the partitions, with mergeid trimmed by `_trim_mergeid`
+    :param like: the data-set the partitions come from
+    :return: the concatenated DataFrame
+    """
+    # empty partitions are skipped, their columns may not have the same dtypes as the others
+    partitions = [partition for partition in partitions if len(partition)] or partitions[:1]
+    df = _concat_chunks(partitions) if len(partitions) > 1 else partitions[0].copy(deep=False)
+    # the categories shared by all the partitions keep their order and orderedness
+    for column in df.columns[df.dtypes == 'category']:
+        dtypes = {partition[column].dtype for partition in partitions}
+        if len(dtypes) == 1:
+            df[column] = df[column].astype(dtypes.pop())
+    categories = like['mergeid'].cat.categories
+    df['mergeid'] = df['mergeid'].cat.set_categories(categories)
+    # the panels have a RangeIndex, only the mergeid index of the cleaned partitions is recoded
+    if isinstance(like.index, pd.CategoricalIndex) and isinstance(partitions[0].index, pd.CategoricalIndex):
+        df.index = pd.CategoricalIndex(df.index, categories=like.index.categories, name=like.index.name)
+    return df
 
 
 class DataManager:
@@ -9,49 +237,158 @@ class DataManager:
     and feature engineering for the share data-set
     """
 
-    def __init__(self, easy_share_dta_path: str, share_death_dta_path: str, verbose: str = True) -> None:
+    def __init__(self, easy_share_dta_path: str, share_death_dta_path: str, verbose: str = True,
+                 cache_dir: Optional[str] = None, chunksize: Optional[int] = None,
+                 profiler: Optional[Profiler] = None, stage_cache: Optional[StageCache] = None) -> None:
         """
         Initialize the DataManager object
         :param easy_share_dta_path: path to the EasyShare dataset
         :param share_death_dta_path: path to the Share cover screens dataset
         :param verbose: parameter to control whether to print messages
+        :param cache_dir: optional directory where to cache the merged data-set (see `read_dataset`)
+        :param chunksize: optionally stream the Stata files in chunks of this many rows (see `read_dataset`)
+        :param profiler: optionally record the time, memory and rows of each stage (see `longevity.profiling`)
+        :param stage_cache: optionally reuse the outputs of the steps of `prepare_dataset` across calls
         """
         self.verbose = verbose
-        self.df = DataManager.read_dataset(easy_share_dta_path, share_death_dta_path)
+        self.profiler = profiler
+        self.stage_cache = stage_cache
+        # drops and ranges recorded by the process_* steps, see `record_drop` and `record_range`
+        self.events: List[tuple] = []
+        with self.profiler.stage('read_dataset') if profiler is not None else contextlib.nullcontext() as record:
+            self.df = DataManager.read_dataset(easy_share_dta_path, share_death_dta_path, cache_dir=cache_dir,
+                                               chunksize=chunksize)
+            if record is not None:
+                record.rows_out = len(self.df)
+        # the steps of prepare_dataset rebind self.df, the cached pipeline starts again from the input
+        self.input_df = self.df if stage_cache is not None else None
+        self._input_key: Optional[str] = None
 
     @staticmethod
-    def read_dataset(easy_share_dta_path: str, share_death_dta_path: str) -> pd.DataFrame:
+    def read_dataset(easy_share_dta_path: str, share_death_dta_path: str, cache_dir: Optional[str] = None,
+                     chunksize: Optional[int] = None) -> pd.DataFrame:
         """
         Static method to read the share data-set
         :param easy_share_dta_path: path to the EasyShare data-set
         :param share_death_dta_path: path to the Share cover screens data-set
+        :param cache_dir: optional directory where to cache the merged data-set. The cache is keyed on the
+                          path, size, mtime and content hash of the two files and it is stored in a
+                          columnar format which is memory mapped when loaded (its columns are read-only)
+        :param chunksize: optionally stream the Stata files in chunks of this many rows, reading only the
+                          needed columns. The peak memory is then that of the merged chunks (which keep the
+                          mergeid as strings until they are compacted) plus one chunk of raw rows, or plus one
+                          concatenated column while the chunks are concatenated, rather than that of the whole
+                          Stata files
         :return: a DataFrame containing the share data-set (including deaths from the cover screens)
         """
-        # load the two datasets and set indeces
+        if cache_dir is not None:
+            key = cache.dataset_key([easy_share_dta_path, share_death_dta_path], cache_dir,
+                                    columns=COLUMNS, death_columns=DEATH_COLUMNS, schema=SCHEMA)
+            cached_path = os.path.join(cache_dir, key)
+            if os.path.isdir(cached_path):
+                return cache.load_frame(cached_path)
+            df = DataManager.read_dataset(easy_share_dta_path, share_death_dta_path, chunksize=chunksize)
+            cache.save_frame(df, cached_path, replace=False)
+            return df
+
+        if chunksize is not None:
+            return DataManager._read_dataset_in_chunks(easy_share_dta_path, share_death_dta_path, chunksize)
+
+        # merge the two datasets
+        df = pd.merge(DataManager.read_easy_share(easy_share_dta_path), DataManager.read_deaths(share_death_dta_path),
+                      how='left', left_index=True, right_index=True)
+        return DataManager._compact_raw_columns(df)
+
+    @staticmethod
+    def read_easy_share(easy_share_dta_path: str) -> pd.DataFrame:
+        """
+        Read the needed columns of the EasyShare data-set, without the deaths
+        :param easy_share_dta_path: path to the EasyShare data-set
+        :return: a DataFrame indexed by mergeid with the columns in `COLUMNS`
+        """
         df = pd.read_stata(easy_share_dta_path)
         df.index = df['mergeid']
+        df = df[COLUMNS]
+
+        # exclude wave 3 because there is no information about income and disability
+        return df[df['wave'] != 3]
 
+    @staticmethod
+    def read_deaths(share_death_dta_path: str) -> pd.DataFrame:
+        """
+        Read the needed columns of the cover screens data-set
+        :param share_death_dta_path: path to the Share cover screens data-set
+        :return: a DataFrame indexed by mergeid with the columns in `DEATH_COLUMNS`
+        """
         df_deaths = pd.read_stata(share_death_dta_path)
         df_deaths.index = df_deaths['mergeid']
+        return df_deaths[DEATH_COLUMNS]
 
-        # filter a subset of columns
-        columns = ['mergeid', 'wave', 'country', 'female', 'age', 'adla', 'income_pct_w1', 'income_pct_w2',
-                   'income_pct_w4', 'income_pct_w5', 'income_pct_w6', 'int_year', 'thinc_m', 'dn004_mod']
-
-        death_columns = ['deceased_age']
-
-        # apply to datasets
-        df = df[columns]
-        df_deaths = df_deaths[death_columns]
-
-        # merge the two datasets
-        df = pd.merge(df, df_deaths, how='left', left_index=True, right_index=True)
-        del df_deaths  # free up memory
+    @staticmethod
+    def _read_dataset_in_chunks(easy_share_dta_path: str, share_death_dta_path: str, chunksize: int) -> \
+            pd.DataFrame:
+        """
+        Streaming version of `read_dataset`: only the needed columns are kept from
+        each chunk, wave 3 is dropped and the deaths are merged chunk by chunk
+        :param easy_share_dta_path: path to the EasyShare data-set
+        :param share_death_dta_path: path to the Share cover screens data-set
+        :param chunksize: number of rows read at once from the Stata files
+        :return: the same DataFrame as `read_dataset`
+        """
+        with warnings.catch_warnings():
+            # value labels are merged across chunks by `_concat_chunks`
+            warnings.simplefilter('ignore', pd.errors.CategoricalConversionWarning)
+
+            with pd.read_stata(share_death_dta_path, columns=['mergeid'] + DEATH_COLUMNS,
+                               chunksize=chunksize) as reader:
+                df_deaths = _concat_chunks([chunk.copy() for chunk in reader], reader.value_labels(), release=True)
+            df_deaths.index = df_deaths['mergeid']
+            df_deaths = df_deaths[DEATH_COLUMNS]
+
+            chunks = []
+            with pd.read_stata(easy_share_dta_path, columns=COLUMNS, chunksize=chunksize) as reader:
+                for chunk in reader:
+                    # exclude wave 3 because there is no information about income and disability, the copy
+                    # releases the raw chunk which the selected columns would otherwise keep alive
+                    chunk = chunk[chunk['wave'] != 3].copy()
+                    chunk.index = chunk['mergeid']
+                    chunks.append(pd.merge(chunk, df_deaths, how='left', left_index=True, right_index=True))
+                value_labels = reader.value_labels()
+        return DataManager._compact_raw_columns(_concat_chunks(chunks, value_labels, release=True))
 
-        # exclude wave 3 because there is no information about income and disability
-        df = df[df['wave'] != 3]
+    @staticmethod
+    def _compact_raw_columns(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Cast the identifiers and the numerical raw columns to their compact dtype. The labelled
+        columns are left as returned by `pd.read_stata` and converted by the `process_*` steps
+        :param df: the merged data-set
+        :return: the data-set with compact identifiers
+        """
+        df = _apply_schema(df, ['mergeid', 'wave', 'int_year'])
+        df.index = pd.CategoricalIndex(df['mergeid'], name='mergeid')
         return df
 
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, verbose: bool = True, profiler: Optional[Profiler] = None,
+                   stage_cache: Optional[StageCache] = None) -> 'DataManager':
+        """
+        Build a DataManager on an already merged data-set, e.g. a subset of the rows returned by `read_dataset`
+        :param df: a DataFrame as returned by `read_dataset`
+        :param verbose: parameter to control whether to print messages
+        :param profiler: optionally record the time, memory and rows of each stage (see `longevity.profiling`)
+        :param stage_cache: optionally reuse the outputs of the steps of `prepare_dataset` across calls
+        :return: the DataManager
+        """
+        dm = cls.__new__(cls)
+        dm.verbose = verbose
+        dm.profiler = profiler
+        dm.stage_cache = stage_cache
+        dm.events = []
+        dm.df = df
+        dm.input_df = df if stage_cache is not None else None
+        dm._input_key = None
+        return dm
+
     def log(self, *messages: str) -> None:
         """
         Print the messages if the instance is verbose
@@ -60,39 +397,83 @@ class DataManager:
         if self.verbose:
             print(*messages)
 
+    def stage(self, name: str) -> ContextManager:
+        """
+        Profile a stage working on self.df, if the instance has a profiler
+        :param name: the name of the stage
+        :return: a context manager yielding the record of the stage (None without a profiler)
+        """
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.stage(name, rows=lambda: len(self.df))
+
+    def record_drop(self, reason: str, rows: int, *args: Any) -> None:
+        """
+        Log dropped rows and account for them in the profiler, if the instance has one
+        :param reason: why the rows are dropped (a key of `DROP_MESSAGES`)
+        :param rows: the number of rows dropped
+        :param args: the parameters of the message, after the number of rows
+        """
+        if DROP_MESSAGES[reason] is not None:
+            self.log(DROP_MESSAGES[reason].format(rows, *args))
+        self.events.append(('drop', reason, int(rows), args))
+        if self.profiler is not None:
+            self.profiler.drop(reason, rows)
+
+    def record_range(self, column: str, maximum: float, minimum: float) -> None:
+        """
+        Log the range of a column
+        :param column: the name of the column
+        :param maximum: the maximum of the column
+        :param minimum: the minimum of the column
+        """
+        self.log('Maximum {}:'.format(column), maximum, 'Minimum {}:'.format(column), minimum)
+        self.events.append(('range', column, maximum, minimum))
+
+    def replay(self, events: List[tuple]) -> None:
+        """
+        Log and account for the events recorded by an earlier run of the steps (see `record_drop`
+        and `record_range`), as if the steps had just run
+        :param events: the events
+        """
+        for event in events:
+            if event[0] == 'drop':
+                self.record_drop(event[1], event[2], *event[3])
+            else:
+                self.record_range(*event[1:])
+
+    def run_stage(self, step: Callable, *args: Any) -> None:
+        """
+        Run a process_* step, profiled as a stage named after it if the instance has a profiler
+        :param step: the bound process_* method
+        :param args: the arguments of the step
+        """
+        with self.stage(step.__name__):
+            step(*args)
+
     def process_country(self):
         """
         Process the country variable of the dataset:
         1) convert to string and remove the country numerical index
         2) filter to a subset of countries
         """
-        # convert country into string
-        self.df['country'] = self.df['country'].astype('str')
-
-        def convert_country(r):
-            r['country'] = r['country'].split()[1]
-            return r['country']
-
-        self.df.loc[:, 'country'] = self.df.apply(convert_country, axis=1)
+        # convert country into string and drop the numerical index (e.g. "11. Austria" -> "Austria")
+        self.df['country'] = _recode(self.df['country'], lambda s: s.astype('str').str.split().str[1],
+                                     categorical=True)
 
         # keep only a subset of countries
-        self.df = self.df[~self.df['country'].isin(['Croatia', 'Czech', 'Estonia', 'Greece', 'Slovenia',
-                                                    'Portugal', 'Poland', 'Netherlands', 'Luxembourg',
-                                                    'Hungary', 'Ireland', 'Israel'])]
+        excluded = self.df['country'].isin(['Croatia', 'Czech', 'Estonia', 'Greece', 'Slovenia', 'Portugal',
+                                            'Poland', 'Netherlands', 'Luxembourg', 'Hungary', 'Ireland', 'Israel'])
+        self.record_drop('excluded_country', excluded.sum())
+        self.df = self.df[~excluded]
 
     def process_gender(self) -> None:
         """
         Process the gender variable by renaming it
         """
-
-        def convert_female(r):
-            if r['female'] == '0. male':
-                return 'male'
-            else:
-                return 'female'
-
-        self.df['gender'] = self.df.apply(convert_female, axis=1)
-        self.df['gender_num'] = (self.df['gender'] == "female").astype(int)
+        female = (self.df['female'] != '0. male').to_numpy()
+        self.df['gender'] = pd.Categorical.from_codes(female.astype('int8'), ['male', 'female'])
+        self.df['gender_num'] = female.astype(SCHEMA['gender_num'])
 
     def process_age(self, start_age: int, end_age: int) -> None:
         """
@@ -101,34 +482,27 @@ class DataManager:
         :param start_age: Minimum age for the analysis
         :param end_age: Maximum age for the analysis
         """
-
-        def convert_age(r):
-
-            if r['age'] == '-15. no information':
-                return np.nan
-            else:
-                return r['age']
-
-        self.df['age'] = self.df.apply(convert_age, axis=1)
+        # '-15. no information' (and any other coded value) becomes missing
+        self.df['age'] = _to_numeric(self.df['age'])
 
         # drop missing values
         missing_age = self.df['age'].isnull().sum()
-        self.log('We drop {} observations because there is no information about age'.format(missing_age))
+        self.record_drop('missing_age', missing_age)
         self.df = self.df.dropna(subset=['age'])
 
         # filter for individuals aged 50 or above (defined by the 'start_age' variable)
         below_age = (self.df['age'] < start_age).astype('int')
         all_below_age = below_age.sum()
-        self.log('We drop {} observations because they are younger than {} years old'.format(all_below_age, start_age))
+        self.record_drop('below_start_age', all_below_age, start_age)
         self.df = self.df[self.df['age'] >= start_age]
 
         # drop individuals aged 91 or above (defined by the 'end_age' variable) because of small sample size
         above_age = (self.df['age'] > end_age).astype('int')
         all_above_age = above_age.sum()
-        self.log('We drop {} observations because they are older than {} years old'.format(all_above_age, end_age))
+        self.record_drop('above_end_age', all_above_age, end_age)
         self.df = self.df[self.df['age'] <= end_age]
 
-        self.log('Maximum age:', self.df['age'].max(), 'Minimum age:', self.df['age'].min())
+        self.record_range('age', self.df['age'].max(), self.df['age'].min())
 
     def process_disability(self) -> None:
         """
@@ -136,21 +510,17 @@ class DataManager:
         variable which is 1 if ADLA is greater than 0, and 0 otherwise.
         """
         # convert adla to numeric
-        self.df['adla'] = pd.to_numeric(self.df['adla'], errors='coerce')
+        self.df['adla'] = _to_numeric(self.df['adla'])
 
         # drop missing values
         missing_adla = self.df['adla'].isnull().sum()
-        self.log('We drop {} observations because there is no information about adla'.format(missing_adla))
+        self.record_drop('missing_adla', missing_adla)
         self.df = self.df.dropna(subset=['adla'])
 
-        # create the dummy 'disabled' if the individual has any functional disability (i.e adla > 0)
-        def convert_adla(r):
-            if r['adla'] == 0:
-                return 0
-            if r['adla'] > 0:
-                return 1
+        self.df = _apply_schema(self.df, ['adla'])
 
-        self.df.loc[:, 'disabled'] = self.df.apply(convert_adla, axis=1)
+        # create the dummy 'disabled' if the individual has any functional disability (i.e adla > 0)
+        self.df['disabled'] = (self.df['adla'] > 0).astype(SCHEMA['disabled'])
 
     def process_income(self, income_bins: int) -> None:
         """
@@ -159,76 +529,50 @@ class DataManager:
         during the interview wave
         :param income_bins: maximum number of bins
         """
+        self.record_drop('missing_thinc_m', self.df['thinc_m'].isnull().sum())
+        self.df = self.df.dropna(subset=['thinc_m'])
 
-        def convert_income(r):
-            if not str(r['income_pct_w1']).startswith("-13"):
-                return r['income_pct_w1']
-            if not str(r['income_pct_w2']).startswith("-13"):
-                return r['income_pct_w2']
-            if not str(r['income_pct_w4']).startswith("-13"):
-                return r['income_pct_w4']
-            if not str(r['income_pct_w5']).startswith("-13"):
-                return r['income_pct_w5']
-            if not str(r['income_pct_w6']).startswith("-13"):
-                return r['income_pct_w6']
+        # take the percentile of the first wave in which income was asked ('-13. not asked in this wave')
+        income_columns = ['income_pct_w1', 'income_pct_w2', 'income_pct_w4', 'income_pct_w5', 'income_pct_w6']
+        asked = [~_recode(self.df[column], lambda s: s.astype('str').str.startswith('-13', na=False)).astype(bool)
+                 for column in income_columns]
+        values = [_to_numeric(self.df[column]) for column in income_columns]
+        income_pct = pd.Series(np.select(asked, values, default=np.nan), index=self.df.index)
 
-        self.df = self.df.dropna(subset=['thinc_m'])
-        self.df['income_dcl'] = self.df.apply(convert_income, axis=1) // (
-            (10 // income_bins + 1) if income_bins < 10 else 1)
+        self.df['income_dcl'] = (income_pct // ((10 // income_bins + 1) if income_bins < 10 else 1)).astype(
+            SCHEMA['income_dcl'])
         # TODO: fix the income binning process
         self.df['income'] = self.df['thinc_m'].astype(float)
 
-        def income_nan(r):
-            if r['income'] == '-7. not yet coded':
-                return np.nan
-            else:
-                return r['income']
-
-        self.df.loc[:, 'income'] = self.df.apply(income_nan, axis=1)
-
         # drop missing values
-        self.log(
-            'We drop {} observations because there is no information about income'.format(
-                self.df['income'].isnull().sum()))
+        missing_income = self.df['income'].isnull().sum()
+        self.record_drop('missing_income', missing_income)
         self.df = self.df.dropna(subset=['income'])
 
     def process_deceased_age(self) -> None:
         """
         Process the deceased age variable
         """
+        # split the labelled variable into a status ('Deceased', 'Not applicable', 'Refusal', ...) and a numeric age
+        self.df['deceased_status'] = _recode(self.df['deceased_age'], lambda s: s.where(
+            pd.to_numeric(s, errors='coerce').isna(), DECEASED), categorical=True)
+        self.df['deceased_age'] = _to_numeric(self.df['deceased_age']).astype(SCHEMA['deceased_age'])
 
-        def convert_deceased_age(r):
-            if r['deceased_age'] == 'Refusal' or r['deceased_age'] == 'Don\'t know':
-                return np.nan
-            else:
-                return r['deceased_age']
-
-        self.df.loc[:, 'deceased_age'] = self.df.apply(convert_deceased_age, axis=1)
-
-        # drop missing values
-        missing_deceased_age = self.df['deceased_age'].isnull().sum()
-        self.log('We drop {} observations because there is no information about their deceased age'.format(
-            missing_deceased_age))
-        self.df = self.df.dropna(subset=['deceased_age'])
+        # drop missing values ('Refusal', 'Don't know' or no record in the cover screens)
+        missing_deceased_age = ~self.df['deceased_status'].isin([DECEASED, ALIVE])
+        self.record_drop('missing_deceased_age', missing_deceased_age.sum())
+        self.df = self.df[~missing_deceased_age]
 
         # exclude observations with deceased_age < age at interview
-        def deceased_age_int(r):
-            if r['deceased_age'] == 'Not applicable':
-                return 99999
-            else:
-                return r['deceased_age']
-
-        self.df['deceased_age_int'] = self.df.apply(deceased_age_int, axis=1)
+        not_applicable = self.df['deceased_status'] == ALIVE
+        deceased_age_int = self.df['deceased_age'].astype(SCHEMA['deceased_age_int'])
+        self.df['deceased_age_int'] = deceased_age_int.mask(not_applicable, 99999)
 
-        # transform 'age' into integer to allow comparison
-        def age_integer(r):
-            return int(round(r['age']))
-
-        self.df['age_int'] = self.df.apply(age_integer, axis=1)
+        # transform 'age' into integer to allow comparison (rounding half to even, as the builtin round)
+        self.df['age_int'] = np.rint(self.df['age']).astype(SCHEMA['age_int'])
 
         wrong_deceased_age = self.df['deceased_age_int'] < self.df['age_int']
-        self.log('We drop {} observations because their age at death is less than their age at interview'.format(
-            wrong_deceased_age.sum()))
+        self.record_drop('deceased_before_interview', wrong_deceased_age.sum())
         self.df = self.df[self.df['deceased_age_int'] >= self.df['age_int']]
 
     def process_immigration(self) -> None:
@@ -236,23 +580,15 @@ class DataManager:
         Process the dn004_mod variable to account for immigration.
         Immigrants will be dropped from the study
         """
-
-        def convert_dn004_mod(r):
-            if r['dn004_mod'] == '-15. no information' or r['dn004_mod'] == '-12. don\'t know / refusal':
-                return np.nan
-            else:
-                return r['dn004_mod']
-
-        self.df['born_in_country'] = self.df.apply(convert_dn004_mod, axis=1)
-
         # drop missing values
-        self.log('We drop {} observations because there is no information about where they were born'.format(
-            self.df['born_in_country'].isnull().sum()))
-        self.df = self.df.dropna(subset=['born_in_country'])
+        missing_dn004_mod = (self.df['dn004_mod'].isin(['-15. no information', '-12. don\'t know / refusal']) |
+                             self.df['dn004_mod'].isnull())
+        self.record_drop('missing_birthplace', missing_dn004_mod.sum())
+        self.df = self.df[~missing_dn004_mod]
         # drop immigrants
-        self.df['born_in_country'] = (self.df['born_in_country'] == '1. Yes').astype('bool')
+        self.df['born_in_country'] = (self.df['dn004_mod'] == '1. Yes').astype(SCHEMA['born_in_country'])
         immigrants = len(self.df[~self.df['born_in_country']])
-        self.log('We drop {} observations because there where not born in the country'.format(immigrants))
+        self.record_drop('immigrant', immigrants)
         self.df = self.df[self.df['born_in_country']]
 
     def process_age_of_death(self) -> None:
@@ -260,22 +596,33 @@ class DataManager:
         Create a dummy to code age of death of individuals and
         create a new variable representing the age of death or at interview
         """
+        not_applicable = self.df['deceased_status'] == ALIVE
+        self.df['is_dead'] = (~not_applicable).astype(SCHEMA['is_dead'])
+        self.df['is_aged'] = self.df['deceased_age'].mask(not_applicable, self.df['age_int']).astype(
+            SCHEMA['is_aged'])
 
-        def deceased_dummy(r):
-            if r['deceased_age'] == 'Not applicable':
-                return 0
-            else:
-                return 1
-
-        self.df['is_dead'] = self.df.apply(deceased_dummy, axis=1)
-
-        def deceased(r):
-            if r['deceased_age'] == 'Not applicable':
-                return r['age_int']
+    @staticmethod
+    def memory_report(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Report the memory used by each column of a data-set, next to the memory the
+        same column would take with wide dtypes (python objects for strings, categoricals
+        and nullable integers, 64 bits for numbers and flags)
+        :param df: a DataFrame, e.g. the result of `prepare_dataset`
+        :return: a DataFrame with the dtype, the bytes and the wide bytes of each column, and their total
+        """
+        report = []
+        for column in df.columns:
+            series = df[column]
+            if isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biuf':
+                wide_bytes = 8 * len(series)
             else:
-                return r['deceased_age']
-
-        self.df['is_aged'] = self.df.apply(deceased, axis=1)
+                wide_bytes = series.astype(object).memory_usage(index=False, deep=True)
+            report.append({'column': column, 'dtype': str(series.dtype),
+                           'bytes': series.memory_usage(index=False, deep=True), 'wide_bytes': wide_bytes})
+        report = pd.DataFrame(report).set_index('column')
+        report.loc['total'] = ['', report['bytes'].sum(), report['wide_bytes'].sum()]
+        report['ratio'] = report['wide_bytes'] / report['bytes']
+        return report
 
     @staticmethod
     def create_panel_dataset(df: pd.DataFrame) -> pd.DataFrame:
@@ -290,55 +637,272 @@ class DataManager:
         :param df: a DataFrame resulting to a call to `prepare_dataset`
         :return: a panel DataFrame ready to be used in regression models.
         """
-        new_rows = []
-
-        df = df.copy()
-        df['y'] = 0
-
-        for mergeid, individual_history in tqdm(df.groupby('mergeid')):
-            tot = len(individual_history)
-            for i, (idx, row) in enumerate(individual_history.sort_values('age', ascending=True).iterrows()):
-                if i < tot - 1 or row['is_dead'] == 0:
-                    new_rows.append(row.to_dict())
-                    continue
-                # last rows of dead people
-                if row['deceased_age'] == row['age_int'] + 1:
-                    row['y'] = 1
-                    new_rows.append(row.to_dict())
-                elif row['deceased_age'] == row['age_int']:
-                    new_row = row.to_dict()
-                    new_row['age'] = row['deceased_age'] - 1
-                    new_row['age_int'] = row['deceased_age'] - 1
-                    new_row['y'] = 1
-                    new_rows.append(new_row)
-                else:
-                    new_rows.append(row.to_dict())
-                    new_row = row.to_dict()
-                    new_row['age'] = row['deceased_age'] - 1
-                    new_row['age_int'] = row['deceased_age'] - 1
-                    new_row['y'] = 1
-                    new_rows.append(new_row)
-
-        panel_df = pd.DataFrame(new_rows)
-        panel_df = panel_df.sort_values(['mergeid', 'age'])
+        # one global sort: the history of every individual ordered by age
+        mergeid_codes = pd.factorize(df['mergeid'], sort=True)[0]
+        order = np.lexsort((df['age'].to_numpy(), mergeid_codes))
+        mergeid_codes = mergeid_codes[order]
+        last_row = np.append(mergeid_codes[1:] != mergeid_codes[:-1], True)
+
+        # last rows of dead people
+        dead = last_row & (df['is_dead'].to_numpy()[order] == 1)
+        deceased_age = df['deceased_age'].to_numpy(dtype=float, na_value=np.nan)[order]
+        age_int = df['age_int'].to_numpy(dtype=float, na_value=np.nan)[order]
+        dies_next_year = dead & (deceased_age == age_int + 1)
+        dies_same_year = dead & (deceased_age == age_int)
+        dies_later = dead & ~dies_next_year & ~dies_same_year
+
+        # duplicate the last row of those who die more than a year after their last interview,
+        # the copy (placed right after the original row) becomes the year before death
+        repeats = 1 + dies_later.astype(int)
+        panel_df = df.take(np.repeat(order, repeats))
+        panel_df.index = pd.RangeIndex(len(panel_df))
+        position = np.cumsum(repeats) - 1
+
+        moved = position[dies_same_year | dies_later]
+        year_before_death = deceased_age[dies_same_year | dies_later] - 1
+        age = panel_df['age'].to_numpy(dtype=float, copy=True)
+        age[moved] = year_before_death
+        panel_df['age'] = age
+        age_int = panel_df['age_int'].to_numpy(dtype=float, na_value=np.nan)
+        age_int[moved] = year_before_death
+        panel_df['age_int'] = pd.array(age_int, dtype=SCHEMA['age_int'])
+
+        y = np.zeros(len(panel_df), dtype=SCHEMA['y'])
+        y[position[dead]] = 1
+        panel_df['y'] = y
+
+        # moving a last row back to the year before death can break the age ordering
+        mergeid_codes = np.repeat(mergeid_codes, repeats)
+        if ((np.diff(mergeid_codes) == 0) & (np.diff(age) < 0)).any():
+            panel_df = panel_df.take(np.lexsort((age, mergeid_codes)))
+            panel_df.index = pd.RangeIndex(len(panel_df))
+        return panel_df
+
+    def _create_panel(self) -> pd.DataFrame:
+        """
+        Create the panel of self.df, profiled as a stage if the instance has a profiler
+        :return: the panel DataFrame (see `create_panel_dataset`)
+        """
+        with self.profiler.stage('create_panel_dataset', rows=len(self.df)) if self.profiler is not None \
+                else contextlib.nullcontext() as record:
+            panel_df = DataManager.create_panel_dataset(self.df)
+            if record is not None:
+                record.rows_out = len(panel_df)
         return panel_df
 
-    def prepare_dataset(self, start_age: int = 65, end_age: int = 90, income_bins: int = 10) -> pd.DataFrame:
+    def steps(self, start_age: int, end_age: int, income_bins: int) -> List[Tuple[Callable, tuple]]:
+        """
+        The steps of `prepare_dataset`, in order
+        :param start_age: Minimum age for the analysis
+        :param end_age: Maximum age for the analysis
+        :param income_bins: maximum number of bins
+        :return: the bound process_* methods with their arguments
+        """
+        return [
+            (self.process_country, ()),
+            (self.process_gender, ()),
+            (self.process_age, (start_age, end_age)),
+            (self.process_disability, ()),
+            (self.process_income, (income_bins,)),
+            (self.process_deceased_age, ()),
+            (self.process_immigration, ()),
+            (self.process_age_of_death, ()),
+        ]
+
+    def _process_individuals(self, start_age: int, end_age: int, income_bins: int) -> None:
+        """
+        Run the steps of `prepare_dataset` following `process_country`. They only drop or
+        transform rows one individual at a time, so they can run on any partition of the
+        individuals (see `_process_partitions`)
+        :param start_age: Minimum age for the analysis
+        :param end_age: Maximum age for the analysis
+        :param income_bins: maximum number of bins
+        """
+        for step, args in self.steps(start_age, end_age, income_bins)[1:]:
+            self.run_stage(step, *args)
+
+    def _process_cached(self, start_age: int, end_age: int, income_bins: int, workers: Optional[int],
+                        panel: bool) -> Tuple[Optional[pd.DataFrame], List[List[StageRecord]]]:
+        """
+        Run the steps of `prepare_dataset` from the input data-set, starting after the last step
+        whose output is in the stage cache. The output of every step run is cached, except the
+        intermediate steps run by the workers with several workers
+        :param start_age: Minimum age for the analysis
+        :param end_age: Maximum age for the analysis
+        :param income_bins: maximum number of bins
+        :param workers: the number of worker processes, all the cores if None
+        :param panel: whether to also create the panel (with several workers)
+        :return: the panel DataFrame if it was created by the workers (None otherwise) and the stages of
+                 the panel profiled in the workers (see `_process_partitions`)
+        """
+        if self._input_key is None:
+            self._input_key = cache.frame_fingerprint(self.input_df)
+        steps = self.steps(start_age, end_age, income_bins)
+        keys, key = [], self._input_key
+        for step, args in steps:
+            key = StageCache.chain_key(key, step.__name__, args, step)
+            keys.append(key)
+
+        self.df = self.input_df.copy(deep=False)
+        first_event = len(self.events)
+        done = 0
+        for i in range(len(steps) - 1, -1, -1):
+            cached = self.stage_cache.get(keys[i], steps[i][0].__name__)
+            if cached is not None:
+                with self.stage('load_cached_steps'):
+                    self.df = cached[0]
+                    self.replay(cached[1])
+                done = i + 1
+                break
+
+        # with several workers, unless only cheap steps are left
+        partitioned = workers != 1 and done <= 1
+        for i in range(done, len(steps)):
+            self.stage_cache.miss(keys[i], steps[i][0].__name__)
+            if not partitioned or i == 0:
+                self.run_stage(steps[i][0], *steps[i][1])
+                self.stage_cache.put(keys[i], self.df, self.events[first_event:])
+
+        self._output_key = keys[-1]
+        if not partitioned:
+            return None, []
+        panel_df, panel_records = self._process_partitions(start_age, end_age, income_bins, workers, panel)
+        self.stage_cache.put(keys[-1], self.df, self.events[first_event:])
+        return panel_df, panel_records
+
+    def _process_partitions(self, start_age: int, end_age: int, income_bins: int, workers: Optional[int],
+                            panel: bool) -> Tuple[Optional[pd.DataFrame], List[List[StageRecord]]]:
+        """
+        Run `_process_individuals` (and optionally `create_panel_dataset`) on one partition of
+        self.df per country, on a pool of processes. Every individual goes to the partition of
+        the country of their first row. The rows are then put back in their original order, the
+        drops and ranges of the partitions are merged and logged as if self.df had been processed
+        at once, and the stages of the cleaning profiled in the workers are merged into the profiler.
+        The stages of the panel are returned, to be merged once `prepare_dataset` is closed, as in a
+        serial run
+        :param start_age: Minimum age for the analysis
+        :param end_age: Maximum age for the analysis
+        :param income_bins: maximum number of bins
+        :param workers: the number of worker processes, all the cores if None
+        :param panel: whether to also create the panel of each partition
+        :return: the panel DataFrame if `panel` (None otherwise) and the stages of the panel profiled in
+                 each worker
+        """
+        df = self.df.assign(_position=np.arange(len(self.df)))
+        mergeid_codes = df['mergeid'].cat.codes.to_numpy()
+        country = pd.Series(df['country'].cat.codes.to_numpy()).groupby(mergeid_codes).transform('first').to_numpy()
+        partitions = [_trim_mergeid(df.take(np.flatnonzero(country == code))) for code in np.unique(country)]
+        # the largest partitions first, so that they do not end up last on the pool
+        partitions.sort(key=len, reverse=True)
+
+        trace_memory = self.profiler.trace_memory if self.profiler is not None else None
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(functools.partial(
+                _prepare_partition, start_age=start_age, end_age=end_age, income_bins=income_bins, panel=panel,
+                trace_memory=trace_memory), partitions))
+        del partitions
+
+        df = _concat_partitions([result[0] for result in results], self.df)
+        self.df = df.take(np.argsort(df['_position'].to_numpy(), kind='stable')).drop(columns='_position')
+        # every partition went through the same steps, so their events match one to one
+        for events in zip(*[result[2] for result in results]):
+            if events[0][0] == 'drop':
+                self.record_drop(events[0][1], sum(event[2] for event in events), *events[0][3])
+            else:
+                maxima = [event[2] for event in events if not pd.isna(event[2])]
+                minima = [event[3] for event in events if not pd.isna(event[3])]
+                self.record_range(events[0][1], max(maxima, default=np.nan), min(minima, default=np.nan))
+        if self.profiler is not None:
+            self.profiler.merge([result[3] for result in results])
+        panel_records = [result[4] for result in results]
+        if not panel:
+            return None, panel_records
+
+        panel_df = _concat_partitions([result[1] for result in results], self.df).drop(columns='_position')
+        panel_df = panel_df.take(np.argsort(panel_df['mergeid'].cat.codes.to_numpy(), kind='stable'))
+        panel_df.index = pd.RangeIndex(len(panel_df))
+        return panel_df, panel_records
+
+    def prepare_dataset(self, start_age: int = 65, end_age: int = 90, income_bins: int = 10,
+                        workers: Optional[int] = 1) -> pd.DataFrame:
         """
         Pipeline method to call all the data cleaning methods
         of the class and prepare a fully cleaned dataframe.
         :param start_age: Minimum age for the analysis
         :param end_age: Maximum age for the analysis
         :param income_bins: maximum number of bins
+        :param workers: the number of processes cleaning the countries in parallel, all the cores if None.
+                        The result is the same whatever the number of workers
         :return: a cleaned and processed dataset for further analysis
         """
-        self.process_country()
-        self.process_gender()
-        self.process_age(start_age, end_age)
-        self.process_disability()
-        self.process_income(income_bins)
-        self.process_deceased_age()
-        self.process_immigration()
-        self.process_age_of_death()
+        return self.prepare_dataset_and_panel(start_age, end_age, income_bins, workers, panel=False)[0]
+
+    def prepare_dataset_and_panel(self, start_age: int = 65, end_age: int = 90, income_bins: int = 10,
+                                  workers: Optional[int] = 1, panel: bool = True) -> \
+            Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+        """
+        Prepare the cleaned dataframe as `prepare_dataset` and its panel as `create_panel_dataset`.
+        With several workers the panel of each country is created in the worker which cleaned it
+        :param start_age: Minimum age for the analysis
+        :param end_age: Maximum age for the analysis
+        :param income_bins: maximum number of bins
+        :param workers: the number of processes cleaning the countries in parallel, all the cores if None.
+                        The result is the same whatever the number of workers
+        :param panel: whether to create the panel
+        :return: the cleaned dataset and its panel (None if not `panel`)
+        """
+        panel_df, panel_records = None, []
+        with self.stage('prepare_dataset'):
+            if self.stage_cache is not None:
+                panel_df, panel_records = self._process_cached(start_age, end_age, income_bins, workers, panel)
+            else:
+                self.run_stage(self.process_country)
+                if workers == 1:
+                    self._process_individuals(start_age, end_age, income_bins)
+                else:
+                    panel_df, panel_records = self._process_partitions(start_age, end_age, income_bins, workers,
+                                                                       panel)
+            self.df = _drop_unused_categories(self.df)
+        # the panel is a stage next to prepare_dataset, as in a serial run, even if the workers created it
+        if self.profiler is not None and any(panel_records):
+            self.profiler.merge(panel_records)
         self.log('We are left with {} observations'.format(len(self.df)))
-        return self.df
\ No newline at end of file
+        if not panel:
+            return self.df, None
+        if panel_df is not None:
+            panel_df = _drop_unused_categories(panel_df)
+        elif self.stage_cache is not None:
+            key = StageCache.chain_key(self._output_key, 'create_panel_dataset', (), self.create_panel_dataset)
+            cached = self.stage_cache.get(key, 'create_panel_dataset')
+            if cached is not None:
+                panel_df = cached[0]
+            else:
+                self.stage_cache.miss(key, 'create_panel_dataset')
+                panel_df = self._create_panel()
+                self.stage_cache.put(key, panel_df, [])
+        else:
+            panel_df = self._create_panel()
+        return self.df, panel_df
+
+
+def _prepare_partition(df: pd.DataFrame, start_age: int, end_age: int, income_bins: int, panel: bool,
+                       trace_memory: Optional[bool]) -> Tuple[pd.DataFrame, Optional[pd.DataFrame], List[tuple],
+                                                              List[StageRecord], List[StageRecord]]:
+    """
+    Clean a partition of the data-set in a worker process (see `DataManager._process_partitions`)
+    :param df: a partition of the data-set, after `process_country`
+    :param start_age: Minimum age for the analysis
+    :param end_age: Maximum age for the analysis
+    :param income_bins: maximum number of bins
+    :param panel: whether to also create the panel of the partition
+    :param trace_memory: whether to trace memory allocations, no profiling if None
+    :return: the cleaned partition, its panel (or None), the events recorded and the profiled stages of
+             the cleaning and of the panel
+    """
+    dm = DataManager.from_frame(df, verbose=False, profiler=Profiler(trace_memory) if trace_memory is not None
+                                else None)
+    dm._process_individuals(start_age, end_age, income_bins)
+    records = list(dm.profiler.records) if dm.profiler is not None else []
+    panel_df = dm._create_panel() if panel else None
+    panel_records = dm.profiler.records[len(records):] if dm.profiler is not None else []
+    return dm.df, panel_df, dm.events, records, panel_records
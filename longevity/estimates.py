@@ -1,15 +1,22 @@
-from typing import Dict, Tuple, Any
+from typing import TYPE_CHECKING, Any, Dict, Tuple, Optional, Sequence, Union
 
 import pandas as pd
 import numpy as np
-import scipy as sp
-from sklearn.linear_model import LogisticRegression
-from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import StandardScaler
 
+from longevity import scoring
+from longevity.cache import ModelCache
+from longevity.markov import absorption_distribution, reward_moments, survival_reward_sensitivities
+from longevity.prevalence import PREVALENCE_MAX_AGE, PrevalenceTable, smooth_curves
+from longevity.scoring import HAZARD_FEATURES, HAZARD_TERMS, death_probabilities
 
-def sigmoid(x):
-    return 1 / (1 + np.exp(-x))
+if TYPE_CHECKING:
+    from sklearn.pipeline import Pipeline
+
+GENDERS = ['male', 'female']
+MEASURES = ['healthy', 'total']
+
+# fitted hazard models, shared by all the estimators of the process
+HAZARD_MODEL_CACHE = ModelCache()
 
 
 class LongevityEstimator:
@@ -20,66 +27,89 @@ class LongevityEstimator:
     longevity.DataManager
     """
 
-    def __init__(self, df: pd.DataFrame, panel_df: pd.DataFrame, gender: str, income_dcl: int, coeffs: dict = None):
+    def __init__(self, df: pd.DataFrame, panel_df: pd.DataFrame, gender: str, income_dcl: int, coeffs: dict = None,
+                 prevalence_max_age: Optional[int] = PREVALENCE_MAX_AGE, model_cache: Optional[ModelCache] = None,
+                 smooth_prevalence: bool = False, hazard_model: Any = None):
         """
         Initialize a LongevityEstimator object
         :param df: a dataframe resulting from a call to longevity.DataManager.prepare_dataset
         :param panel_df: a dataframe resulting from a call to longevity.DataManager.create_panel_dataset
         :param gender: the gender of the individual, can be "male" or "female"
-        :param coeffs: optionally pass the coefficients of the LR
+        :param coeffs: optionally pass the coefficients of the LR on the raw features (see
+                       longevity.scoring.death_probabilities), which may include the "intercept"
         :param income_dcl:
+        :param prevalence_max_age: disability is only measured on observations younger than this age
+        :param model_cache: the cache of fitted hazard models, HAZARD_MODEL_CACHE by default
+        :param smooth_prevalence: whether to smooth the disability prevalence curves (see PrevalenceTable.smoothed)
+        :param hazard_model: optionally, the (unfitted) model of the probability of dying within a year, fitted on
+                             the HAZARD_FEATURES of panel_df (e.g. the model chosen by
+                             longevity.selection.select_hazard_model), `build_hazard_model` by default
         """
         self.df = df
         self.panel_df = panel_df
-        self.panel_df.loc[:, 'age_2'] = self.panel_df.age ** 2
-        self.disability_prevalence = LongevityEstimator.compute_disability_prevalence_by_age(df)
+        self.disability_prevalence = LongevityEstimator.compute_disability_prevalence_by_age(df, prevalence_max_age,
+                                                                                             smooth_prevalence)
         self.start_age, self.end_age = int(self.df.age.min()), int(self.df.age.max()) + 1
         self.diff = int(self.end_age - self.start_age)
         self.gender = gender
         self.income_dcl = income_dcl
         self.income_buckets = len(self.df.income_dcl.unique())
         self.coeffs = coeffs
-        self.clf = Pipeline([
+        self.hazard_model = hazard_model
+        # the fitted hazard model, only built (and sklearn imported) when it is needed, i.e. without coeffs
+        self.clf = None
+        self.model_cache = HAZARD_MODEL_CACHE if model_cache is None else model_cache
+
+    @staticmethod
+    def build_hazard_model() -> 'Pipeline':
+        """
+        Build the (unfitted) model of the probability of dying within a year. sklearn is only
+        imported here, so that scoring with coeffs does not import it
+        :return: a sklearn pipeline to be fitted on the HAZARD_FEATURES of a panel dataset
+        """
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import StandardScaler
+
+        return Pipeline([
             ('scaler', StandardScaler(with_std=False, with_mean=False)),
             ('lr', LogisticRegression())
         ])
 
+    def _fit_hazard_model(self) -> Any:
+        """
+        Get the hazard model fitted on the panel. It is fitted (or found in the model cache) on the
+        first call only, so that the panel is not fingerprinted again by every computation
+        :return: the fitted hazard model
+        """
+        if self.clf is None:
+            model = LongevityEstimator.build_hazard_model() if self.hazard_model is None else self.hazard_model
+            self.clf = self.model_cache.fit(model, self.panel_df[HAZARD_FEATURES], self.panel_df['y'])
+        return self.clf
+
     @staticmethod
-    def compute_disability_prevalence_by_age(df: pd.DataFrame) -> Dict[Any, Any]:
+    def compute_disability_prevalence_by_age(df: pd.DataFrame, max_age: Optional[int] = PREVALENCE_MAX_AGE,
+                                             smooth: bool = False) -> PrevalenceTable:
         """
-        Computes the prevalence of disability matrix by age
+        Computes the prevalence of disability matrix by age. The table (and its smoothed version)
+        is shared by all the estimators built on the same dataframe
         :param df: a dataframe resulting from a call to longevity.DataManager.prepare_dataset
-        :return: the disability prevalence matrix
-        """
-        return (pd.pivot_table(
-            df[(df['disabled'] == 1) & (df['is_aged'] < 88)],
-            columns=['income_dcl'],
-            index=['is_aged'],
-            values=['mergeid'],
-            aggfunc='count'
-        ).replace(np.nan, 0) / pd.pivot_table(
-            df[(df['disabled'] == 0) & (df['is_aged'] < 88)],
-            columns=['income_dcl'],
-            index=['is_aged'],
-            values=['mergeid'],
-            aggfunc='count'
-        )).to_dict()
+        :param max_age: observations from this age on are not counted, no cutoff if None
+        :param smooth: whether to smooth the prevalence curves (see PrevalenceTable.smoothed)
+        :return: the disability prevalence table (age x income_dcl)
+        """
+        table = PrevalenceTable.for_frame(df, max_age)
+        return table.smoothed() if smooth else table
 
     def smooth_disability_curve(self, y: np.array) -> np.array:
         """
-        Smooths out the disability curve in order to reduce noise
-        1) substitutes 0 values with the last available prevalence
-        2) fits an exponential function through the data
+        Smooths out the disability curve in order to reduce noise by fitting
+        an exponential function through the data (log-linear least squares,
+        zero and missing values are left out of the fit)
         :param y: disability curve
         :return: smoothed disability curve
         """
-        # for idx, i in enumerate(y):
-        #    if i == 0:
-        #        y[idx] = y[idx - 1] if idx > 0 else y[idx + 1]
-        x = range(self.start_age, self.end_age)
-        f = lambda t, a, b: a * (np.e ** (t * b))
-        a, b = sp.optimize.curve_fit(f, x, y, p0=(4, 0.1))[0]
-        return f(x, a, b)
+        return smooth_curves(np.arange(self.start_age, self.end_age), y, 1.)
 
     def prevalence(self, age: int) -> float:
         """
@@ -88,145 +118,387 @@ class LongevityEstimator:
         :return: a float representing the disability prevalence
                  for the specified age class
         """
-        ps = [self.disability_prevalence[('mergeid', self.income_dcl)].get(float(age), 0) for age in
-              range(self.start_age, self.end_age)]
-        # for idx, i in enumerate(ps):
-        #    if np.isnan(i):
-        #        ps[idx] = 0 if idx == 0 else ps[idx - 1]
-        # ps = self.smooth_disability_curve(ps)
-        return ps[int(age - self.start_age)]
+        return float(self.disability_prevalence.curve(self.income_dcl, [age])[0])
 
     def generate_prevalence_matrix(self) -> np.array:
         """
         Generate the healthy prevalence matrix
         :return: a healthy prevalence matrix
         """
-        m = []
-        for age in range(self.start_age, self.end_age):
-            m.append(self.prevalence(age))
-        m.append(0)
-        return 1 - np.vstack([[m] * (len(m) - 1), [i / 2 for i in m]])
+        ages = np.arange(self.start_age, self.end_age)
+        return LongevityEstimator.prevalence_matrix(self.disability_prevalence.curve(self.income_dcl, ages))
+
+    @staticmethod
+    def prevalence_matrix(prevalences: np.array) -> np.array:
+        """
+        Build the healthy prevalence (reward) matrix from the disability prevalence at each age
+        :param prevalences: the disability prevalence at each age (d), or a stack of them (... x d)
+        :return: the healthy prevalence matrix ((d + 1) x (d + 1)), or a stack of them
+        """
+        return scoring.prevalence_matrix(prevalences)
+
+    @staticmethod
+    def total_life_matrix(d: int) -> np.array:
+        """
+        Build the reward matrix of total life: a full year for surviving, half a year for dying
+        :param d: the number of ages
+        :return: the total life reward matrix ((d + 1) x (d + 1))
+        """
+        return scoring.total_life_matrix(d)
+
+    def compute_death_probabilities(self, ages: np.array) -> np.array:
+        """
+        Compute the probability of dying within a year for all the given ages
+        at once, either with the fitted classifier or with the passed coefficients
+        :param ages: the ages for which to compute the probabilities
+        :return: an array with the probability of dying at each age
+        """
+        gender_num = 1 if self.gender == 'female' else 0
+        if self.coeffs:
+            return death_probabilities(self.coeffs, ages, self.income_dcl, gender_num)
+        X = pd.DataFrame({
+            'age': ages,
+            'income_dcl': np.full(len(ages), self.income_dcl),
+            'gender_num': np.full(len(ages), gender_num)
+        })
+        p_alive, p_dead = self._fit_hazard_model().predict_proba(X).T
+        return p_dead
+
+    @staticmethod
+    def survival_matrices(p_dead: np.array) -> Tuple[np.array, np.array]:
+        """
+        Build the U and P matrices as defined in Caswell, Zarulli (2018) from the
+        probability of dying at each age. The last age is an open-ended age class
+        :param p_dead: the probability of dying at each age (d), or a stack of them (... x d)
+        :return: U (... x d x d) and P (... x (d + 1) x (d + 1)) matrices
+        """
+        return scoring.survival_matrices(p_dead)
 
     def compute_UP(self) -> Tuple[np.array, np.array]:
         """
-        Computes the U and P matrices as defined in Caswell, Zarulli (2018)
+        Computes the U and P matrices as defined in Caswell, Zarulli (2018). The
+        last age of the range is an open-ended age class, where survivors stay
         :return: U and P matrices
         """
-        if not self.coeffs:
-            self.clf.fit(self.panel_df[['age', 'income_dcl', 'gender_num']], self.panel_df['y'])
-
-            lr = self.clf.named_steps['lr']
-            scaler = self.clf.named_steps['scaler']
-
-        P = np.hstack(
-            [np.zeros((self.diff + 1, self.diff)), np.hstack([np.zeros(self.diff), [1]]).reshape(self.diff + 1, 1)])
-        for age in range(self.start_age, self.end_age):
-            if not self.coeffs:
-                row = [age, self.income_dcl, 1 if self.gender == 'female' else 0]
-                row = scaler.transform([row])
-            if age != 90:
-                if not self.coeffs:
-                    p_alive, p_dead = lr.predict_proba(row)[0]
-                else:
-                    p_dead = sigmoid(
-                        self.coeffs['age'] * age +
-                        self.coeffs['income_dcl'] * self.income_dcl +
-                        self.coeffs['gender_num'] * (1 if self.gender == 'female' else 0)
-                    )
-                    p_alive = 1 - p_dead
-                P[age - (self.start_age - 1), age - self.start_age] = p_alive
-                P[self.diff, age - self.start_age] = p_dead
-            else:
-                if not self.coeffs:
-                    p_alive, p_dead = lr.predict_proba(row)[0]
-                else:
-                    p_dead = sigmoid(
-                        self.coeffs['age'] * age +
-                        self.coeffs['income_dcl'] * self.income_dcl +
-                        self.coeffs['gender_num'] * (1 if self.gender == 'female' else 0)
-                    )
-                    p_alive = 1 - p_dead
-                P[self.diff - 1, self.diff - 1] = p_alive
-                P[self.diff, self.diff - 1] = p_dead
-        U = P[:self.diff, :self.diff]
-        return U, P
-
-    def compute_moments(self, U: np.array, P: np.array, prevalence_matrix:
-    np.array, healthy_life_only: bool) -> Tuple[np.array, np.array, np.array]:
+        p_dead = self.compute_death_probabilities(np.arange(self.start_age, self.end_age))
+        return LongevityEstimator.survival_matrices(p_dead)
+
+    def compute_moments(self, U: np.array, P: np.array, prevalence_matrix: np.array, healthy_life_only: bool,
+                        k: int = 3) -> Tuple[np.array, ...]:
         """
         Compute vector of rewards moments as defined in Caswell, Zarulli (2018)
         :param U: the U matrix
         :param P: the P matrix
         :param prevalence_matrix: the prevalence matrix
-        :param healthy_life_only: whether to compute moments for healthy or total life 
-        :return: the first three moments of the vector of rewards
+        :param healthy_life_only: whether to compute moments for healthy or total life
+        :param k: the number of moments to compute
+        :return: the first k moments of the vector of rewards
         """
-        Z = np.hstack([np.eye(self.diff), np.zeros((self.diff, 1))])
-        N = np.linalg.inv(np.eye(self.diff) - U)
-
         if healthy_life_only:
-            R_1 = R_2 = R_3 = prevalence_matrix
+            R = prevalence_matrix
         else:
-            R_1 = R_2 = R_3 = np.hstack(
-                [np.vstack([np.ones((self.diff, self.diff)), np.ones(self.diff) / 2]), np.zeros((self.diff + 1, 1))])
+            R = LongevityEstimator.total_life_matrix(self.diff)
+        return reward_moments(U, P, R, k)
 
-        ones = np.matrix(np.ones(self.diff + 1)).T
+    def compute_lifetime_estimates(self, healthy_life_only: bool) -> Tuple[np.array, np.array]:
+        """
+        Compute the lifetime estimates
+        :param healthy_life_only: whether to compute lifetime for healthy or total life
+        :return: the mean and the standard deviation of the remaining (healthy) lifetime at each age
+        """
+        prevalence_matrix = self.generate_prevalence_matrix()
+        U, P = self.compute_UP()
+        mu, m2 = self.compute_moments(U, P, prevalence_matrix, healthy_life_only, k=2)
+        std = np.sqrt(m2 - mu * mu)
+        return mu, std
+
+    def compute_lifetime_sensitivities(self, healthy_life_only: bool) -> \
+            Tuple[np.array, np.array, Dict[str, np.array]]:
+        """
+        Compute the lifetime estimates and, from the same fundamental matrix, the derivatives of the
+        (healthy) life expectancy at each age with respect to the coefficients of the LR on the raw
+        features (see `export_coefficients`, the intercept being a shift of the log-odds of dying) and
+        to the disability prevalence at each age (see longevity.markov.survival_reward_sensitivities)
+        :param healthy_life_only: whether to compute lifetime for healthy or total life
+        :return: the mean and the standard deviation of the remaining (healthy) lifetime at each age,
+                 and the derivatives of the mean: one array (ages) per coefficient in HAZARD_FEATURES,
+                 per term of HAZARD_TERMS in the model and "intercept", and under "prevalence" an array
+                 (ages x ages) whose element [i, j] is the derivative of the mean at the i-th age with
+                 respect to the prevalence at the j-th
+        """
+        prevalence_matrix = self.generate_prevalence_matrix()
+        U, P = self.compute_UP()
+        R = prevalence_matrix if healthy_life_only else LongevityEstimator.total_life_matrix(self.diff)
+        mu, m2 = reward_moments(U, P, R, k=2)
+        std = np.sqrt(m2 - mu * mu)
 
-        # 1st moment
-        rho_1 = (N.T @ Z @ (np.multiply(P, R_1)).T @ ones)
+        # d p / d coefficient = p (1 - p) x for a logistic model
+        ages = np.arange(self.start_age, self.end_age)
+        d = len(ages)
+        p_dead = P[d, :d]
+        coeffs = self.export_coefficients()
+        names = [name for name in HAZARD_FEATURES + HAZARD_TERMS if name in coeffs] + ['intercept']
+        features = scoring.hazard_design(ages, self.income_dcl, 1 if self.gender == 'female' else 0, names)
+        dp_dead = np.concatenate([p_dead * (1 - p_dead) * features, np.zeros((d, d))])
+        # the prevalence m takes 1 - m from surviving and 1 - m / 2 from dying healthy
+        identity = np.eye(d) if healthy_life_only else np.zeros((d, d))
+        d_stay_rewards = np.concatenate([np.zeros((len(features), d)), -identity])
+        d_death_rewards = np.concatenate([np.zeros((len(features), d)), -identity / 2])
 
-        # 2nd moment
-        R_1_tilde = Z @ R_1 @ Z.T
-        rho_2 = N.T @ (Z @ np.multiply(P, R_2).T @ ones + 2 * (np.multiply(U, R_1_tilde)).T @ rho_1)
+        sensitivities = survival_reward_sensitivities(U, P, R, mu, dp_dead, d_stay_rewards, d_death_rewards)
+        result = dict(zip(names, sensitivities[:len(names)]))
+        result['prevalence'] = sensitivities[len(names):].T
+        return mu, std, result
 
-        # 3rd moment
-        R_2_tilde = Z @ R_2 @ Z.T
-        rho_3 = N.T @ (Z @ np.multiply(P, R_3).T @ ones + 3 * (np.multiply(U, R_2_tilde)).T @ rho_1 + 3 * (
-            np.multiply(U, R_1_tilde)).T @ rho_2)
+    def export_coefficients(self) -> Dict[str, float]:
+        """
+        Express the hazard model as coefficients on the raw features, including the intercept, fitting
+        it if needed (see longevity.scoring.export_coefficients). They can be passed back as coeffs
+        :return: the coefficients of the LR
+        """
+        if self.coeffs:
+            return dict(self.coeffs)
+        return scoring.export_coefficients(self._fit_hazard_model())
 
-        return rho_1, rho_2, rho_3
+    def export_scoring_artifact(self, path: str) -> None:
+        """
+        Write the coefficients of the hazard model and the disability prevalence of every income
+        decile at the ages of the estimator to a json artifact, from which longevity.scoring.score
+        computes the lifetime estimates of any subgroup with NumPy only
+        :param path: destination path
+        """
+        ages = np.arange(self.start_age, self.end_age)
+        income_dcls = self.disability_prevalence.income_dcls
+        scoring.save_artifact(path, self.export_coefficients(), ages, income_dcls,
+                              self.disability_prevalence.curves(income_dcls, ages))
 
-    def compute_lifetime_estimates(self, healthy_life_only: bool) -> Tuple[float, float]:
+    def compute_lifetime_distribution(self, healthy_life_only: bool, tail: float = 1e-12) -> \
+            Tuple[np.array, np.array]:
         """
-        Compute the lifetime estimates
-        :param healthy_life_only: whether to compute lifetime for healthy or total life
-        :return:
+        Compute the distribution of the remaining (healthy) lifetime at each age, from the U and P
+        matrices (see longevity.markov.absorption_distribution). The distribution is discrete: one
+        value per number of years until death, the last one gathering the `tail` probability of
+        living longer
+        :param healthy_life_only: whether to compute the distribution of healthy or total life
+        :param tail: the probability of living longer than the last value
+        :return: the remaining (healthy) lifetime and its probability, from each age (ages x values)
         """
         prevalence_matrix = self.generate_prevalence_matrix()
         U, P = self.compute_UP()
-        mu, m2, _ = self.compute_moments(U, P, prevalence_matrix, healthy_life_only)
-        std = np.sqrt(np.array(m2).squeeze() - np.array(mu).squeeze() * np.array(mu).squeeze())
-        mu = np.array(mu).squeeze()
-        return mu, std
+        R = prevalence_matrix if healthy_life_only else LongevityEstimator.total_life_matrix(self.diff)
+        return absorption_distribution(U, P, R, tail)
+
+    def compute_age_at_death_distribution(self, tail: float = 1e-12) -> Tuple[np.array, np.array]:
+        """
+        Compute the distribution of the age at death of the individuals alive at each age. Those
+        dying within a year of age a are counted as dying at a + 0.5, as in the total life moments
+        :param tail: the probability of dying after the last age
+        :return: the age at death and its probability, from each age (ages x values)
+        """
+        years, probabilities = self.compute_lifetime_distribution(False, tail)
+        return np.arange(self.start_age, self.end_age)[:, None] + years, probabilities
+
+    @staticmethod
+    def compute_grid_chains(df: pd.DataFrame, panel_df: pd.DataFrame, genders: Optional[Sequence[str]] = None,
+                            income_dcls: Optional[Sequence[int]] = None, coeffs: dict = None,
+                            ages: Optional[Sequence[int]] = None,
+                            prevalence_max_age: Optional[int] = PREVALENCE_MAX_AGE,
+                            model_cache: Optional[ModelCache] = None, smooth_prevalence: bool = False,
+                            hazard_model: Any = None) -> Dict[str, Any]:
+        """
+        Build the U, P and reward matrices of every (gender, income_dcl) subgroup at once: the hazard
+        model is fitted once and the death probabilities of all subgroups are predicted in a single call
+        :param df: a dataframe resulting from a call to longevity.DataManager.prepare_dataset
+        :param panel_df: a dataframe resulting from a call to longevity.DataManager.create_panel_dataset
+        :param genders: the genders of the grid, "male" and "female" by default
+        :param income_dcls: the income deciles of the grid, all the deciles in df by default
+        :param coeffs: optionally pass the coefficients of the LR
+        :param ages: the (consecutive) ages of the grid, from the youngest to the oldest age in df by default
+        :param prevalence_max_age: disability is only measured on observations younger than this age
+        :param model_cache: the cache of fitted hazard models, HAZARD_MODEL_CACHE by default
+        :param smooth_prevalence: whether to smooth the disability prevalence curves (see PrevalenceTable.smoothed)
+        :param hazard_model: optionally, the (unfitted) hazard model (see LongevityEstimator), `build_hazard_model`
+                             by default
+        :return: a dictionary with the genders, income_dcls and ages of the grid, the U and P matrices
+                 of each cell (cells x ...) and the reward matrix of each measure and cell
+                 (measures x cells x ...), where the cells are ordered by gender then income_dcl
+        """
+        genders = GENDERS if genders is None else list(genders)
+        if income_dcls is None:
+            income_dcls = np.sort(df.income_dcl.dropna().unique())
+        income_dcls = np.asarray(income_dcls, dtype=int)
+        if ages is None:
+            ages = np.arange(int(df.age.min()), int(df.age.max()) + 1)
+        ages = np.asarray(ages, dtype=int)
+        d = len(ages)
+
+        # one cell per (gender, income_dcl), genders vary slowest
+        cell_gender_num = np.repeat([1 if gender == 'female' else 0 for gender in genders], len(income_dcls))
+        cell_income_dcl = np.tile(income_dcls, len(genders))
+        cells = len(cell_income_dcl)
+
+        if coeffs:
+            p_dead = death_probabilities(coeffs, ages, cell_income_dcl[:, None], cell_gender_num[:, None])
+        else:
+            model_cache = HAZARD_MODEL_CACHE if model_cache is None else model_cache
+            if hazard_model is None:
+                hazard_model = LongevityEstimator.build_hazard_model()
+            clf = model_cache.fit(hazard_model, panel_df[HAZARD_FEATURES], panel_df['y'])
+            X = pd.DataFrame({
+                'age': np.tile(ages, cells),
+                'income_dcl': np.repeat(cell_income_dcl, d),
+                'gender_num': np.repeat(cell_gender_num, d)
+            })
+            p_dead = clf.predict_proba(X)[:, 1].reshape(cells, d)
+        U, P = LongevityEstimator.survival_matrices(p_dead)
+
+        disability_prevalence = LongevityEstimator.compute_disability_prevalence_by_age(df, prevalence_max_age,
+                                                                                        smooth_prevalence)
+        prevalences = disability_prevalence.curves(income_dcls, ages)
+        healthy = LongevityEstimator.prevalence_matrix(np.tile(prevalences, (len(genders), 1)))
+        total = np.broadcast_to(LongevityEstimator.total_life_matrix(d), healthy.shape)
+        return {'genders': genders, 'income_dcls': income_dcls, 'ages': ages, 'U': U, 'P': P,
+                'R': np.stack([healthy, total])}
 
     @staticmethod
-    def gini(y: np.array) -> float:
+    def grid_frame(chains: Dict[str, Any], **columns: np.array) -> pd.DataFrame:
         """
-        Calculate the Gini coefficient of a numpy array.
+        Arrange values computed on the grid of `compute_grid_chains` in a tidy dataframe
+        :param chains: the result of `compute_grid_chains`
+        :param columns: the values of each column (measures x cells x ages)
+        :return: a dataframe with one row per gender, income_dcl, measure and age
+        """
+        genders, income_dcls, ages = chains['genders'], chains['income_dcls'], chains['ages']
+        index = pd.MultiIndex.from_product([genders, income_dcls, MEASURES, ages],
+                                           names=['gender', 'income_dcl', 'measure', 'age'])
+        shape = (len(MEASURES), len(genders), len(income_dcls), len(ages))
+        return pd.DataFrame({name: values.reshape(shape).transpose(1, 2, 0, 3).ravel()
+                             for name, values in columns.items()}, index=index).reset_index()
+
+    @staticmethod
+    def compute_grid_estimates(df: pd.DataFrame, panel_df: pd.DataFrame, genders: Optional[Sequence[str]] = None,
+                               income_dcls: Optional[Sequence[int]] = None, coeffs: dict = None,
+                               ages: Optional[Sequence[int]] = None,
+                               prevalence_max_age: Optional[int] = PREVALENCE_MAX_AGE,
+                               model_cache: Optional[ModelCache] = None, smooth_prevalence: bool = False,
+                               hazard_model: Any = None) -> pd.DataFrame:
+        """
+        Compute the lifetime estimates of every (gender, income_dcl) subgroup, for both healthy
+        and total life, at once. This is equivalent to calling `compute_lifetime_estimates` on a
+        LongevityEstimator per subgroup, but the hazard model is fitted once, the death probabilities
+        of all subgroups are predicted in a single call and the moments of all subgroups and measures
+        are computed on a stack of matrices
+        :param df: a dataframe resulting from a call to longevity.DataManager.prepare_dataset
+        :param panel_df: a dataframe resulting from a call to longevity.DataManager.create_panel_dataset
+        :param genders: the genders of the grid, "male" and "female" by default
+        :param income_dcls: the income deciles of the grid, all the deciles in df by default
+        :param coeffs: optionally pass the coefficients of the LR
+        :param ages: the (consecutive) ages of the grid, from the youngest to the oldest age in df by default
+        :param prevalence_max_age: disability is only measured on observations younger than this age
+        :param model_cache: the cache of fitted hazard models, HAZARD_MODEL_CACHE by default
+        :param smooth_prevalence: whether to smooth the disability prevalence curves (see PrevalenceTable.smoothed)
+        :param hazard_model: optionally, the (unfitted) hazard model (see LongevityEstimator), `build_hazard_model`
+                             by default
+        :return: a tidy dataframe with one row per gender, income_dcl, measure ("healthy" or "total")
+                 and age, with the mean and the standard deviation of the remaining lifetime
+        """
+        chains = LongevityEstimator.compute_grid_chains(df, panel_df, genders, income_dcls, coeffs, ages,
+                                                        prevalence_max_age, model_cache, smooth_prevalence,
+                                                        hazard_model)
+        # measures x cells x ages
+        mu, m2 = reward_moments(chains['U'], chains['P'], chains['R'], k=2)
+        std = np.sqrt(m2 - mu * mu)
+        return LongevityEstimator.grid_frame(chains, mean=mu, std=std)
+
+    @staticmethod
+    def compute_grid_inequality(df: pd.DataFrame, panel_df: pd.DataFrame, genders: Optional[Sequence[str]] = None,
+                                income_dcls: Optional[Sequence[int]] = None, coeffs: dict = None,
+                                ages: Optional[Sequence[int]] = None,
+                                prevalence_max_age: Optional[int] = PREVALENCE_MAX_AGE,
+                                model_cache: Optional[ModelCache] = None, tail: float = 1e-12,
+                                smooth_prevalence: bool = False, hazard_model: Any = None) -> pd.DataFrame:
+        """
+        Compute the Gini and Theil coefficients of the remaining (healthy) lifetime of every
+        (gender, income_dcl) subgroup at every age, from the distributions given by the U and P
+        matrices (see longevity.markov.absorption_distribution) rather than from a sample
+        :param df: a dataframe resulting from a call to longevity.DataManager.prepare_dataset
+        :param panel_df: a dataframe resulting from a call to longevity.DataManager.create_panel_dataset
+        :param genders: the genders of the grid, "male" and "female" by default
+        :param income_dcls: the income deciles of the grid, all the deciles in df by default
+        :param coeffs: optionally pass the coefficients of the LR
+        :param ages: the (consecutive) ages of the grid, from the youngest to the oldest age in df by default
+        :param prevalence_max_age: disability is only measured on observations younger than this age
+        :param model_cache: the cache of fitted hazard models, HAZARD_MODEL_CACHE by default
+        :param tail: the probability of living longer than the last value of the distributions
+        :param smooth_prevalence: whether to smooth the disability prevalence curves (see PrevalenceTable.smoothed)
+        :param hazard_model: optionally, the (unfitted) hazard model (see LongevityEstimator), `build_hazard_model`
+                             by default
+        :return: a tidy dataframe with one row per gender, income_dcl, measure ("healthy" or "total")
+                 and age, with the Gini and Theil coefficients of the remaining lifetime
+        """
+        chains = LongevityEstimator.compute_grid_chains(df, panel_df, genders, income_dcls, coeffs, ages,
+                                                        prevalence_max_age, model_cache, smooth_prevalence,
+                                                        hazard_model)
+        # measures x cells x ages x values
+        values, probabilities = absorption_distribution(chains['U'], chains['P'], chains['R'], tail)
+        order = np.argsort(values, axis=-1, kind='stable')
+        values = np.take_along_axis(values, order, axis=-1)
+        probabilities = np.take_along_axis(probabilities, order, axis=-1)
+        return LongevityEstimator.grid_frame(
+            chains,
+            gini=LongevityEstimator.gini(values, probabilities, axis=-1, presorted=True),
+            theil=LongevityEstimator.theil(values, probabilities, axis=-1))
+
+    @staticmethod
+    def gini(y: np.array, weights: Optional[np.array] = None, axis: Optional[int] = None,
+             presorted: bool = False) -> Union[float, np.array]:
+        """
+        Calculate the (weighted) Gini coefficient of a numpy array, or of each of its slices
+        along an axis. Values are shifted to be positive (as the coefficient is only defined for
+        non-negative values) and the arrays passed are never modified
         :param y: the array for which to compute the coefficient
-        :return: the Gini coefficient
+        :param weights: optionally the weight (e.g. the probability) of each value, broadcastable to y
+        :param axis: the axis along which to compute the coefficients, all values are treated equally if None
+        :param presorted: whether the values are already sorted along the axis
+        :return: the Gini coefficient, or an array of coefficients
         """
-        y = y.flatten()  # all values are treated equally, arrays must be 1d
-        if np.amin(y) < 0:
-            y -= np.amin(y)  # values cannot be negative
-        y += 0.0000001  # values cannot be 0
-        y = np.sort(y)  # values must be sorted
-        index = np.arange(1, y.shape[0] + 1)  # index per array element
-        n = y.shape[0]  # number of array elements
-        return np.sum((2 * index - n - 1) * y) / (n * np.sum(y))  # Gini coefficient
+        y = np.asarray(y, dtype=float)
+        weights = np.ones(1) if weights is None else np.asarray(weights, dtype=float)
+        if axis is None:
+            y, weights = y.ravel(), np.broadcast_to(weights, y.shape).ravel()
+            axis = 0
+        y, weights = np.moveaxis(y, axis, -1), np.moveaxis(np.broadcast_to(weights, y.shape), axis, -1)
+        if not presorted:
+            order = np.argsort(y, axis=-1, kind='stable')
+            y, weights = np.take_along_axis(y, order, axis=-1), np.take_along_axis(weights, order, axis=-1)
+
+        # values cannot be negative nor 0: shift them by the same offset
+        offset = 0.0000001 - np.minimum(y.min(axis=-1, keepdims=True), 0)
+        cumulative_weights = np.cumsum(weights, axis=-1)
+        # Lorenz curve at the end of each value
+        lorenz = np.cumsum(weights * y, axis=-1) + offset * cumulative_weights
+        lorenz = lorenz / lorenz[..., -1:]
+        lorenz_before = np.concatenate([np.zeros(lorenz.shape[:-1] + (1,)), lorenz[..., :-1]], axis=-1)
+        gini = 1 - (weights * (lorenz_before + lorenz)).sum(axis=-1) / cumulative_weights[..., -1]
+        return gini if gini.ndim else float(gini)
 
     @staticmethod
-    def theil(y: np.array) -> float:
+    def theil(y: np.array, weights: Optional[np.array] = None, axis: int = 0) -> Union[float, np.array]:
         """
-        Calculate the Theil coefficient of a numpy array.
+        Calculate the (weighted) Theil coefficient of a numpy array, or of each of its slices along
+        an axis. Zero values do not contribute and the arrays passed are never modified
         :param y: the array for which to compute the coefficient
-        :return: the Theil coefficient
-        """
-        n = len(y)
-        y = y + 1e-08 * (y == 0)
-        yt = y.sum(axis=0)
-        s = y / (yt * 1.0)
-        lns = np.log(n * s)
-        slns = s * lns
-        t = sum(slns)
-        return t
+        :param weights: optionally the weight (e.g. the probability) of each value, broadcastable to y
+        :param axis: the axis along which to compute the coefficients
+        :return: the Theil coefficient, or an array of coefficients
+        """
+        from scipy.special import xlogy
+
+        y = np.asarray(y, dtype=float)
+        weights = np.ones(1) if weights is None else np.asarray(weights, dtype=float)
+        weights = np.broadcast_to(weights, y.shape)
+        total_weight = weights.sum(axis=axis, keepdims=True)
+        mean = (weights * y).sum(axis=axis, keepdims=True) / total_weight
+        ratio = y / mean
+        t = (weights * xlogy(ratio, ratio)).sum(axis=axis) / np.squeeze(total_weight, axis=axis)
+        return t if t.ndim else float(t)
@@ -0,0 +1,330 @@
+import json
+import os
+import shutil
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+
+import numpy as np
+import pandas as pd
+
+from longevity import cache
+from longevity.data_manager import DataManager, _concat_chunks, _drop_unused_categories, _to_numeric
+
+STATE_FILE = 'state.json'
+# version of the layout of the frames listed in the state file
+STATE_FORMAT = 2
+# number of partitions the individuals are spread over, by a hash of their mergeid
+PARTITIONS = 32
+
+
+def _concat(frames: List[Optional[pd.DataFrame]]) -> Optional[pd.DataFrame]:
+    """
+    Concatenate frames with the same columns, unioning the categories of categorical columns
+    :param frames: the frames to concatenate, None or empty frames are skipped
+    :return: the concatenated frame, None if there is none
+    """
+    frames = [frame for frame in frames if frame is not None and len(frame)]
+    if not frames:
+        return None
+    return _concat_chunks(frames) if len(frames) > 1 else frames[0]
+
+
+def _changed_deaths(old: pd.DataFrame, new: pd.DataFrame) -> pd.Index:
+    """
+    Find the individuals whose record in the cover screens is new, removed or different
+    :param old: the previous cover screens data-set, indexed by mergeid
+    :param new: the new cover screens data-set, indexed by mergeid
+    :return: the mergeid of the changed individuals
+    """
+    joined = pd.concat([old['deceased_age'].astype(object).rename('old'),
+                        new['deceased_age'].astype(object).rename('new')], axis=1)
+    same = (joined['old'] == joined['new']) | (joined['old'].isna() & joined['new'].isna())
+    return pd.Index(joined.index[~same.to_numpy()].astype(str))
+
+
+def partition_of(mergeid: Any, partitions: int) -> np.array:
+    """
+    Compute the partition of some individuals from a hash of their mergeid, which is the same in every run
+    :param mergeid: the mergeid of the individuals
+    :param partitions: the number of partitions
+    :return: the partition of each individual
+    """
+    mergeid = pd.Index(mergeid).astype(str).to_numpy(dtype=object)
+    return (pd.util.hash_array(mergeid) % np.uint64(partitions)).astype(int)
+
+
+def _wave_keys(df: pd.DataFrame) -> pd.MultiIndex:
+    """
+    The (mergeid, wave) of the rows of a raw frame
+    """
+    return pd.MultiIndex.from_arrays([df['mergeid'].astype(str), df['wave']])
+
+
+class IncrementalDataset:
+    """
+    Cleaned data-set and panel of the share data-set kept across runs. The steps of
+    DataManager.prepare_dataset work row by row, so when a new wave of the EasyShare
+    data-set arrives only its rows are cleaned and appended to the cleaned rows. The
+    stored raw rows are only cleaned again for the individuals whose record in new
+    cover screens changed, and only their panel is rebuilt. The rows of the panel are
+    the cleaned rows, except for the last row of the dead, which depends on their whole
+    history: it is kept apart, so that the panel of the new rows is appended and only
+    the last row of a dead individual with new rows is replaced. The result is the
+    same (up to the order of the rows and of the categories) as cleaning the whole
+    history with DataManager.
+
+    The individuals are spread over `partitions` partitions by a hash of their mergeid.
+    Each partition keeps its raw rows, its cleaned rows and its panel as one part per
+    update: an update appends new parts, and existing parts are only rewritten when
+    they lose rows (replaced by a wave file, or of individuals cleaned or rebuilt
+    again). `save` only writes the frames which changed. The frames are stored in
+    `directory` in the columnar format of longevity.cache and memory mapped when loaded
+    """
+
+    def __init__(self, directory: str, start_age: int = 65, end_age: int = 90, income_bins: int = 10,
+                 partitions: int = PARTITIONS, verbose: bool = False):
+        """
+        Initialize an IncrementalDataset object, loading the state stored in `directory` if any
+        :param directory: directory where the state is stored
+        :param start_age: Minimum age for the analysis
+        :param end_age: Maximum age for the analysis
+        :param income_bins: maximum number of bins
+        :param partitions: the number of partitions of the individuals
+        :param verbose: parameter to control whether to print messages
+        """
+        self.directory = directory
+        self.params = {'start_age': start_age, 'end_age': end_age, 'income_bins': income_bins}
+        self.partitions = partitions
+        self.verbose = verbose
+        self.files: Dict[str, Dict[str, Any]] = {}
+        # the frames by name: "deaths", and per partition "raw-<partition>-<part>", "df-<partition>-<part>",
+        # "panel_df-<partition>-<part>" and "panel_tail-<partition>-<part>" (the last panel rows of the dead)
+        self.frames: Dict[str, pd.DataFrame] = {}
+        # where each frame is stored (relative to `directory`) and the frames changed since
+        self.paths: Dict[str, str] = {}
+        self.changed: Set[str] = set()
+        self.version = 0
+        self._merged: Dict[str, Optional[pd.DataFrame]] = {}
+
+        state_path = os.path.join(directory, STATE_FILE)
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+            if state.get('format') != STATE_FORMAT:
+                raise ValueError('The data-set in {} is stored in an older format, it has to be ingested again'.format(
+                    directory))
+            if state['params'] != self.params or state['partitions'] != partitions:
+                raise ValueError('The data-set in {} was cleaned with {} in {} partitions, not {} in {}'.format(
+                    directory, state['params'], state['partitions'], self.params, partitions))
+            self.files = state['files']
+            self.version = state['version']
+            self.paths = state['frames']
+            for name, path in self.paths.items():
+                self.frames[name] = cache.load_frame(os.path.join(directory, path))
+
+    def _parts(self, kind: str, partition: int) -> List[str]:
+        """
+        The names of the parts of a kind ("raw", "df", "panel_df" or "panel_tail") of a partition, from the oldest
+        """
+        prefix = '{}-{}-'.format(kind, partition)
+        return sorted((name for name in self.frames if name.startswith(prefix)),
+                      key=lambda name: int(name[len(prefix):]))
+
+    def _partition_frames(self, kind: str) -> List[pd.DataFrame]:
+        """
+        The parts of a kind ("df", "panel_df" or "panel_tail") of every partition
+        """
+        return [self.frames[name] for partition in range(self.partitions) for name in self._parts(kind, partition)]
+
+    @property
+    def df(self) -> Optional[pd.DataFrame]:
+        """
+        The cleaned data-set, as returned by DataManager.prepare_dataset
+        """
+        if 'df' not in self._merged:
+            df = _concat(self._partition_frames('df'))
+            if df is not None:
+                df = df.copy(deep=False)
+                df.index = pd.CategoricalIndex(df['mergeid'], name='mergeid')
+                df = _drop_unused_categories(df)
+            self._merged['df'] = df
+        return self._merged['df']
+
+    @property
+    def panel_df(self) -> Optional[pd.DataFrame]:
+        """
+        The panel data-set, as returned by DataManager.create_panel_dataset
+        """
+        if 'panel_df' not in self._merged:
+            panel_df = _concat(self._partition_frames('panel_df') + self._partition_frames('panel_tail'))
+            if panel_df is not None:
+                # the rows of an individual are in several parts, they are put back together and ordered by age
+                mergeid_codes = pd.factorize(panel_df['mergeid'], sort=True)[0]
+                panel_df = panel_df.take(np.lexsort((panel_df['age'].to_numpy(), mergeid_codes)))
+                panel_df = _drop_unused_categories(panel_df.reset_index(drop=True))
+            self._merged['panel_df'] = panel_df
+        return self._merged['panel_df']
+
+    def _set(self, name: str, frame: Optional[pd.DataFrame]) -> None:
+        """
+        Replace a frame, None or an empty frame removes it
+        """
+        if frame is None or not len(frame):
+            self.frames.pop(name, None)
+        else:
+            self.frames[name] = frame
+        self.changed.add(name)
+
+    def _append(self, kind: str, partition: int, frame: Optional[pd.DataFrame]) -> None:
+        """
+        Add a part to a partition, unless the frame is None or empty
+        """
+        if frame is not None and len(frame):
+            parts = self._parts(kind, partition)
+            number = int(parts[-1].rsplit('-', 1)[-1]) + 1 if parts else 0
+            self._set('{}-{}-{}'.format(kind, partition, number), frame)
+
+    def _drop_rows(self, kind: str, partition: int, dropped: Callable[[pd.DataFrame], np.array]) -> None:
+        """
+        Remove rows from the parts of a partition, only the parts losing rows are replaced
+        :param kind: the kind of the parts
+        :param partition: the partition
+        :param dropped: a function returning whether each row of a part is removed
+        """
+        for name in self._parts(kind, partition):
+            part = self.frames[name]
+            mask = dropped(part)
+            if mask.any():
+                part = part[~mask]
+                self._set(name, part if kind == 'raw' else _drop_unused_categories(part))
+
+    def _is_new(self, path: str) -> bool:
+        """
+        Check whether a file differs from the version already ingested from the same path
+        """
+        known = self.files.get(os.path.abspath(path))
+        return known is None or known['sha256'] != cache.file_fingerprint(path, self.directory)['sha256']
+
+    def update(self, easy_share_dta_paths: Sequence[str] = (),
+               share_death_dta_path: Optional[str] = None) -> pd.Index:
+        """
+        Ingest new or updated EasyShare waves and/or new cover screens. The rows of a wave
+        file replace the rows already ingested for the same individual and wave. Files which
+        did not change since they were ingested are skipped
+        :param easy_share_dta_paths: paths to EasyShare data-sets with new or updated waves
+        :param share_death_dta_path: path to the latest Share cover screens data-set (needed on the first update)
+        :return: the mergeid of the individuals with new rows or whose record in the cover screens changed
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        deaths = self.frames.get('deaths')
+        changed = pd.Index([], dtype=object)
+
+        if share_death_dta_path is not None and self._is_new(share_death_dta_path):
+            new_deaths = DataManager.read_deaths(share_death_dta_path)
+            if deaths is not None:
+                changed = _changed_deaths(deaths, new_deaths)
+            deaths = new_deaths
+            self._set('deaths', deaths)
+            self.files[os.path.abspath(share_death_dta_path)] = cache.file_fingerprint(share_death_dta_path,
+                                                                                      self.directory)
+        if deaths is None:
+            raise ValueError('The cover screens data-set is needed on the first update')
+
+        new_rows = []
+        for path in easy_share_dta_paths:
+            if self._is_new(path):
+                new_rows.append(DataManager.read_easy_share(path))
+                self.files[os.path.abspath(path)] = cache.file_fingerprint(path, self.directory)
+        new_raw = _concat(new_rows)
+        affected = changed
+        if new_raw is not None:
+            affected = affected.union(pd.Index(new_raw['mergeid'].unique().astype(str)))
+
+        affected_partitions = partition_of(affected, self.partitions)
+        changed_partitions = partition_of(changed, self.partitions)
+        new_partitions = None if new_raw is None else partition_of(new_raw['mergeid'], self.partitions)
+        for partition in np.unique(affected_partitions):
+            self._update_partition(int(partition), changed[changed_partitions == partition], deaths,
+                                   None if new_raw is None else new_raw[new_partitions == partition])
+        self._merged = {}
+        return affected
+
+    def _update_partition(self, partition: int, changed: pd.Index, deaths: pd.DataFrame,
+                          new_raw: Optional[pd.DataFrame]) -> None:
+        """
+        Clean the new rows of a partition and the stored rows of its individuals whose record in the
+        cover screens changed, and update the panel of the individuals concerned
+        :param partition: the partition
+        :param changed: the mergeid of the individuals of the partition whose record in the cover screens changed
+        :param deaths: the cover screens data-set, indexed by mergeid
+        :param new_raw: the new raw rows of the partition
+        """
+        new_keys = _wave_keys(new_raw) if new_raw is not None and len(new_raw) else None
+
+        def replaced(frame: pd.DataFrame) -> np.array:
+            # the rows of the same individual and wave as a new row
+            return _wave_keys(frame).isin(new_keys) if new_keys is not None else np.zeros(len(frame), dtype=bool)
+
+        # the new raw rows replace the stored ones of the same wave, the other stored rows of the changed
+        # individuals are cleaned again with the new rows
+        self._drop_rows('raw', partition, replaced)
+        history = [part[part['mergeid'].isin(changed).to_numpy()]
+                   for part in (self.frames[name] for name in self._parts('raw', partition))]
+        self._append('raw', partition, new_raw)
+        history = _concat(history + [new_raw])
+
+        self._drop_rows('df', partition, lambda part: part['mergeid'].isin(changed).to_numpy() | replaced(part))
+        df_delta = None
+        if history is not None:
+            merged = pd.merge(history, deaths, how='left', left_index=True, right_index=True)
+            df_delta = DataManager.from_frame(DataManager._compact_raw_columns(merged), self.verbose).prepare_dataset(
+                **self.params)
+            self._append('df', partition, _drop_unused_categories(df_delta))
+
+        # the panel of an individual is made of their cleaned rows taken one by one (with y = 0), except for the
+        # last rows of the dead, which depend on their whole history and are kept apart in the "panel_tail" parts.
+        # The panel of the changed individuals is rebuilt, the dead with new rows only get new last rows
+        new_ids = pd.Index([] if new_raw is None else new_raw['mergeid'].unique().astype(str))
+        dead = _to_numeric(deaths['deceased_age'].reindex(new_ids)).notna().to_numpy()
+        dead_new = new_ids[dead].difference(changed)
+        rebuilt = changed.union(dead_new)
+        self._drop_rows('panel_df', partition, lambda part: part['mergeid'].isin(changed).to_numpy() | replaced(part))
+        self._drop_rows('panel_tail', partition,
+                        lambda part: part['mergeid'].isin(rebuilt).to_numpy() | replaced(part))
+        rows = [part[part['mergeid'].isin(rebuilt).to_numpy()]
+                for part in (self.frames[name] for name in self._parts('df', partition))]
+        if df_delta is not None:
+            rows.append(df_delta[~df_delta['mergeid'].isin(rebuilt).to_numpy()])
+        rows = [frame for frame in rows if len(frame)]
+        if not rows:
+            return
+        panel_df = DataManager.create_panel_dataset(_concat_chunks(rows) if len(rows) > 1 else rows[0])
+        tail = panel_df['y'].to_numpy() == 1
+        body = panel_df[~tail]
+        # the rows of the dead with new rows which are already in the panel
+        kept = [_wave_keys(part[part['mergeid'].isin(dead_new).to_numpy()])
+                for part in (self.frames[name] for name in self._parts('panel_df', partition))]
+        if kept:
+            body = body[~_wave_keys(body).isin(kept[0].append(kept[1:]))]
+        self._append('panel_df', partition, _drop_unused_categories(body.reset_index(drop=True)))
+        self._append('panel_tail', partition, _drop_unused_categories(panel_df[tail].reset_index(drop=True)))
+
+    def save(self) -> None:
+        """
+        Store the changed frames in `directory`, each in a new directory. The state listing the
+        current directory of every frame is then replaced atomically, and the directories which
+        are no longer listed are removed
+        """
+        version = self.version + 1
+        paths = dict(self.paths)
+        for name in sorted(self.changed):
+            paths.pop(name, None)
+            if name in self.frames:
+                paths[name] = os.path.join('frames', '{}.{}'.format(name, version))
+                cache.save_frame(self.frames[name], os.path.join(self.directory, paths[name]))
+        state = {'format': STATE_FORMAT, 'params': self.params, 'partitions': self.partitions, 'files': self.files,
+                 'version': version, 'frames': paths}
+        cache._atomic_write_json(state, os.path.join(self.directory, STATE_FILE))
+
+        for path in set(self.paths.values()) - set(paths.values()):
+            shutil.rmtree(os.path.join(self.directory, path), ignore_errors=True)
+        self.paths, self.changed, self.version = paths, set(), version
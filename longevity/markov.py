@@ -0,0 +1,219 @@
+from math import comb
+from typing import Callable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# below this survivorship the closed-form solution loses precision, the recurrence is used instead
+MIN_SURVIVORSHIP = 1e-250
+
+
+def _stay_diagonal(M: np.array, d: int) -> np.array:
+    """
+    Gather the entries of a (stack of) matrices on the transitions of a survival
+    chain among its d transient states: from each age to the next one, and
+    from the open-ended last age class to itself
+    :param M: a matrix with at least d rows and columns (... x n x n)
+    :param d: the number of transient states
+    :return: the d entries (... x d)
+    """
+    return np.concatenate([np.diagonal(M, offset=-1, axis1=-2, axis2=-1)[..., :d - 1], M[..., d - 1, d - 1:d]],
+                          axis=-1)
+
+
+def is_survival_matrix(U: np.array) -> bool:
+    """
+    Check whether U only has survival transitions to the next age (sub-diagonal)
+    and an open-ended last age class (last diagonal element)
+    :param U: the U matrix, or a stack of U matrices
+    :return: True if every matrix has this structure
+    """
+    d = U.shape[-1]
+    return np.array_equal(np.count_nonzero(U, axis=(-2, -1)), np.count_nonzero(_stay_diagonal(U, d), axis=-1))
+
+
+def _survival_solver(U: np.array, structured: Optional[bool] = None) -> Callable[[np.array], np.array]:
+    """
+    Prepare the solution of (I - U)^T x = b for several right hand sides. When U is
+    a survival matrix (see `is_survival_matrix`) the system is upper bidiagonal and it
+    is solved by back-substitution in closed form: x_i = sum_{j >= i} l_j b_j / l_i,
+    with l the survivorship. Any other U falls back to a dense solve
+    :param U: the U matrix (d x d), or a stack of U matrices (... x d x d)
+    :param structured: whether U is known to be a survival matrix (checked if not given)
+    :return: a function mapping b (... x d x m) to N^T b
+    """
+    d = U.shape[-1]
+    if structured is None:
+        structured = is_survival_matrix(U)
+    if not structured:
+        transposed = np.swapaxes(np.eye(d) - U, -1, -2)
+        return lambda b: np.linalg.solve(transposed, b)
+
+    survival = np.diagonal(U, offset=-1, axis1=-2, axis2=-1)
+    tail_scale = 1 / (1 - U[..., d - 1, d - 1:d])
+
+    # survivorship l_j = prod_{k < j} survival_k
+    l = np.concatenate([np.ones(survival.shape[:-1] + (1,)), np.cumprod(survival, axis=-1)], axis=-1)[..., None]
+    closed_form = np.all(l > MIN_SURVIVORSHIP)
+
+    def solve(b: np.array) -> np.array:
+        x = np.array(b, dtype=float)
+        x[..., d - 1, :] *= tail_scale
+        if closed_form:
+            return np.cumsum((l * x)[..., ::-1, :], axis=-2)[..., ::-1, :] / l
+        for i in range(d - 2, -1, -1):
+            x[..., i, :] += survival[..., i, None] * x[..., i + 1, :]
+        return x
+
+    return solve
+
+
+def solve_survival_system(U: np.array, b: np.array) -> np.array:
+    """
+    Compute N^T b where N = (I - U)^-1 is the fundamental matrix, without inverting I - U
+    :param U: the U matrix (d x d), or a stack of U matrices (... x d x d)
+    :param b: the right hand side (... x d), or several right hand sides (... x d x m)
+    :return: N^T b, with the shape of b
+    """
+    solve = _survival_solver(U)
+    if b.ndim == U.ndim - 1:
+        return solve(b[..., None])[..., 0]
+    return solve(b)
+
+
+def _next_state(x: np.array) -> np.array:
+    """
+    Gather, for every state of a survival chain, the value of the state it survives to
+    (the next age, or the last age itself for the open-ended age class)
+    :param x: values by state (... x d)
+    :return: values of the next state (... x d)
+    """
+    return np.concatenate([x[..., 1:], x[..., -1:]], axis=-1)
+
+
+def reward_moments(U: np.array, P: np.array, R: Union[np.array, Sequence[np.array]], k: int = 3) -> \
+        Tuple[np.array, ...]:
+    """
+    Compute the first k moments of the rewards accumulated before absorption,
+    as defined in Caswell, Zarulli (2018):
+    rho_k = N^T (Z (P o R_k)^T 1 + sum_{i=1}^{k-1} C(k, i) (U o R~_i)^T rho_{k-i}) with R~_i = Z R_i Z^T
+    For survival matrices only the non-zero transitions are used, so the cost is linear in d
+    :param U: the U matrix (d x d), or a stack of U matrices (... x d x d)
+    :param P: the P matrix ((d + 1) x (d + 1)), or a stack of P matrices
+    :param R: the reward matrix used for all moments, or a sequence with the matrix of each moment
+    :param k: the number of moments to compute
+    :return: a tuple with the k moments (arrays of shape ... x d, one value per starting state)
+    """
+    d = U.shape[-1]
+    if isinstance(R, np.ndarray):
+        R = [R] * k
+
+    structured = is_survival_matrix(U)
+    solve = _survival_solver(U, structured)
+    if structured:
+        # probability and rewards of the transition out of each state which stays among the transient states
+        stay = _stay_diagonal(U, d)
+        stay_rewards = [_stay_diagonal(R_n, d) for R_n in R]
+
+        def transient_reward(n):
+            return stay * stay_rewards[n - 1]
+
+        def weighted_rho(i, rho_i):
+            # (U o R~_i)^T rho_i
+            return stay * stay_rewards[i - 1] * _next_state(rho_i)
+    else:
+        def transient_reward(n):
+            return (U * R[n - 1][..., :d, :d]).sum(axis=-2)
+
+        def weighted_rho(i, rho_i):
+            return np.einsum('...ij,...i->...j', U * R[i - 1][..., :d, :d], rho_i)
+
+    rho = []
+    for n in range(1, k + 1):
+        # Z (P o R_n)^T 1: expected reward of the transitions out of each transient state
+        rhs = transient_reward(n) + (P[..., d:, :d] * R[n - 1][..., d:, :d]).sum(axis=-2)
+        for i in range(1, n):
+            rhs = rhs + comb(n, i) * weighted_rho(i, rho[n - i - 1])
+        rho.append(solve(rhs[..., None])[..., 0])
+    return tuple(rho)
+
+
+def absorption_distribution(U: np.array, P: np.array, R: np.array, tail: float = 1e-12, max_steps: int = 10000) -> \
+        Tuple[np.array, np.array]:
+    """
+    Compute the distribution of the rewards accumulated before absorption from each starting state
+    of a survival chain (see `is_survival_matrix`). From a given state the chain can only survive
+    to the next age or die, so the accumulated reward is a function of the time of death and its
+    distribution is the one of the time of death: l_t q_t / l_i for death on the t-th transition,
+    computed for all the starting states and steps at once. The open-ended last age class gives an
+    unbounded time of death, which is cut after the number of steps leaving less than `tail`
+    probability of still being alive; the probability left is added to the last step
+    :param U: the U matrix (d x d), or a stack of U matrices (... x d x d)
+    :param P: the P matrix ((d + 1) x (d + 1)), or a stack of P matrices
+    :param R: the reward matrix ((d + 1) x (d + 1)), or a stack of reward matrices
+    :param tail: the probability of still being alive after the last step
+    :param max_steps: the maximum number of steps
+    :return: the accumulated reward and the probability of dying on each step, from each starting
+             state (read-only arrays of shape ... x d x steps)
+    """
+    d = U.shape[-1]
+    if not is_survival_matrix(U):
+        raise ValueError('The distribution of the rewards can only be computed for survival matrices')
+
+    stay = _stay_diagonal(U, d)
+    last_stay = stay[..., d - 1].max(initial=0.)
+    if last_stay >= 1:
+        raise ValueError('The last age class has no death, the time of death is unbounded')
+    steps = d + (int(np.ceil(np.log(tail) / np.log(last_stay))) if last_stay > 0 else 0)
+    steps = min(steps, max_steps)
+
+    # state of the chain after each step, from each starting state
+    state = np.minimum(np.arange(d)[:, None] + np.arange(steps), d - 1)
+    stay_path = stay[..., state]
+    alive = np.cumprod(stay_path, axis=-1)
+    probabilities = P[..., d, :d][..., state] * np.concatenate([np.ones(alive.shape[:-1] + (1,)), alive[..., :-1]],
+                                                              axis=-1)
+    probabilities[..., -1] += alive[..., -1]
+
+    # reward of the years survived before the step of death, then of the death itself
+    stay_reward = _stay_diagonal(R, d)[..., state]
+    survived = np.cumsum(stay_reward, axis=-1) - stay_reward
+    rewards = survived + R[..., d, :d][..., state]
+    shape = np.broadcast_shapes(rewards.shape, probabilities.shape)
+    return np.broadcast_to(rewards, shape), np.broadcast_to(probabilities, shape)
+
+
+def survival_reward_sensitivities(U: np.array, P: np.array, R: np.array, rho: np.array, dp_dead: np.array,
+                                  d_stay_rewards: Optional[np.array] = None,
+                                  d_death_rewards: Optional[np.array] = None) -> np.array:
+    """
+    Compute the derivatives of the expected rewards accumulated before absorption (the first moment
+    of `reward_moments`) of a survival chain with respect to several parameters, as in Caswell (2013):
+    d rho = N^T (Z (dP o R + P o dR)^T 1 + dU^T rho). From each state the chain survives with
+    probability s or dies with probability q = 1 - s, so for each parameter the right hand side is
+    dq (D - r - rho') + s dr + q dD, with r and D the rewards of surviving and dying and rho' the
+    expected reward of the next state. All the parameters share the back-substitution of N^T
+    :param U: the U matrix (d x d), or a stack of U matrices (... x d x d)
+    :param P: the P matrix ((d + 1) x (d + 1)), or a stack of P matrices
+    :param R: the reward matrix ((d + 1) x (d + 1)), or a stack of reward matrices
+    :param rho: the expected rewards (... x d), as returned by `reward_moments`
+    :param dp_dead: the derivative of the probability of dying at each age with respect to each parameter
+                    (... x m x d)
+    :param d_stay_rewards: optionally the derivative of the reward of surviving each age (... x m x d)
+    :param d_death_rewards: optionally the derivative of the reward of dying at each age (... x m x d)
+    :return: the derivative of the expected reward from each starting state with respect to each
+             parameter (... x m x d)
+    """
+    d = U.shape[-1]
+    if not is_survival_matrix(U):
+        raise ValueError('The sensitivities can only be computed for survival matrices')
+
+    stay = _stay_diagonal(U, d)[..., None, :]
+    death = P[..., d, :d][..., None, :]
+    stay_rewards = _stay_diagonal(R, d)[..., None, :]
+    death_rewards = R[..., d, :d][..., None, :]
+    rhs = dp_dead * (death_rewards - stay_rewards - _next_state(rho)[..., None, :])
+    if d_stay_rewards is not None:
+        rhs = rhs + stay * d_stay_rewards
+    if d_death_rewards is not None:
+        rhs = rhs + death * d_death_rewards
+    return np.swapaxes(_survival_solver(U, True)(np.swapaxes(rhs, -1, -2)), -1, -2)
@@ -0,0 +1,151 @@
+from math import comb
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+
+# index of the health states of `healthy_rewards`
+HEALTHY, DISABLED = 0, 1
+
+
+class MultistateChain:
+    """
+    Absorbing Markov chain over (age x health state) transient states and death, stored as a
+    scipy.sparse matrix. From each transient state the chain either dies or survives to the next
+    age, moving between health states on the way, and the last age is an open-ended age class.
+    Every transient state has at most `states` successors, so building the chain and solving for
+    the moments of the rewards are linear in the number of transient states, which allows fine
+    age steps and long age ranges. With a single health state and yearly steps this is the chain
+    of LongevityEstimator.compute_UP
+    """
+
+    def __init__(self, p_dead: np.array, transitions: Optional[np.array] = None, start_age: float = 0.,
+                 step: float = 1.):
+        """
+        Initialize a MultistateChain object
+        :param p_dead: the probability of dying during a step from each state (ages x states)
+        :param transitions: the probability of moving from each state (axis 1) to each state of the next
+                            age (axis 2) for the survivors (ages x states x states), staying in the same
+                            state by default
+        :param start_age: the age of the first age class
+        :param step: the length of an age class in years
+        """
+        self.p_dead = np.asarray(p_dead, dtype=float)
+        self.ages, self.states = self.p_dead.shape
+        if transitions is None:
+            transitions = np.broadcast_to(np.eye(self.states), (self.ages, self.states, self.states))
+        self.transitions = np.asarray(transitions, dtype=float)
+        self.start_age = start_age
+        self.step = step
+        self.n = self.ages * self.states
+
+        # transient state (age, state) is number age * states + state, every state of an age leads to
+        # every state of the next age (or of the last age for the open-ended age class)
+        age, state, next_state = np.indices((self.ages, self.states, self.states)).reshape(3, -1)
+        self._rows = age * self.states + state
+        self._columns = np.minimum(age + 1, self.ages - 1) * self.states + next_state
+        self._survival = ((1 - self.p_dead)[..., None] * self.transitions).ravel()
+        # transient transitions (from x to), i.e. the transpose of U in Caswell, Zarulli (2018)
+        self.T = self._transition_matrix(self._survival)
+        self._lu = None
+
+    @staticmethod
+    def step_probabilities(annual: np.array, step: float) -> np.array:
+        """
+        Convert yearly probabilities (e.g. of dying) to probabilities over a step, assuming
+        a constant rate within the year
+        :param annual: the yearly probabilities
+        :param step: the length of a step in years
+        :return: the probabilities over a step
+        """
+        return 1 - (1 - np.asarray(annual, dtype=float)) ** step
+
+    @staticmethod
+    def from_survival(p_dead: np.array, start_age: float = 0., step: float = 1.) -> 'MultistateChain':
+        """
+        Build the chain with a single health state, i.e. the chain of LongevityEstimator.compute_UP
+        :param p_dead: the probability of dying during a step at each age
+        :param start_age: the age of the first age class
+        :param step: the length of an age class in years
+        :return: the chain
+        """
+        return MultistateChain(np.asarray(p_dead, dtype=float)[:, None], start_age=start_age, step=step)
+
+    @property
+    def age_classes(self) -> np.array:
+        """
+        The age at the start of each age class
+        """
+        return self.start_age + self.step * np.arange(self.ages)
+
+    def _transition_matrix(self, values: np.array) -> scipy.sparse.csr_matrix:
+        """
+        Build a sparse matrix with the structure of the transient transitions
+        :param values: the value of each transition, in the order of `_survival`
+        :return: a sparse (transient states x transient states) matrix
+        """
+        return scipy.sparse.csr_matrix((values, (self._rows, self._columns)), shape=(self.n, self.n))
+
+    def solve(self, b: np.array) -> np.array:
+        """
+        Compute N^T b where N is the fundamental matrix, i.e. solve (I - T) x = b. The factorization
+        keeps the natural order of the states, in which I - T is triangular but for the last age,
+        so it has no fill-in and it is computed once for all the right hand sides
+        :param b: the right hand side (n), or several right hand sides (n x m)
+        :return: the solution, with the shape of b
+        """
+        if self._lu is None:
+            system = (scipy.sparse.identity(self.n, format='csc') - self.T).tocsc()
+            self._lu = scipy.sparse.linalg.splu(system, permc_spec='NATURAL')
+        return self._lu.solve(np.asarray(b, dtype=float))
+
+    def reward_moments(self, stay_rewards: Union[np.array, Sequence[np.array]],
+                       death_rewards: Union[np.array, Sequence[np.array]], k: int = 3) -> Tuple[np.array, ...]:
+        """
+        Compute the first k moments of the rewards accumulated before death, as defined in Caswell,
+        Zarulli (2018) and as longevity.markov.reward_moments does for dense matrices:
+        rho_k = N^T (Z (P o R_k)^T 1 + sum_{i=1}^{k-1} C(k, i) (U o R~_i)^T rho_{k-i})
+        :param stay_rewards: the reward of each transition between transient states (ages x states x states,
+                             or broadcastable to it), or a sequence with the rewards of each moment
+        :param death_rewards: the reward of dying from each state (ages x states, or broadcastable to it),
+                              or a sequence with the rewards of each moment
+        :param k: the number of moments to compute
+        :return: a tuple with the k moments, one value per transient state (ages x states)
+        """
+        shape = (self.ages, self.states, self.states)
+        if isinstance(stay_rewards, np.ndarray):
+            stay_rewards = [stay_rewards] * k
+        if isinstance(death_rewards, np.ndarray):
+            death_rewards = [death_rewards] * k
+        weighted = [self._survival * np.broadcast_to(rewards, shape).ravel() for rewards in stay_rewards[:k]]
+        death = [(self.p_dead * np.broadcast_to(rewards, shape[:2])).ravel() for rewards in death_rewards[:k]]
+
+        rho = []
+        for n in range(1, k + 1):
+            # expected reward of the transitions out of each transient state
+            rhs = np.bincount(self._rows, weighted[n - 1], minlength=self.n) + death[n - 1]
+            for i in range(1, n):
+                rhs += comb(n, i) * (self._transition_matrix(weighted[i - 1]) @ rho[n - i - 1])
+            rho.append(self.solve(rhs))
+        return tuple(moment.reshape(self.ages, self.states) for moment in rho)
+
+    def total_rewards(self) -> Tuple[np.array, np.array]:
+        """
+        Rewards of total life: a full step for surviving, half a step for dying
+        :return: the stay and death rewards, for `reward_moments`
+        """
+        return np.full((1, 1, 1), self.step), np.full((1, 1), self.step / 2)
+
+    def healthy_rewards(self, healthy: Optional[Sequence[bool]] = None) -> Tuple[np.array, np.array]:
+        """
+        Rewards of healthy life: a step spent in healthy states, where a transition between a
+        healthy and a disabled state counts for half a step, and half a step for dying healthy
+        :param healthy: whether each state is healthy, only state HEALTHY by default
+        :return: the stay and death rewards, for `reward_moments`
+        """
+        if healthy is None:
+            healthy = np.arange(self.states) == HEALTHY
+        healthy = np.asarray(healthy, dtype=float)
+        stay = self.step * (healthy[:, None] + healthy[None, :]) / 2
+        return stay[None], self.step * healthy[None] / 2
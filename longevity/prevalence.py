@@ -0,0 +1,168 @@
+import copy
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from longevity.cache import frame_fingerprint
+
+# ages from which disability is no longer measured, their prevalence is 0
+PREVALENCE_MAX_AGE = 88
+
+# columns of a dataframe which a prevalence table is built on
+PREVALENCE_COLUMNS = ['is_aged', 'income_dcl', 'disabled']
+# number of tables kept by PrevalenceTable.for_frame
+TABLES_MAXSIZE = 32
+
+# tables already built, least recently used first, by fingerprint of the columns they were built on and parameters
+_tables: OrderedDict = OrderedDict()
+
+
+def smooth_curves(ages: np.array, values: np.array, weights: np.array) -> np.array:
+    """
+    Smooth curves by fitting a * exp(b * age) to each of them with weighted least squares on the log of
+    the values, in closed form for all the curves at once. Zero, negative and NaN values are left out of
+    the fits, curves with a single value left are fitted by a constant and curves without any by 0
+    :param ages: the ages of the values (ages)
+    :param values: the curves, ages along the first axis (ages x ...)
+    :param weights: the weight of each value, broadcastable to values
+    :return: the smoothed curves, with the shape of values
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.where((values > 0) & np.isfinite(values), weights, 0.)
+    logs = np.log(np.where(weights > 0, values, 1.))
+    x = np.asarray(ages, dtype=float).reshape((-1,) + (1,) * (values.ndim - 1))
+
+    total = weights.sum(axis=0)
+    fitted = total > 0
+    total = np.where(fitted, total, 1.)
+    x_mean = (weights * x).sum(axis=0) / total
+    log_mean = (weights * logs).sum(axis=0) / total
+    sxx = (weights * (x - x_mean) ** 2).sum(axis=0)
+    sxy = (weights * (x - x_mean) * (logs - log_mean)).sum(axis=0)
+    b = np.divide(sxy, sxx, out=np.zeros_like(sxy), where=sxx > 0)
+    return np.where(fitted, np.exp(log_mean + b * (x - x_mean)), 0.)
+
+
+class PrevalenceTable:
+    """
+    Dense (age x income_dcl) table of the disability prevalence of a dataframe
+    resulting from a call to longevity.DataManager.prepare_dataset, measured as
+    the ratio of disabled to non-disabled observations at each age
+    """
+
+    def __init__(self, start_age: int, income_dcls: np.array, disabled: np.array, healthy: np.array,
+                 fill_value: float = np.nan):
+        """
+        Initialize a PrevalenceTable object
+        :param start_age: the age of the first row of the counts
+        :param income_dcls: the (sorted) income decile of each column of the counts
+        :param disabled: the number of disabled observations (ages x income_dcls)
+        :param healthy: the number of non-disabled observations (ages x income_dcls)
+        :param fill_value: the prevalence of the cells with disabled but no non-disabled observations
+        """
+        self.start_age = start_age
+        self.income_dcls = np.asarray(income_dcls)
+        self.disabled = disabled
+        self.healthy = healthy
+        # cells without any observation have no measured disability
+        self.values = np.divide(disabled, healthy, out=np.where(disabled > 0, fill_value, 0.), where=healthy > 0)
+        self._smoothed: Optional['PrevalenceTable'] = None
+
+    @staticmethod
+    def from_frame(df: pd.DataFrame, max_age: Optional[int] = PREVALENCE_MAX_AGE,
+                   fill_value: float = np.nan) -> 'PrevalenceTable':
+        """
+        Count the disabled and non-disabled observations of each (age, income_dcl) cell in one pass.
+        Observations with a missing age or income decile are not counted
+        :param df: a dataframe resulting from a call to longevity.DataManager.prepare_dataset
+        :param max_age: observations from this age on are not counted, no cutoff if None
+        :param fill_value: the prevalence of the cells with disabled but no non-disabled observations
+        :return: the prevalence table
+        """
+        age = df['is_aged'].to_numpy(dtype=float, na_value=np.nan)
+        income_dcl = df['income_dcl'].to_numpy(dtype=float, na_value=np.nan)
+        valid = ~np.isnan(age) & ~np.isnan(income_dcl)
+        if max_age is not None:
+            valid &= age < max_age
+        age = age[valid].astype(int)
+        income_dcls, column = np.unique(income_dcl[valid].astype(int), return_inverse=True)
+        disabled = df['disabled'].to_numpy()[valid] == 1
+
+        start_age = int(age.min()) if len(age) else 0
+        shape = (int(age.max()) - start_age + 1 if len(age) else 0, len(income_dcls), 2)
+        cell = ((age - start_age) * shape[1] + column) * 2 + disabled
+        counts = np.bincount(cell, minlength=int(np.prod(shape))).reshape(shape)
+        return PrevalenceTable(start_age, income_dcls, counts[..., 1], counts[..., 0], fill_value)
+
+    @staticmethod
+    def for_frame(df: pd.DataFrame, max_age: Optional[int] = PREVALENCE_MAX_AGE,
+                  fill_value: float = np.nan) -> 'PrevalenceTable':
+        """
+        Get the prevalence table of a dataframe, built only once for every estimator using the same
+        data. The tables are kept by the fingerprint of the PREVALENCE_COLUMNS of the dataframe, so
+        that a modified dataframe gets a new table and a copy of the dataframe gets the same one
+        :param df: a dataframe resulting from a call to longevity.DataManager.prepare_dataset
+        :param max_age: observations from this age on are not counted, no cutoff if None
+        :param fill_value: the prevalence of the cells with disabled but no non-disabled observations
+        :return: the prevalence table
+        """
+        key = (frame_fingerprint(df[PREVALENCE_COLUMNS]), max_age, fill_value)
+        table = _tables.get(key)
+        if table is None:
+            table = _tables[key] = PrevalenceTable.from_frame(df, max_age, fill_value)
+        _tables.move_to_end(key)
+        while len(_tables) > TABLES_MAXSIZE:
+            _tables.popitem(last=False)
+        return table
+
+    def smoothed(self) -> 'PrevalenceTable':
+        """
+        Get the table where the prevalence of each income decile is smoothed by an exponential
+        of the age (see `smooth_curves`). The prevalence of a cell is weighted by the inverse
+        of the (delta method) variance of its log, disabled * healthy / (disabled + healthy),
+        so that cells with few observations count less and cells with no disabled or no
+        non-disabled observation are left out. The smoothed table is built only once
+        :return: the smoothed prevalence table
+        """
+        if self._smoothed is None:
+            observations = self.disabled + self.healthy
+            weights = np.divide(self.disabled * self.healthy, observations, out=np.zeros(self.values.shape),
+                                where=observations > 0)
+            ages = self.start_age + np.arange(self.values.shape[0])
+            smoothed = copy.copy(self)
+            smoothed.values = smooth_curves(ages, self.values, weights)
+            smoothed._smoothed = smoothed
+            self._smoothed = smoothed
+        return self._smoothed
+
+    def curves(self, income_dcls: Sequence[int], ages: Sequence[int]) -> np.array:
+        """
+        Gather the prevalence of several income deciles at several ages. The prevalence
+        at ages outside of the table is 0
+        :param income_dcls: the income deciles
+        :param ages: the ages
+        :return: the prevalence of each income decile at each age (income_dcls x ages)
+        """
+        income_dcls = np.asarray(income_dcls, dtype=int)
+        column = np.searchsorted(self.income_dcls, income_dcls)
+        known = column < len(self.income_dcls)
+        known[known] = self.income_dcls[column[known]] == income_dcls[known]
+        if not known.all():
+            raise KeyError(f'No disability prevalence for income_dcl {income_dcls[~known].tolist()}')
+
+        row = np.asarray(ages, dtype=int) - self.start_age
+        inside = (row >= 0) & (row < self.values.shape[0])
+        prevalences = np.zeros((len(income_dcls), len(row)))
+        prevalences[:, inside] = self.values[row[inside][None, :], column[:, None]]
+        return prevalences
+
+    def curve(self, income_dcl: int, ages: Sequence[int]) -> np.array:
+        """
+        Gather the prevalence of an income decile at several ages
+        :param income_dcl: the income decile
+        :param ages: the ages
+        :return: the prevalence at each age
+        """
+        return self.curves([income_dcl], ages)[0]
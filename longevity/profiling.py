@@ -0,0 +1,227 @@
+import contextlib
+import functools
+import json
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# ru_maxrss is in kilobytes, except on macOS where it is in bytes
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def peak_memory() -> Optional[int]:
+    """
+    Get the peak resident memory of the process so far
+    :return: the peak memory in bytes, None if it cannot be measured on this platform
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+
+
+class StageRecord:
+    """
+    Measurements of a single stage of the pipeline
+    """
+
+    def __init__(self, name: str, parent: Optional[str] = None):
+        """
+        Initialize a StageRecord object
+        :param name: the name of the stage
+        :param parent: the name of the stage this one is nested in, if any
+        """
+        self.name = name
+        self.parent = parent
+        self.wall_time = 0.
+        self.cpu_time = 0.
+        # growth of the peak resident memory of the process during the stage, in bytes
+        self.peak_memory_delta: Optional[int] = None
+        # peak of the memory allocated during the stage, in bytes (only when tracing memory allocations)
+        self.traced_peak_memory: Optional[int] = None
+        self._traced_start = self._traced_peak = 0
+        self.rows_in: Optional[int] = None
+        self.rows_out: Optional[int] = None
+        self.dropped: Dict[str, int] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Convert the record to a json serializable dictionary
+        :return: the measurements of the stage
+        """
+        return {
+            'name': self.name,
+            'parent': self.parent,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'peak_memory_delta': self.peak_memory_delta,
+            'traced_peak_memory': self.traced_peak_memory,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'dropped': dict(self.dropped),
+        }
+
+
+class Profiler:
+    """
+    Records the wall time, CPU time, peak memory growth, rows in and out and rows
+    dropped by reason of each stage of the pipeline. Stages are delimited with the
+    `stage` context manager or with the `hook` decorator, e.g.
+
+        profiler = Profiler()
+        dm = DataManager(easy_share_dta_path, share_death_dta_path, profiler=profiler)
+        df = dm.prepare_dataset()
+        with profiler.stage('create_panel_dataset', rows=len(df)) as record:
+            panel_df = DataManager.create_panel_dataset(df)
+            record.rows_out = len(panel_df)
+        profiler.to_json('profile.json')
+
+    By default the measurements only use clocks and getrusage, so the profiler can be left on
+    in production. Tracing memory allocations gives the peak memory of each stage, even when
+    it is below the peak of the process, but slows down allocations (use it for benchmarks)
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        """
+        Initialize a Profiler object
+        :param trace_memory: whether to trace memory allocations with tracemalloc
+        """
+        self.records: List[StageRecord] = []
+        self._open: List[StageRecord] = []
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _observe_traced_peak(self) -> None:
+        """
+        Update the traced peak of the open stages before the peak is reset or read
+        """
+        peak = tracemalloc.get_traced_memory()[1]
+        for record in self._open:
+            record._traced_peak = max(record._traced_peak, peak)
+
+    @contextlib.contextmanager
+    def stage(self, name: str, rows: Union[int, Callable[[], int], None] = None) -> Iterator[StageRecord]:
+        """
+        Measure a stage of the pipeline. Stages can be nested
+        :param name: the name of the stage
+        :param rows: the number of rows going into the stage, or a function returning the
+                     current number of rows, called when the stage starts and when it ends
+        :return: a context manager yielding the record of the stage, whose rows_out can be set
+                 when `rows` is not a function
+        """
+        record = StageRecord(name, self._open[-1].name if self._open else None)
+        record.rows_in = rows() if callable(rows) else rows
+        if self.trace_memory:
+            self._observe_traced_peak()
+            tracemalloc.reset_peak()
+            record._traced_start = record._traced_peak = tracemalloc.get_traced_memory()[0]
+        self.records.append(record)
+        self._open.append(record)
+        memory = peak_memory()
+        wall_time, cpu_time = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall_time = time.perf_counter() - wall_time
+            record.cpu_time = time.process_time() - cpu_time
+            if memory is not None:
+                record.peak_memory_delta = peak_memory() - memory
+            if self.trace_memory:
+                self._observe_traced_peak()
+                record.traced_peak_memory = record._traced_peak - record._traced_start
+            self._open.pop()
+            if callable(rows):
+                record.rows_out = rows()
+
+    def hook(self, func: Callable, name: Optional[str] = None,
+             rows: Optional[Callable[[], int]] = None) -> Callable:
+        """
+        Wrap a function (e.g. a process_* step of a DataManager) so that each call is measured as a stage
+        :param func: the function to wrap
+        :param name: the name of the stage, the name of the function by default
+        :param rows: a function returning the current number of rows, e.g. lambda: len(dm.df)
+        :return: the wrapped function
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.stage(name or func.__name__, rows):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def drop(self, reason: str, rows: int) -> None:
+        """
+        Account for rows dropped for a reason, in every stage currently open.
+        Nothing is recorded outside of a stage
+        :param reason: why the rows are dropped
+        :param rows: the number of rows dropped
+        """
+        for record in self._open:
+            record.dropped[reason] = record.dropped.get(reason, 0) + int(rows)
+
+    def merge(self, partitions: List[List[StageRecord]]) -> None:
+        """
+        Add the stages profiled by several processes running the same stages on partitions of
+        the data (e.g. longevity.DataManager.prepare_dataset with several workers). The records
+        at the same position in each partition are merged into one: the wall time and the memory
+        are the largest of the partitions, the CPU time, the rows and the dropped rows are summed.
+        The top stages of the partitions are nested in the stage currently open, if any
+        :param partitions: the records of each partition
+        """
+        def largest(values):
+            values = [value for value in values if value is not None]
+            return max(values) if values else None
+
+        def total(values):
+            values = [value for value in values if value is not None]
+            return sum(values) if values else None
+
+        parent = self._open[-1].name if self._open else None
+        for records in zip(*partitions):
+            merged = StageRecord(records[0].name, records[0].parent or parent)
+            merged.wall_time = max(record.wall_time for record in records)
+            merged.cpu_time = sum(record.cpu_time for record in records)
+            merged.peak_memory_delta = largest(record.peak_memory_delta for record in records)
+            merged.traced_peak_memory = largest(record.traced_peak_memory for record in records)
+            merged.rows_in = total(record.rows_in for record in records)
+            merged.rows_out = total(record.rows_out for record in records)
+            for record in records:
+                for reason, rows in record.dropped.items():
+                    merged.dropped[reason] = merged.dropped.get(reason, 0) + rows
+            self.records.append(merged)
+
+    def to_dict(self) -> List[Dict[str, Any]]:
+        """
+        Convert the records to json serializable dictionaries
+        :return: one dictionary per stage, in the order the stages started
+        """
+        return [record.to_dict() for record in self.records]
+
+    def to_json(self, path: Optional[str] = None) -> str:
+        """
+        Export the records to json
+        :param path: optionally, a file where to write the json
+        :return: the json string
+        """
+        report = json.dumps({'stages': self.to_dict()}, indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(report)
+        return report
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Convert the records to a DataFrame, with one column per drop reason
+        :return: a DataFrame with one row per stage
+        """
+        rows = [{**{k: v for k, v in record.to_dict().items() if k != 'dropped'},
+                 **{'dropped_' + reason: n for reason, n in record.dropped.items()}} for record in self.records]
+        return pd.DataFrame(rows)
@@ -0,0 +1,192 @@
+"""
+Batch computation of lifetime estimates for a file of scenarios, and fast lookups in the results:
+
+    python -m longevity.scenarios easyshare.dta cover_screens.dta scenarios.csv grid/
+
+The scenario file (csv, or json lines with a .json/.jsonl extension) has one scenario per row with
+the columns gender, income_dcl and optionally start_age, end_age, income_bins and measure ("healthy"
+or "total"), which default to the defaults of DataManager.prepare_dataset and to "healthy". The raw
+data-set is read once, cleaned once per (start_age, end_age, income_bins) and all the scenarios of a
+cleaning are computed together with LongevityEstimator.compute_grid_estimates. The results are
+written in the columnar format of longevity.cache and queried with ScenarioGrid:
+
+    grid = ScenarioGrid.load('grid/')
+    mean, std = grid.lookup('female', 5, 70)
+"""
+import argparse
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from longevity import cache
+from longevity.data_manager import DataManager
+from longevity.estimates import GENDERS, MEASURES, LongevityEstimator
+
+# the parameters of the cleaning, the scenarios sharing them share the cleaned data-set
+CLEANING_PARAMS = ['start_age', 'end_age', 'income_bins']
+# the columns identifying a scenario, in the order of the results
+SCENARIO_COLUMNS = CLEANING_PARAMS + ['gender', 'income_dcl', 'measure']
+SCENARIO_DEFAULTS = {'start_age': 65, 'end_age': 90, 'income_bins': 10, 'measure': 'healthy'}
+
+
+def read_scenarios(path: str) -> pd.DataFrame:
+    """
+    Read and validate a scenario file
+    :param path: a csv file, or a json lines file with a .json or .jsonl extension
+    :return: the distinct scenarios, with the columns in `SCENARIO_COLUMNS`
+    """
+    if os.path.splitext(path)[1] in ('.json', '.jsonl'):
+        scenarios = pd.read_json(path, lines=True)
+    else:
+        scenarios = pd.read_csv(path, skipinitialspace=True)
+
+    missing = [column for column in ('gender', 'income_dcl') if column not in scenarios]
+    if missing:
+        raise ValueError('The scenario file {} has no column {}'.format(path, ', '.join(missing)))
+    for column, default in SCENARIO_DEFAULTS.items():
+        scenarios[column] = scenarios[column].fillna(default) if column in scenarios else default
+    for column in CLEANING_PARAMS + ['income_dcl']:
+        scenarios[column] = scenarios[column].astype(int)
+    for column, allowed in (('gender', GENDERS), ('measure', MEASURES)):
+        scenarios[column] = scenarios[column].astype(str).str.strip().str.lower()
+        unknown = sorted(set(scenarios[column]) - set(allowed))
+        if unknown:
+            raise ValueError('Unknown {} {} in {}, expected one of {}'.format(column, unknown, path, allowed))
+    return scenarios[SCENARIO_COLUMNS].drop_duplicates().reset_index(drop=True)
+
+
+def run_scenarios(raw: pd.DataFrame, scenarios: pd.DataFrame, workers: Optional[int] = 1,
+                  verbose: bool = False) -> pd.DataFrame:
+    """
+    Compute the lifetime estimates of every scenario
+    :param raw: the data-set, as returned by DataManager.read_dataset (it is not modified)
+    :param scenarios: the scenarios, as returned by `read_scenarios`
+    :param workers: the number of processes cleaning the data-set (see DataManager.prepare_dataset)
+    :param verbose: parameter to control whether to print messages
+    :return: a tidy dataframe with one row per scenario and age, with the mean and the standard
+             deviation of the remaining lifetime, sorted by the columns in `SCENARIO_COLUMNS` and age
+    """
+    results = []
+    for params, group in scenarios.groupby(CLEANING_PARAMS, sort=True):
+        params = dict(zip(CLEANING_PARAMS, map(int, params)))
+        dm = DataManager.from_frame(raw.copy(deep=False), verbose)
+        df, panel_df = dm.prepare_dataset_and_panel(**params, workers=workers)
+
+        estimates = LongevityEstimator.compute_grid_estimates(
+            df, panel_df, genders=sorted(group['gender'].unique()), income_dcls=np.sort(group['income_dcl'].unique()))
+        estimates = estimates.merge(group[['gender', 'income_dcl', 'measure']], on=['gender', 'income_dcl', 'measure'])
+        results.append(estimates.assign(**params))
+
+    results = pd.concat(results, ignore_index=True)[SCENARIO_COLUMNS + ['age', 'mean', 'std']]
+    results = results.sort_values(SCENARIO_COLUMNS + ['age'], ignore_index=True)
+    for column in ('gender', 'measure'):
+        results[column] = results[column].astype('category')
+    return results
+
+
+class ScenarioGrid:
+    """
+    Lookups in the results of `run_scenarios`. The rows of each scenario are located once,
+    when the grid is loaded, so that a lookup is a dictionary access and an array access
+    """
+
+    def __init__(self, results: pd.DataFrame):
+        """
+        Initialize a ScenarioGrid object
+        :param results: the results of `run_scenarios`, sorted by scenario and age
+        """
+        self.results = results
+        self.mean = results['mean'].to_numpy()
+        self.std = results['std'].to_numpy()
+        ages = results['age'].to_numpy()
+
+        # first and last row of every scenario, the ages of a scenario are consecutive
+        keys = list(zip(*[results[column].tolist() for column in SCENARIO_COLUMNS]))
+        starts = [0] + [i for i in range(1, len(keys)) if keys[i] != keys[i - 1]]
+        stops = starts[1:] + [len(keys)]
+        self.scenarios: Dict[tuple, Tuple[int, int, int]] = {
+            keys[start]: (start, stop, int(ages[start])) for start, stop in zip(starts, stops)}
+
+    @staticmethod
+    def load(directory: str) -> 'ScenarioGrid':
+        """
+        Load the results written by `save` (memory mapped)
+        :param directory: the directory of the results
+        :return: the grid
+        """
+        return ScenarioGrid(cache.load_frame(directory))
+
+    def save(self, directory: str) -> None:
+        """
+        Write the results in the columnar format of longevity.cache
+        :param directory: destination directory (replaced if it exists)
+        """
+        cache.save_frame(self.results, directory)
+
+    def _rows(self, gender: str, income_dcl: int, measure: str, start_age: int, end_age: int,
+              income_bins: int) -> Tuple[int, int, int]:
+        """
+        Locate the rows of a scenario
+        :return: the first row, the row after the last one and the age of the first row
+        """
+        try:
+            return self.scenarios[(start_age, end_age, income_bins, gender, income_dcl, measure)]
+        except KeyError:
+            raise KeyError('No scenario gender={}, income_dcl={}, measure={}, start_age={}, end_age={}, '
+                           'income_bins={} in the grid'.format(gender, income_dcl, measure, start_age, end_age,
+                                                                income_bins)) from None
+
+    def lookup(self, gender: str, income_dcl: int, age: int, measure: str = 'healthy', start_age: int = 65,
+               end_age: int = 90, income_bins: int = 10) -> Tuple[float, float]:
+        """
+        Get the estimate of a scenario at an age
+        :param gender: the gender, "male" or "female"
+        :param income_dcl: the income decile
+        :param age: the age
+        :param measure: "healthy" or "total"
+        :param start_age: Minimum age of the cleaning
+        :param end_age: Maximum age of the cleaning
+        :param income_bins: maximum number of bins of the cleaning
+        :return: the mean and the standard deviation of the remaining lifetime
+        """
+        start, stop, first_age = self._rows(gender, income_dcl, measure, start_age, end_age, income_bins)
+        row = start + age - first_age
+        if not start <= row < stop:
+            raise KeyError('No estimate at age {} for this scenario, the ages go from {} to {}'.format(
+                age, first_age, first_age + stop - start - 1))
+        return float(self.mean[row]), float(self.std[row])
+
+    def curve(self, gender: str, income_dcl: int, measure: str = 'healthy', start_age: int = 65,
+              end_age: int = 90, income_bins: int = 10) -> Tuple[np.array, np.array, np.array]:
+        """
+        Get the estimates of a scenario at all its ages
+        :param gender: the gender, "male" or "female"
+        :param income_dcl: the income decile
+        :param measure: "healthy" or "total"
+        :param start_age: Minimum age of the cleaning
+        :param end_age: Maximum age of the cleaning
+        :param income_bins: maximum number of bins of the cleaning
+        :return: the ages, and the mean and the standard deviation of the remaining lifetime at each age
+                 (read-only views of the grid)
+        """
+        start, stop, first_age = self._rows(gender, income_dcl, measure, start_age, end_age, income_bins)
+        return np.arange(first_age, first_age + stop - start), self.mean[start:stop], self.std[start:stop]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute the lifetime estimates of a file of scenarios')
+    parser.add_argument('easy_share_dta_path')
+    parser.add_argument('share_death_dta_path')
+    parser.add_argument('scenarios', help='csv (or json lines) file with one scenario per row')
+    parser.add_argument('output', help='directory where the results are written')
+    parser.add_argument('--cache-dir', help='directory where to cache the merged data-set')
+    parser.add_argument('--workers', type=int, default=1, help='processes cleaning the data-set')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    raw = DataManager.read_dataset(args.easy_share_dta_path, args.share_death_dta_path, cache_dir=args.cache_dir)
+    grid = ScenarioGrid(run_scenarios(raw, read_scenarios(args.scenarios), args.workers, args.verbose))
+    grid.save(args.output)
+    print('{} scenarios, {} rows written to {}'.format(len(grid.scenarios), len(grid.results), args.output))
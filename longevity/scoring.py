@@ -0,0 +1,209 @@
+"""
+Scoring of lifetime estimates with NumPy only, from a fitted hazard model exported as a small json
+artifact. This module (and longevity.markov, which it uses) imports neither pandas, scipy nor sklearn,
+so that short-lived processes which only score do not pay for their import:
+
+    # where the model is fitted
+    estimator = LongevityEstimator(df, panel_df, 'female', 5)
+    estimator.export_scoring_artifact('hazard.json')
+
+    # where it is used
+    artifact = load_artifact('hazard.json')
+    mean, std = score(artifact, 'female', 5)
+"""
+import json
+import os
+import tempfile
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from longevity.markov import reward_moments
+
+HAZARD_FEATURES = ['age', 'income_dcl', 'gender_num']
+# terms which a hazard model can add to HAZARD_FEATURES (see longevity.selection.add_terms)
+HAZARD_TERMS = ['age_2', 'income_age']
+ARTIFACT_FORMAT_VERSION = 1
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def hazard_design(ages: np.array, income_dcl: Any, gender_num: Any, names: Sequence[str]) -> np.array:
+    """
+    Compute the value of some features of the hazard model, broadcasting the ages, income deciles
+    and genders against each other
+    :param ages: the ages
+    :param income_dcl: the income deciles
+    :param gender_num: the genders, 1 for "female" and 0 for "male"
+    :param names: the features, from HAZARD_FEATURES, HAZARD_TERMS and "intercept"
+    :return: the value of each feature (names x broadcast shape)
+    """
+    age, income_dcl, gender_num = np.broadcast_arrays(np.asarray(ages, dtype=float),
+                                                      np.asarray(income_dcl, dtype=float),
+                                                      np.asarray(gender_num, dtype=float))
+    values = {'age': age, 'income_dcl': income_dcl, 'gender_num': gender_num, 'age_2': age * age,
+              'income_age': income_dcl * age, 'intercept': np.ones(age.shape)}
+    return np.stack([values[name] for name in names])
+
+
+def death_probabilities(coeffs: Dict[str, float], ages: np.array, income_dcl: Any, gender_num: Any) -> np.array:
+    """
+    Compute the probability of dying within a year with the coefficients of a logistic hazard model
+    :param coeffs: the coefficients of the LR on the raw features: one per feature in HAZARD_FEATURES,
+                   optionally one per term in HAZARD_TERMS and the "intercept" (0 if missing)
+    :param ages: the ages
+    :param income_dcl: the income deciles, broadcast against the ages
+    :param gender_num: the genders (1 for "female" and 0 for "male"), broadcast against the ages
+    :return: the probability of dying at each age
+    """
+    names = [name for name in HAZARD_FEATURES + HAZARD_TERMS + ['intercept'] if name in coeffs]
+    weights = np.array([coeffs[name] for name in names], dtype=float)
+    design = hazard_design(ages, income_dcl, gender_num, names)
+    return sigmoid(np.tensordot(weights, design, axes=1))
+
+
+def export_coefficients(model: Any) -> Dict[str, float]:
+    """
+    Express a fitted logistic hazard model as coefficients on the raw features, folding the
+    scaling of the features into them. The model is read through its attributes, so that
+    sklearn is not imported
+    :param model: a fitted LogisticRegression, or a pipeline of a StandardScaler (optional) and a
+                  LogisticRegression, optionally preceded by the terms of longevity.selection
+    :return: the coefficients, with the "intercept", as used by `death_probabilities`
+    """
+    steps = [step for _, step in model.steps] if hasattr(model, 'steps') else [model]
+    names = list(HAZARD_FEATURES)
+    mean, scale = 0., 1.
+    for step in steps[:-1]:
+        if getattr(getattr(step, 'func', None), '__name__', None) == 'add_terms':
+            names += list((step.kw_args or {}).get('terms', ()))
+        elif hasattr(step, 'scale_') or hasattr(step, 'mean_'):
+            mean = 0. if getattr(step, 'mean_', None) is None else step.mean_
+            scale = 1. if getattr(step, 'scale_', None) is None else step.scale_
+        else:
+            raise ValueError('Cannot export the coefficients of a hazard model with a {} step'.format(
+                type(step).__name__))
+
+    lr = steps[-1]
+    if getattr(lr, 'coef_', None) is None or np.shape(lr.coef_)[0] != 1:
+        raise ValueError('The hazard model must be a fitted binary logistic regression')
+    coef = np.asarray(lr.coef_[0], dtype=float) / scale
+    intercept = float(lr.intercept_[0] - np.sum(coef * mean))
+    coeffs = {name: float(value) for name, value in zip(names, coef)}
+    coeffs['intercept'] = intercept
+    return coeffs
+
+
+def save_artifact(path: str, coeffs: Dict[str, float], ages: Optional[Sequence[int]] = None,
+                  income_dcls: Optional[Sequence[int]] = None, prevalences: Optional[np.array] = None) -> None:
+    """
+    Write a scoring artifact (json), atomically
+    :param path: destination path
+    :param coeffs: the coefficients of the hazard model (see `export_coefficients`)
+    :param ages: the ages of the model, required to score healthy life
+    :param income_dcls: the income deciles of the prevalences
+    :param prevalences: optionally, the disability prevalence of each income decile at each age
+                        (income_dcls x ages), required to score healthy life
+    """
+    artifact = {'format': ARTIFACT_FORMAT_VERSION, 'coeffs': {name: float(value) for name, value in coeffs.items()}}
+    if ages is not None:
+        artifact['ages'] = [int(age) for age in ages]
+    if prevalences is not None:
+        artifact['income_dcls'] = [int(income_dcl) for income_dcl in income_dcls]
+        artifact['prevalences'] = np.asarray(prevalences, dtype=float).tolist()
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(artifact, f)
+    os.replace(tmp_path, path)
+
+
+def load_artifact(path: str) -> Dict[str, Any]:
+    """
+    Read a scoring artifact written by `save_artifact`
+    :param path: path of the artifact
+    :return: the artifact, with the ages, income deciles and prevalences as arrays
+    """
+    with open(path) as f:
+        artifact = json.load(f)
+    if artifact.get('format') != ARTIFACT_FORMAT_VERSION:
+        raise ValueError('Unsupported scoring artifact format {} in {}'.format(artifact.get('format'), path))
+    for key, dtype in (('ages', int), ('income_dcls', int), ('prevalences', float)):
+        if key in artifact:
+            artifact[key] = np.asarray(artifact[key], dtype=dtype)
+    return artifact
+
+
+def survival_matrices(p_dead: np.array) -> Tuple[np.array, np.array]:
+    """
+    Build the U and P matrices as defined in Caswell, Zarulli (2018) from the
+    probability of dying at each age. The last age is an open-ended age class
+    :param p_dead: the probability of dying at each age (d), or a stack of them (... x d)
+    :return: U (... x d x d) and P (... x (d + 1) x (d + 1)) matrices
+    """
+    d = p_dead.shape[-1]
+    p_alive = 1 - p_dead
+    P = np.zeros(p_dead.shape[:-1] + (d + 1, d + 1))
+    ages = np.arange(d)
+    P[..., ages[1:], ages[:-1]] = p_alive[..., :-1]
+    P[..., d - 1, d - 1] = p_alive[..., -1]
+    P[..., d, ages] = p_dead
+    P[..., d, d] = 1
+    U = P[..., :d, :d]
+    return U, P
+
+
+def prevalence_matrix(prevalences: np.array) -> np.array:
+    """
+    Build the healthy prevalence (reward) matrix from the disability prevalence at each age
+    :param prevalences: the disability prevalence at each age (d), or a stack of them (... x d)
+    :return: the healthy prevalence matrix ((d + 1) x (d + 1)), or a stack of them
+    """
+    m = np.concatenate([prevalences, np.zeros(prevalences.shape[:-1] + (1,))], axis=-1)[..., None, :]
+    d = prevalences.shape[-1]
+    return 1 - np.concatenate([np.repeat(m, d, axis=-2), m / 2], axis=-2)
+
+
+def total_life_matrix(d: int) -> np.array:
+    """
+    Build the reward matrix of total life: a full year for surviving, half a year for dying
+    :param d: the number of ages
+    :return: the total life reward matrix ((d + 1) x (d + 1))
+    """
+    return np.hstack([np.vstack([np.ones((d, d)), np.ones(d) / 2]), np.zeros((d + 1, 1))])
+
+
+def score(artifact: Dict[str, Any], gender: str, income_dcl: int, healthy_life_only: bool = True,
+          ages: Optional[Sequence[int]] = None) -> Tuple[np.array, np.array]:
+    """
+    Compute the lifetime estimates of a subgroup from a scoring artifact, as
+    LongevityEstimator.compute_lifetime_estimates does with the same coefficients
+    :param artifact: the artifact, as returned by `load_artifact`
+    :param gender: the gender of the individual, can be "male" or "female"
+    :param income_dcl: the income decile of the individual
+    :param healthy_life_only: whether to compute lifetime for healthy or total life
+    :param ages: the (consecutive) ages, the ages of the artifact by default
+    :return: the mean and the standard deviation of the remaining (healthy) lifetime at each age
+    """
+    ages = np.asarray(artifact['ages'] if ages is None else ages, dtype=int)
+    d = len(ages)
+    U, P = survival_matrices(death_probabilities(artifact['coeffs'], ages, income_dcl,
+                                                 1 if gender == 'female' else 0))
+    if healthy_life_only:
+        if 'prevalences' not in artifact:
+            raise ValueError('The scoring artifact has no disability prevalence to score healthy life')
+        known = np.flatnonzero(artifact['income_dcls'] == income_dcl)
+        if not len(known):
+            raise KeyError('No disability prevalence for income_dcl {}'.format(income_dcl))
+        # the prevalence at ages outside of the artifact is 0, as in PrevalenceTable.curves
+        row = ages - artifact['ages'][0]
+        inside = (row >= 0) & (row < len(artifact['ages']))
+        prevalences = np.zeros(d)
+        prevalences[inside] = artifact['prevalences'][known[0], row[inside]]
+        R = prevalence_matrix(prevalences)
+    else:
+        R = total_life_matrix(d)
+    mu, m2 = reward_moments(U, P, R, k=2)
+    return mu, np.sqrt(m2 - mu * mu)
@@ -0,0 +1,165 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import log_loss
+from sklearn.model_selection import GroupKFold
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import FunctionTransformer, StandardScaler
+
+from longevity.cache import ModelCache
+from longevity.estimates import HAZARD_FEATURES, HAZARD_MODEL_CACHE, LongevityEstimator
+from longevity.scoring import HAZARD_TERMS
+
+DEFAULT_SPECIFICATIONS = [(), ('age_2',), ('income_age',), ('age_2', 'income_age')]
+# inverse regularization strengths, from the strongest regularization to the weakest
+DEFAULT_CS = np.logspace(-4, 4, 9)
+
+# state of a worker process, set once by _init_worker
+_worker: Dict[str, Any] = {}
+
+
+def add_terms(X: Any, terms: Sequence[str] = ()) -> np.array:
+    """
+    Build the design matrix of a specification from the HAZARD_FEATURES
+    :param X: the HAZARD_FEATURES (rows x 3), as a DataFrame or an array
+    :param terms: the terms added to the features: "age_2" (age squared) and "income_age" (income_dcl x age)
+    :return: the features followed by the terms (rows x (3 + len(terms)))
+    """
+    X = np.asarray(X, dtype=float)
+    age, income_dcl = X[:, HAZARD_FEATURES.index('age')], X[:, HAZARD_FEATURES.index('income_dcl')]
+    values = {'age_2': age * age, 'income_age': income_dcl * age}
+    return np.column_stack([X] + [values[term] for term in terms])
+
+
+def build_hazard_model(terms: Sequence[str] = (), C: float = 1.) -> Pipeline:
+    """
+    Build the (unfitted) hazard model of a specification. It is fitted and used on the HAZARD_FEATURES
+    of a panel, as the model of LongevityEstimator.build_hazard_model. Without terms, it is that model
+    (so that the default hazard model is one of the candidates), otherwise the features and the terms
+    are standardized, as their scales differ by orders of magnitude
+    :param terms: the terms added to the features (see `add_terms`)
+    :param C: the inverse of the regularization strength
+    :return: a sklearn pipeline
+    """
+    if not terms:
+        return LongevityEstimator.build_hazard_model().set_params(lr__C=C)
+    return Pipeline([
+        ('terms', FunctionTransformer(add_terms, kw_args={'terms': tuple(terms)})),
+        ('scaler', StandardScaler()),
+        ('lr', LogisticRegression(C=C, max_iter=1000))
+    ])
+
+
+def _init_worker(X: np.array, y: np.array, folds: List[np.array]) -> None:
+    """
+    Keep the panel and the folds in a worker process, so that they are sent once per worker
+    rather than once per task
+    :param X: the HAZARD_FEATURES of the panel
+    :param y: the target of the panel
+    :param folds: the validation rows of each fold
+    """
+    _worker.update(X=X, y=y, folds=folds)
+
+
+def _fit_path(terms: Sequence[str], fold: int, Cs: Sequence[float]) -> Dict[str, Any]:
+    """
+    Fit a specification on the training rows of a fold along the regularization path, each
+    fit starting from the coefficients of the previous (more regularized) one
+    :param terms: the terms of the specification
+    :param fold: the index of the fold
+    :param Cs: the inverse regularization strengths, in increasing order
+    :return: the validation log loss and the number of iterations at each C
+    """
+    X, y, validation = _worker['X'], _worker['y'], _worker['folds'][fold]
+    train = np.ones(len(y), dtype=bool)
+    train[validation] = False
+
+    design = add_terms(X, terms)
+    if terms:
+        design = StandardScaler().fit(design[train]).transform(design)
+        model = LogisticRegression(warm_start=True, max_iter=1000)
+    else:
+        # the model of `build_hazard_model` without terms: unscaled features and the default solver settings
+        model = LongevityEstimator.build_hazard_model().named_steps['lr'].set_params(warm_start=True)
+    losses, iterations = [], []
+    for C in Cs:
+        model.set_params(C=C).fit(design[train], y[train])
+        losses.append(log_loss(y[validation], model.predict_proba(design[validation])[:, 1], labels=[0, 1]))
+        iterations.append(int(model.n_iter_[0]))
+    return {'log_loss': losses, 'iterations': iterations}
+
+
+class HazardModelSelection:
+    """
+    Result of `select_hazard_model`
+    """
+
+    def __init__(self, scores: pd.DataFrame, terms: Sequence[str], C: float, model: Pipeline, fitted: Pipeline):
+        """
+        Initialize a HazardModelSelection object
+        :param scores: the cross-validated log loss of every specification and C
+        :param terms: the terms of the chosen specification
+        :param C: the chosen inverse regularization strength
+        :param model: the chosen (unfitted) model, to pass to LongevityEstimator as hazard_model
+        :param fitted: the chosen model fitted on the whole panel
+        """
+        self.scores = scores
+        self.terms = tuple(terms)
+        self.C = C
+        self.model = model
+        self.fitted = fitted
+
+
+def select_hazard_model(panel_df: pd.DataFrame, specifications: Optional[Sequence[Sequence[str]]] = None,
+                        Cs: Optional[Sequence[float]] = None, folds: int = 5, workers: Optional[int] = None,
+                        model_cache: Optional[ModelCache] = None) -> HazardModelSelection:
+    """
+    Choose the specification and the regularization of the hazard model by cross-validation.
+    The folds group the rows by mergeid, so that an individual is never both in the training and
+    the validation rows. Every (specification, fold) pair fits the whole regularization path with
+    warm starts, and the pairs run on a process pool. The model with the lowest mean validation
+    log loss is refitted on the whole panel through the model cache, so that the estimators using
+    it as their hazard_model (with the same model cache) do not fit it again
+    :param panel_df: a dataframe resulting from a call to longevity.DataManager.create_panel_dataset
+    :param specifications: the specifications compared, as the terms added to HAZARD_FEATURES
+                           (see `add_terms`), DEFAULT_SPECIFICATIONS by default
+    :param Cs: the inverse regularization strengths compared, DEFAULT_CS by default
+    :param folds: the number of folds
+    :param workers: the number of worker processes, all the cores by default
+    :param model_cache: the cache of fitted hazard models, HAZARD_MODEL_CACHE by default
+    :return: the scores of all the candidates and the chosen model
+    """
+    specifications = list(dict.fromkeys(tuple(terms) for terms in (DEFAULT_SPECIFICATIONS if specifications is None
+                                                                   else specifications)))
+    unknown = sorted({term for terms in specifications for term in terms} - set(HAZARD_TERMS))
+    if unknown:
+        raise ValueError('Unknown terms {}, expected some of {}'.format(unknown, HAZARD_TERMS))
+    Cs = np.sort(np.asarray(DEFAULT_CS if Cs is None else Cs, dtype=float))
+    model_cache = HAZARD_MODEL_CACHE if model_cache is None else model_cache
+
+    X = panel_df[HAZARD_FEATURES].to_numpy(dtype=float)
+    y = panel_df['y'].to_numpy()
+    groups = pd.factorize(panel_df['mergeid'])[0]
+    validation = [rows for _, rows in GroupKFold(folds).split(X, y, groups)]
+
+    tasks = [(terms, fold) for terms in specifications for fold in range(folds)]
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(X, y, validation)) as executor:
+        paths = list(executor.map(_fit_path, *zip(*tasks), [Cs] * len(tasks)))
+
+    names = {' + '.join(terms) or 'none': terms for terms in specifications}
+    scores = pd.DataFrame([{'terms': ' + '.join(terms) or 'none', 'fold': fold, 'C': C, 'log_loss': loss,
+                            'iterations': iterations}
+                           for (terms, fold), path in zip(tasks, paths)
+                           for C, loss, iterations in zip(Cs, path['log_loss'], path['iterations'])])
+    scores = scores.groupby(['terms', 'C'], sort=False).agg(
+        log_loss=('log_loss', 'mean'), log_loss_std=('log_loss', 'std'),
+        iterations=('iterations', 'sum')).reset_index()
+
+    best = scores.loc[scores['log_loss'].idxmin()]
+    terms, C = names[best['terms']], float(best['C'])
+    model = build_hazard_model(terms, C)
+    fitted = model_cache.fit(model, panel_df[HAZARD_FEATURES], panel_df['y'])
+    return HazardModelSelection(scores, terms, C, model, fitted)
@@ -0,0 +1,127 @@
+import argparse
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+# SHARE country codes and labels (only the name after the code is used by longevity.DataManager)
+COUNTRIES = {11: 'Austria', 12: 'Germany', 13: 'Sweden', 14: 'Netherlands', 15: 'Spain', 16: 'Italy',
+             17: 'France', 18: 'Denmark', 19: 'Greece', 20: 'Switzerland', 23: 'Belgium', 25: 'Israel',
+             28: 'Czech Republic', 29: 'Poland', 32: 'Hungary', 33: 'Portugal', 34: 'Slovenia', 35: 'Estonia'}
+# year of the interviews of each wave (wave 3 is the retrospective SHARELIFE wave)
+WAVE_YEAR = {1: 2004, 2: 2006, 3: 2008, 4: 2011, 5: 2013, 6: 2015}
+INCOME_WAVES = [1, 2, 4, 5, 6]
+# year up to which deaths are recorded in the cover screens
+LAST_DEATH_YEAR = 2016
+# probability that an individual alive and in the panel answers a wave
+RESPONSE_RATE = 0.85
+# Gompertz hazard a * exp(b * age), with a multiplied by exp(FEMALE_LOG_HAZARD) for women
+GOMPERTZ_LOG_A, GOMPERTZ_B, FEMALE_LOG_HAZARD = -10.5, 0.1, -0.3
+# age from which mortality is simulated
+ENTRY_AGE = 50.
+# average number of interviews per individual, used to size the population for a number of rows
+ROWS_PER_INDIVIDUAL = 1.95
+
+EASY_SHARE_LABELS = {
+    'country': {code: '{}. {}'.format(code, name) for code, name in COUNTRIES.items()},
+    'female': {0: '0. male', 1: '1. female'},
+    'age': {-15: '-15. no information'},
+    'adla': {-15: '-15. no information'},
+    'dn004_mod': {1: '1. Yes', 5: '5. No', -15: '-15. no information', -12: '-12. don\'t know / refusal'},
+    **{'income_pct_w{}'.format(wave): {-13: '-13. not asked in this wave'} for wave in INCOME_WAVES}
+}
+COVER_SCREENS_LABELS = {'deceased_age': {-9: 'Not applicable', -2: 'Refusal', -1: 'Don\'t know'}}
+
+
+def generate(rows: int, seed: int = 0) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Generate a synthetic EasyShare-like and cover-screens-like data-set. Ages at death follow a
+    Gompertz law with individual frailty, disability (adla) increases with age and every coded
+    value handled by longevity.DataManager (missing ages, adla, birthplace and deceased ages,
+    income not asked in a wave, immigrants, ...) appears in the data
+    :param rows: the approximate number of rows of the EasyShare data-set
+    :param seed: the seed of the random generator
+    :return: the EasyShare and the cover screens data-sets, with codes instead of labels
+    """
+    rng = np.random.default_rng(seed)
+    n = max(int(rows / ROWS_PER_INDIVIDUAL), 1)
+    codes = np.array(list(COUNTRIES))
+    country = rng.choice(codes, n)
+    female = rng.integers(0, 2, n)
+    birth_year = rng.uniform(1915, 1955, n)
+    frailty = rng.normal(0, 0.3, n)
+    decile = rng.integers(1, 11, n)
+
+    # age at death conditional on surviving to ENTRY_AGE, by inversion of the Gompertz survival function
+    a = np.exp(GOMPERTZ_LOG_A + frailty + FEMALE_LOG_HAZARD * female)
+    death_age = np.log(1 - GOMPERTZ_B * np.log(rng.uniform(size=n)) / (a * np.exp(GOMPERTZ_B * ENTRY_AGE))) / \
+        GOMPERTZ_B + ENTRY_AGE
+    death_year = birth_year + death_age
+
+    prefixes = np.array([name[:2].upper() for name in COUNTRIES.values()])[np.searchsorted(codes, country)]
+    mergeid = np.char.add(np.char.add(prefixes, '-'), np.char.add(np.char.zfill(np.arange(n).astype(str), 6), '-01'))
+
+    # individuals join the panel in a refreshment wave and answer the waves they are alive for
+    first_wave = rng.choice([1, 2, 4, 5], n)
+    person, wave = [], []
+    for w, year in WAVE_YEAR.items():
+        present = np.flatnonzero((first_wave <= w) & (death_year > year) & (rng.uniform(size=n) < RESPONSE_RATE))
+        person.append(present)
+        wave.append(np.full(len(present), w, dtype='int8'))
+    person, wave = np.concatenate(person), np.concatenate(wave)
+    m = len(person)
+
+    int_year = np.array([WAVE_YEAR.get(w, 0) for w in range(max(WAVE_YEAR) + 1)], dtype='int16')[wave]
+    age = np.round(int_year - birth_year[person] + rng.uniform(0, 1, m), 1)
+    adla = np.minimum(rng.poisson(np.exp((age - 85) / 8)), 5).astype(float)
+    adla[rng.uniform(size=m) < 0.01] = -15
+    recorded_age = np.where(rng.uniform(size=m) < 0.01, -15, age)
+
+    easy = pd.DataFrame({
+        'mergeid': mergeid[person],
+        'wave': wave,
+        'country': country[person],
+        'female': female[person],
+        'age': recorded_age,
+        'adla': adla,
+        **{'income_pct_w{}'.format(w): np.where(wave == w, decile[person], -13) for w in INCOME_WAVES},
+        'int_year': int_year,
+        'thinc_m': np.where(rng.uniform(size=m) < 0.02, np.nan, rng.lognormal(10, 0.5, m)),
+        'dn004_mod': rng.choice([1, 5, -15, -12], m, p=[0.88, 0.1, 0.01, 0.01]),
+    })
+
+    # cover screens of the individuals interviewed at least once, with some refusals and missing records
+    ids = np.unique(person)
+    dead = death_year[ids] < LAST_DEATH_YEAR
+    deceased_age = np.where(dead, np.floor(death_age[ids]), -9)
+    r = rng.uniform(size=len(ids))
+    deceased_age[(r < 0.01) & dead] = -2
+    deceased_age[(r > 0.99) & dead] = -1
+    recorded = rng.uniform(size=len(ids)) < 0.97
+    cover_screens = pd.DataFrame({'mergeid': mergeid[ids][recorded], 'deceased_age': deceased_age[recorded]})
+    return easy, cover_screens
+
+
+def write(easy_share_dta_path: str, share_death_dta_path: str, rows: int, seed: int = 0) -> Dict[str, int]:
+    """
+    Write a synthetic EasyShare and cover screens data-set as labelled Stata files
+    :param easy_share_dta_path: destination of the EasyShare data-set
+    :param share_death_dta_path: destination of the cover screens data-set
+    :param rows: the approximate number of rows of the EasyShare data-set
+    :param seed: the seed of the random generator
+    :return: the number of rows written in each file
+    """
+    easy, cover_screens = generate(rows, seed)
+    easy.to_stata(easy_share_dta_path, write_index=False, value_labels=EASY_SHARE_LABELS)
+    cover_screens.to_stata(share_death_dta_path, write_index=False, value_labels=COVER_SCREENS_LABELS)
+    return {'easy_share': len(easy), 'cover_screens': len(cover_screens)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic SHARE-like data-set')
+    parser.add_argument('easy_share_dta_path')
+    parser.add_argument('share_death_dta_path')
+    parser.add_argument('--rows', type=int, default=100000, help='approximate number of EasyShare rows')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(write(args.easy_share_dta_path, args.share_death_dta_path, args.rows, args.seed))
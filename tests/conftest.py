@@ -0,0 +1,38 @@
+import os
+from typing import List, Tuple
+
+import pandas as pd
+import pytest
+
+from longevity import synthetic
+from longevity.data_manager import DataManager
+
+# approximate number of EasyShare rows of the synthetic data-set shared by the tests
+ROWS = 20000
+
+
+@pytest.fixture(scope='session')
+def dta_paths(tmp_path_factory: pytest.TempPathFactory) -> List[str]:
+    """
+    The paths of a synthetic EasyShare and cover screens data-set, written once per session
+    """
+    directory = tmp_path_factory.mktemp('synthetic')
+    paths = [os.path.join(directory, 'easy_share.dta'), os.path.join(directory, 'cover_screens.dta')]
+    synthetic.write(*paths, rows=ROWS, seed=0)
+    return paths
+
+
+@pytest.fixture(scope='session')
+def raw(dta_paths: List[str]) -> pd.DataFrame:
+    """
+    The synthetic data-set, as returned by DataManager.read_dataset. Tests must not modify it
+    """
+    return DataManager.read_dataset(*dta_paths)
+
+
+@pytest.fixture(scope='session')
+def prepared(raw: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    The cleaned synthetic data-set and its panel. Tests must not modify them
+    """
+    return DataManager.from_frame(raw.copy(deep=False), verbose=False).prepare_dataset_and_panel()
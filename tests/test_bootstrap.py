@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from longevity.bootstrap import _intervals, bootstrap_lifetime_estimates
+from longevity.estimates import LongevityEstimator
+from longevity.selection import build_hazard_model
+
+
+def test_intervals_ignore_invalid_replicates():
+    estimates = pd.DataFrame({'mean': [1., 2.]})
+    replicates = np.array([[0., np.nan], [1., np.nan], [2., 3.]])
+    intervals = _intervals(estimates, replicates, 0.5)
+    assert intervals['replicates'].tolist() == [3, 1]
+    assert intervals.loc[0, ['lower', 'upper']].tolist() == [0.5, 1.5]
+    assert intervals.loc[1, ['lower', 'upper']].tolist() == [3., 3.]
+
+
+def test_intervals_are_finite_and_contain_the_point_estimates(prepared):
+    df, panel_df = prepared
+    intervals = list(bootstrap_lifetime_estimates(df, panel_df, replicates=40, workers=1, report_every=20))
+    assert [result['replicates'].max() for result in intervals] == [20, 40]
+
+    result = intervals[-1]
+    estimated = np.isfinite(result['mean'])
+    assert estimated.mean() > 0.9
+    assert np.isfinite(result.loc[estimated, ['lower', 'upper']]).all().all()
+    assert (result.loc[estimated, 'lower'] <= result.loc[estimated, 'mean']).all()
+    assert (result.loc[estimated, 'mean'] <= result.loc[estimated, 'upper']).all()
+
+
+def test_settings_of_the_point_estimates_are_used(prepared):
+    df, panel_df = prepared
+    model = build_hazard_model(('age_2',), 1.)
+    result = list(bootstrap_lifetime_estimates(df, panel_df, replicates=20, workers=1, report_every=20,
+                                               smooth_prevalence=True, hazard_model=model))[-1]
+    expected = LongevityEstimator.compute_grid_estimates(df, panel_df, smooth_prevalence=True, hazard_model=model)
+    np.testing.assert_allclose(result['mean'], expected['mean'])
+    assert np.isfinite(result[['lower', 'upper']]).all().all()
+    assert (result['replicates'] == 20).all()
+    assert ((result['lower'] <= result['mean']) & (result['mean'] <= result['upper'])).all()
+
+
+def test_intervals_do_not_depend_on_the_number_of_workers(prepared):
+    df, panel_df = prepared
+    serial, parallel = [list(bootstrap_lifetime_estimates(df, panel_df, replicates=6, workers=workers,
+                                                          report_every=6, smooth_prevalence=True))[-1]
+                        for workers in (1, 2)]
+    pd.testing.assert_frame_equal(parallel, serial)
@@ -0,0 +1,165 @@
+import importlib
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.testing import assert_allclose
+from pandas.testing import assert_frame_equal
+
+from longevity import cache
+from longevity.cache import ModelCache, StageCache
+from longevity.data_manager import DataManager
+from longevity.estimates import HAZARD_FEATURES, LongevityEstimator
+
+
+def test_model_cache_fits_once_per_model_and_data(prepared: Tuple[pd.DataFrame, pd.DataFrame]):
+    df, panel_df = prepared
+    model_cache = ModelCache()
+    estimators = [LongevityEstimator(df, panel_df, gender, income_dcl, model_cache=model_cache)
+                  for gender in ('female', 'male') for income_dcl in (1, 5)]
+    coeffs = [estimator.export_coefficients() for estimator in estimators]
+    assert (model_cache.misses, model_cache.hits) == (1, len(estimators) - 1)
+    assert all(estimator.clf is estimators[0].clf for estimator in estimators)
+    assert all(c == coeffs[0] for c in coeffs)
+
+    # equal data held by another object is a hit, another model is a miss
+    model_cache.fit(LongevityEstimator.build_hazard_model(), panel_df[HAZARD_FEATURES].copy(), panel_df['y'].copy())
+    assert (model_cache.misses, model_cache.hits) == (1, len(estimators))
+    model_cache.fit(LongevityEstimator.build_hazard_model().set_params(lr__C=.5), panel_df[HAZARD_FEATURES],
+                    panel_df['y'])
+    assert model_cache.misses == 2
+
+
+def test_estimator_fits_its_model_once(prepared: Tuple[pd.DataFrame, pd.DataFrame]):
+    df, panel_df = prepared
+    model_cache = ModelCache()
+    estimator = LongevityEstimator(df, panel_df, 'female', 5, model_cache=model_cache)
+    assert estimator.clf is None
+    for healthy_life_only in (True, False):
+        estimator.compute_lifetime_estimates(healthy_life_only)
+    estimator.compute_lifetime_sensitivities(True)
+    estimator.export_coefficients()
+    # the panel is fingerprinted by the first computation only
+    assert (model_cache.misses, model_cache.hits) == (1, 0)
+
+
+def test_model_cache_is_invalidated_by_new_data(prepared: Tuple[pd.DataFrame, pd.DataFrame]):
+    panel_df = prepared[1]
+    model_cache = ModelCache()
+    X, y = panel_df[HAZARD_FEATURES], panel_df['y']
+    fitted = model_cache.fit(LongevityEstimator.build_hazard_model(), X, y)
+
+    changed = y.copy()
+    changed.iloc[np.flatnonzero(y.to_numpy() == 0)[:50]] = 1
+    refitted = model_cache.fit(LongevityEstimator.build_hazard_model(), X, changed)
+    assert refitted is not fitted and model_cache.misses == 2
+    assert not np.allclose(refitted.named_steps['lr'].coef_, fitted.named_steps['lr'].coef_)
+
+
+def test_model_cache_directory_is_shared_by_runs(prepared: Tuple[pd.DataFrame, pd.DataFrame], tmp_path):
+    panel_df = prepared[1]
+    X, y = panel_df[HAZARD_FEATURES], panel_df['y']
+    fitted = ModelCache(directory=str(tmp_path)).fit(LongevityEstimator.build_hazard_model(), X, y)
+
+    # a later run, with an empty memory
+    model_cache = ModelCache(directory=str(tmp_path))
+    loaded = model_cache.fit(LongevityEstimator.build_hazard_model(), X, y)
+    assert (model_cache.misses, model_cache.hits) == (0, 1)
+    assert_allclose(loaded.predict_proba(X), fitted.predict_proba(X))
+
+
+def test_model_cache_keeps_the_most_recently_used_models(prepared: Tuple[pd.DataFrame, pd.DataFrame]):
+    panel_df = prepared[1]
+    X, y = panel_df[HAZARD_FEATURES], panel_df['y']
+    model_cache = ModelCache(maxsize=2)
+    for C in (1., 2., 1., 3.):
+        model_cache.fit(LongevityEstimator.build_hazard_model().set_params(lr__C=C), X, y)
+    assert (model_cache.misses, model_cache.hits) == (3, 1)
+    assert len(model_cache.models) == 2
+    model_cache.fit(LongevityEstimator.build_hazard_model().set_params(lr__C=2.), X, y)
+    assert model_cache.misses == 4
+
+
+def _prepare(raw: pd.DataFrame, stage_cache: StageCache, **params) -> Tuple[DataManager, pd.DataFrame, pd.DataFrame]:
+    dm = DataManager.from_frame(raw.copy(deep=False), verbose=False, stage_cache=stage_cache)
+    return (dm, ) + dm.prepare_dataset_and_panel(**params)
+
+
+def test_stage_cache_reuses_the_steps_of_prepare_dataset(raw: pd.DataFrame):
+    stage_cache = StageCache()
+    dm, df, panel_df = _prepare(raw, stage_cache)
+    assert stage_cache.hits == 0
+    cached_dm, cached_df, cached_panel_df = _prepare(raw, stage_cache)
+    assert stage_cache.hits == 2
+    assert_frame_equal(cached_df, df)
+    assert_frame_equal(cached_panel_df, panel_df)
+    # the dropped rows are replayed
+    assert cached_dm.events == dm.events
+
+    # the steps before the first one whose parameters change are reused
+    stage_cache.lookups.clear()
+    _, df, _ = _prepare(raw, stage_cache, end_age=85)
+    report = stage_cache.report()
+    assert report['status'].tolist()[:2] == ['hit', 'miss']
+    assert report['stage'].iloc[0] == 'process_gender'
+    assert_frame_equal(df, DataManager.from_frame(raw.copy(deep=False), verbose=False).prepare_dataset(end_age=85))
+
+
+def test_stage_cache_is_invalidated_by_new_data(raw: pd.DataFrame):
+    stage_cache = StageCache()
+    _prepare(raw, stage_cache)
+    changed = raw.copy()
+    changed['thinc_m'] = changed['thinc_m'] * 2
+    _, df, _ = _prepare(changed, stage_cache)
+    assert stage_cache.hits == 0
+    assert_frame_equal(df, DataManager.from_frame(changed, verbose=False).prepare_dataset())
+
+
+def test_stage_cache_directory_is_shared_by_runs(raw: pd.DataFrame, tmp_path):
+    _, df, panel_df = _prepare(raw, StageCache(directory=str(tmp_path)))
+    # a later run, with an empty memory
+    stage_cache = StageCache(directory=str(tmp_path))
+    _, cached_df, cached_panel_df = _prepare(raw, stage_cache)
+    assert stage_cache.hits == 2 and stage_cache.misses == 0
+    assert_frame_equal(cached_df, df)
+    assert_frame_equal(cached_panel_df, panel_df)
+
+
+def test_disabled_model_cache_neither_hashes_nor_keeps_models(prepared: Tuple[pd.DataFrame, pd.DataFrame],
+                                                              monkeypatch):
+    panel_df = prepared[1]
+    model_cache = ModelCache(maxsize=0)
+    monkeypatch.setattr(model_cache, 'key', None)
+    for _ in range(2):
+        fitted = model_cache.fit(LongevityEstimator.build_hazard_model(), panel_df[HAZARD_FEATURES], panel_df['y'])
+    assert (model_cache.misses, model_cache.hits) == (2, 0)
+    assert not model_cache.models
+    assert fitted.predict_proba(panel_df[HAZARD_FEATURES]).shape == (len(panel_df), 2)
+
+
+def test_stage_cache_is_invalidated_by_an_edited_step(raw: pd.DataFrame, monkeypatch):
+    stage_cache = StageCache()
+    _prepare(raw, stage_cache)
+    code_version = cache.code_version
+    # as if process_income had been edited since the outputs were cached
+    monkeypatch.setattr(cache, 'code_version', lambda function: code_version(function) + (
+        'edited' if function.__name__ == 'process_income' else ''))
+    stage_cache.lookups.clear()
+    _prepare(raw, stage_cache)
+    report = stage_cache.report()
+    assert report['status'].tolist()[:2] == ['hit', 'miss']
+    assert report['stage'].tolist()[:2] == ['process_disability', 'process_income']
+
+
+def test_code_version_follows_the_module_of_the_function(tmp_path, monkeypatch):
+    step = 'def process(df):\n    return _recode(df)\n\n\n'
+    for name, helper in (('before_edit', 'def _recode(df):\n    return df\n'),
+                         ('after_edit', 'def _recode(df):\n    return df.copy()\n')):
+        (tmp_path / (name + '.py')).write_text(step + helper)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    before_edit, after_edit = importlib.import_module('before_edit'), importlib.import_module('after_edit')
+
+    # the steps have the same code, only the helper they call was edited
+    assert cache._source_hash(before_edit.process) == cache._source_hash(after_edit.process)
+    assert cache.code_version(before_edit.process) != cache.code_version(after_edit.process)
+    assert cache.code_version(before_edit.process) == cache.code_version(before_edit.process)
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from benchmarks import rowwise
+from longevity.data_manager import DROP_MESSAGES, SCHEMA, DataManager
+from longevity.profiling import Profiler
+
+# the columns compared with the row-wise reference, as numbers
+NUMERIC_COLUMNS = ['wave', 'gender_num', 'age', 'adla', 'disabled', 'income_dcl', 'income', 'deceased_age', 'age_int',
+                   'deceased_age_int', 'is_dead', 'is_aged']
+LABEL_COLUMNS = ['mergeid', 'country', 'gender']
+
+
+def _numbers(series: pd.Series) -> np.ndarray:
+    """
+    Convert a column to floats, the labels left by the row-wise cleaning (e.g. 'Not applicable') become NaN
+    """
+    return pd.to_numeric(pd.Series(series.to_numpy(dtype=object)), errors='coerce').to_numpy(dtype=float)
+
+
+@pytest.mark.parametrize('start_age, end_age, income_bins', [(65, 90, 10), (50, 85, 4)])
+def test_prepare_dataset_matches_the_row_wise_cleaning(raw, start_age, end_age, income_bins):
+    dm = DataManager.from_frame(raw.copy(deep=False), verbose=False)
+    df = dm.prepare_dataset(start_age, end_age, income_bins)
+    expected, messages = rowwise.prepare_dataset(raw, start_age, end_age, income_bins)
+
+    assert len(df) == len(expected) > 0
+    for column in LABEL_COLUMNS:
+        assert df[column].astype(str).tolist() == expected[column].astype(str).tolist(), column
+    for column in NUMERIC_COLUMNS:
+        np.testing.assert_array_equal(df[column].to_numpy(dtype=float, na_value=np.nan), _numbers(expected[column]),
+                                      err_msg=column)
+    assert [DROP_MESSAGES[reason].format(rows, *args) for event, reason, rows, args in dm.events
+            if event == 'drop' and DROP_MESSAGES[reason] is not None] == [
+        message for message in messages if message.startswith('We drop')]
+
+
+def test_create_panel_dataset_matches_the_row_wise_panel(prepared):
+    df, panel_df = prepared
+    expected = rowwise.create_panel_dataset(df)
+
+    assert len(panel_df) == len(expected) > len(df)
+    mergeid, age = pd.factorize(panel_df['mergeid'])[0], panel_df['age'].to_numpy()
+    # the rows of an individual are contiguous and ordered by age
+    assert (np.diff(mergeid) != 0).sum() == mergeid.max()
+    assert ((np.diff(mergeid) != 0) | (np.diff(age) >= 0)).all()
+    keys = ['mergeid', 'age', 'y']
+    panel_df, expected = [frame.assign(mergeid=frame['mergeid'].astype(str).to_numpy()).sort_values(
+        keys, kind='stable').reset_index(drop=True) for frame in (panel_df, expected)]
+    assert panel_df['mergeid'].tolist() == expected['mergeid'].tolist()
+    for column in NUMERIC_COLUMNS + ['y']:
+        np.testing.assert_array_equal(panel_df[column].to_numpy(dtype=float, na_value=np.nan),
+                                      expected[column].to_numpy(dtype=float), err_msg=column)
+
+
+def test_cleaned_frames_keep_to_the_schema(raw, prepared):
+    # labelled raw columns stay categorical until they are cleaned
+    for column in ['mergeid', 'wave', 'int_year']:
+        assert str(raw[column].dtype) == SCHEMA[column], column
+    df, panel_df = prepared
+    for frame in (df, panel_df):
+        for column in frame.columns.intersection(list(SCHEMA)):
+            assert str(frame[column].dtype) == SCHEMA[column], column
+    assert df.memory_usage(deep=True).sum() < raw.memory_usage(deep=True).sum()
+
+
+def test_partitioned_cleaning_matches_the_serial_cleaning(raw):
+    results = []
+    for workers in (1, 2):
+        profiler = Profiler()
+        dm = DataManager.from_frame(raw.copy(deep=False), verbose=False, profiler=profiler)
+        df, panel_df = dm.prepare_dataset_and_panel(workers=workers)
+        tree = [(record.name, record.parent, record.rows_in, record.rows_out, record.dropped)
+                for record in profiler.records]
+        results.append((df, panel_df, dm.events, tree))
+
+    (df, panel_df, events, tree), (partitioned_df, partitioned_panel_df, partitioned_events, partitioned_tree) = results
+    assert_frame_equal(partitioned_df, df)
+    assert_frame_equal(partitioned_panel_df, panel_df)
+    assert repr(partitioned_events) == repr(events)
+    # the panel is a stage next to prepare_dataset whichever process created it
+    assert ('create_panel_dataset', None) in [record[:2] for record in tree]
+    assert partitioned_tree == tree
+
+
+def test_memory_report_of_the_compact_frame(prepared):
+    df = prepared[0]
+    report = DataManager.memory_report(df)
+    assert list(report.columns) == ['dtype', 'bytes', 'wide_bytes', 'ratio']
+    assert report.index.tolist() == list(df.columns) + ['total']
+    columns = report.drop(index='total')
+    assert columns['dtype'].tolist() == [str(dtype) for dtype in df.dtypes]
+    assert columns['bytes'].tolist() == df.memory_usage(index=False, deep=True).tolist()
+    assert report.loc['total', 'bytes'] == columns['bytes'].sum()
+    assert report.loc['total', 'wide_bytes'] == columns['wide_bytes'].sum()
+    # the compact dtypes take less memory than the wide ones, column by column and in total
+    assert (columns['bytes'] <= columns['wide_bytes']).all()
+    assert report.loc['total', 'ratio'] > 2
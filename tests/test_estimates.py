@@ -0,0 +1,110 @@
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.testing import assert_allclose
+
+from longevity.estimates import LongevityEstimator
+from longevity.markov import reward_moments
+from longevity.scoring import death_probabilities, prevalence_matrix, survival_matrices, total_life_matrix
+from longevity.selection import build_hazard_model
+
+
+def test_gini_of_known_inputs():
+    assert LongevityEstimator.gini(np.array([3., 3., 3., 3.])) == pytest.approx(0, abs=1e-6)
+    # a single owner of everything among n values
+    assert LongevityEstimator.gini(np.array([0., 0., 0., 1.])) == pytest.approx(.75, abs=1e-6)
+    assert LongevityEstimator.gini(np.array([1., 2., 3., 4.])) == pytest.approx(.25)
+
+
+def test_theil_of_known_inputs():
+    assert LongevityEstimator.theil(np.array([3., 3., 3., 3.])) == pytest.approx(0)
+    assert LongevityEstimator.theil(np.array([0., 0., 0., 1.])) == pytest.approx(np.log(4))
+
+
+@pytest.mark.parametrize('coefficient', [LongevityEstimator.gini, LongevityEstimator.theil])
+def test_weights_count_as_repeated_values(coefficient):
+    values, weights = np.array([4., 1., 2.]), np.array([1., 3., 2.])
+    assert coefficient(values, weights) == pytest.approx(coefficient(np.repeat(values, weights.astype(int))))
+    # and the coefficients of the slices of an array are computed at once
+    stacked = np.stack([values, values[::-1] * 2])
+    assert_allclose(coefficient(stacked, weights, axis=1), [coefficient(values, weights),
+                                                            coefficient(values[::-1] * 2, weights)])
+
+
+@pytest.mark.parametrize('healthy_life_only', [True, False])
+def test_lifetime_distribution_matches_the_moments(prepared: Tuple[pd.DataFrame, pd.DataFrame],
+                                                   healthy_life_only: bool):
+    df, panel_df = prepared
+    estimator = LongevityEstimator(df, panel_df, 'female', 5, smooth_prevalence=True)
+    values, probabilities = estimator.compute_lifetime_distribution(healthy_life_only)
+    mean, _ = estimator.compute_lifetime_estimates(healthy_life_only)
+    assert_allclose(probabilities.sum(axis=-1), 1)
+    assert_allclose((values * probabilities).sum(axis=-1), mean, rtol=1e-8)
+
+    # the second moment of a fixed reward, with the square of the rewards
+    U, P = estimator.compute_UP()
+    R = estimator.generate_prevalence_matrix() if healthy_life_only else LongevityEstimator.total_life_matrix(len(U))
+    _, m2 = reward_moments(U, P, [R, R ** 2], k=2)
+    assert_allclose((values ** 2 * probabilities).sum(axis=-1), m2, rtol=1e-8)
+
+
+@pytest.mark.parametrize('smooth_prevalence', [False, True])
+def test_grid_estimates_match_the_estimator_of_each_subgroup(prepared: Tuple[pd.DataFrame, pd.DataFrame],
+                                                             smooth_prevalence: bool):
+    df, panel_df = prepared
+    grid = LongevityEstimator.compute_grid_estimates(df, panel_df, ['male', 'female'], [1, 5, 9],
+                                                     smooth_prevalence=smooth_prevalence)
+    assert len(grid) == 2 * 3 * 2 * (int(df.age.max()) - int(df.age.min()) + 1)
+    for gender, income_dcl in [('male', 1), ('female', 5), ('male', 9)]:
+        estimator = LongevityEstimator(df, panel_df, gender, income_dcl, smooth_prevalence=smooth_prevalence)
+        for measure, healthy_life_only in [('healthy', True), ('total', False)]:
+            mean, std = estimator.compute_lifetime_estimates(healthy_life_only)
+            cell = grid[(grid['gender'] == gender) & (grid['income_dcl'] == income_dcl) &
+                        (grid['measure'] == measure)].sort_values('age')
+            assert_allclose(cell['mean'], mean, rtol=1e-9)
+            assert_allclose(cell['std'], std, rtol=1e-9)
+
+
+def test_grid_inequality_matches_the_distributions(prepared: Tuple[pd.DataFrame, pd.DataFrame]):
+    df, panel_df = prepared
+    grid = LongevityEstimator.compute_grid_inequality(df, panel_df, ['male'], [3], smooth_prevalence=True)
+    values, probabilities = LongevityEstimator(df, panel_df, 'male', 3, smooth_prevalence=True) \
+        .compute_lifetime_distribution(False)
+
+    total = grid[grid['measure'] == 'total'].sort_values('age')
+    assert_allclose(total['gini'], LongevityEstimator.gini(values, probabilities, axis=-1))
+    assert_allclose(total['theil'], LongevityEstimator.theil(values, probabilities, axis=-1))
+
+
+@pytest.mark.parametrize('healthy_life_only', [True, False])
+def test_sensitivities_match_finite_differences(prepared: Tuple[pd.DataFrame, pd.DataFrame],
+                                                healthy_life_only: bool):
+    df, panel_df = prepared
+    estimator = LongevityEstimator(df, panel_df, 'male', 4, smooth_prevalence=True,
+                                   hazard_model=build_hazard_model(('age_2',), 1.))
+    mean, _, sensitivities = estimator.compute_lifetime_sensitivities(healthy_life_only)
+    coeffs = estimator.export_coefficients()
+    assert set(sensitivities) == set(coeffs) | {'prevalence'}
+    ages = np.arange(estimator.start_age, estimator.end_age)
+    prevalences = estimator.disability_prevalence.curve(4, ages)
+
+    def life_expectancy(coeffs, prevalences):
+        R = prevalence_matrix(prevalences) if healthy_life_only else total_life_matrix(len(ages))
+        return reward_moments(*survival_matrices(death_probabilities(coeffs, ages, 4, 0)), R, k=1)[0]
+
+    assert_allclose(life_expectancy(coeffs, prevalences), mean, rtol=1e-10)
+    eps = 1e-6
+    for name, value in coeffs.items():
+        # a relative step, the coefficient of age squared is small
+        h = eps * max(abs(value), 1e-3)
+        difference = (life_expectancy(dict(coeffs, **{name: value + h}), prevalences) -
+                      life_expectancy(dict(coeffs, **{name: value - h}), prevalences)) / (2 * h)
+        assert_allclose(sensitivities[name], difference, rtol=1e-4, atol=1e-6, err_msg=name)
+    for j in range(len(ages)):
+        step = np.zeros(len(ages))
+        step[j] = eps
+        difference = (life_expectancy(coeffs, prevalences + step) - life_expectancy(coeffs, prevalences - step)) / \
+            (2 * eps)
+        assert_allclose(sensitivities['prevalence'][:, j], difference, rtol=1e-4, atol=1e-6)
@@ -0,0 +1,162 @@
+import os
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from longevity import cache, synthetic
+from longevity.data_manager import DataManager
+from longevity.incremental import IncrementalDataset
+
+ROWS = 6000
+# the columns compared with a full cleaning, as numbers
+NUMERIC_COLUMNS = ['wave', 'gender_num', 'age', 'disabled', 'income_dcl', 'income', 'deceased_age', 'is_dead',
+                   'is_aged', 'y']
+
+
+@pytest.fixture(scope='module')
+def waves(tmp_path_factory: pytest.TempPathFactory) -> Dict[str, str]:
+    """
+    A synthetic data-set with one EasyShare file per wave and the cover screens, a corrected version of a wave
+    where some incomes are missing and updated cover screens where some deceased ages are corrected
+    """
+    directory = tmp_path_factory.mktemp('waves')
+    easy, cover_screens = synthetic.generate(ROWS, seed=1)
+    paths = {}
+    for wave, rows in easy.groupby('wave'):
+        paths['wave{}'.format(wave)] = str(directory / 'wave{}.dta'.format(wave))
+        rows.to_stata(paths['wave{}'.format(wave)], write_index=False, value_labels=synthetic.EASY_SHARE_LABELS)
+    paths['easy_share'] = str(directory / 'easy_share.dta')
+    easy.to_stata(paths['easy_share'], write_index=False, value_labels=synthetic.EASY_SHARE_LABELS)
+    corrected = easy.copy()
+    corrected.loc[np.flatnonzero(corrected['wave'] == 5)[::5], 'thinc_m'] = np.nan
+    paths['corrected_wave'] = str(directory / 'corrected_wave5.dta')
+    corrected[corrected['wave'] == 5].to_stata(paths['corrected_wave'], write_index=False,
+                                                value_labels=synthetic.EASY_SHARE_LABELS)
+    paths['corrected_easy_share'] = str(directory / 'corrected_easy_share.dta')
+    corrected.to_stata(paths['corrected_easy_share'], write_index=False, value_labels=synthetic.EASY_SHARE_LABELS)
+
+    paths['deaths'] = str(directory / 'cover_screens.dta')
+    cover_screens.to_stata(paths['deaths'], write_index=False, value_labels=synthetic.COVER_SCREENS_LABELS)
+    updated = cover_screens.copy()
+    dead = np.flatnonzero(updated['deceased_age'] > 0)[::10]
+    updated.loc[dead, 'deceased_age'] += 1
+    paths['updated_deaths'] = str(directory / 'updated_cover_screens.dta')
+    updated.to_stata(paths['updated_deaths'], write_index=False, value_labels=synthetic.COVER_SCREENS_LABELS)
+    return paths
+
+
+def _cleaned(easy_share_dta_path: str, share_death_dta_path: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    return DataManager(easy_share_dta_path, share_death_dta_path, verbose=False).prepare_dataset_and_panel()
+
+
+def _assert_same_rows(df: pd.DataFrame, expected: pd.DataFrame):
+    assert len(df) == len(expected) > 0
+    keys = ['mergeid', 'age', 'y'] if 'y' in df else ['mergeid', 'age']
+    df, expected = [frame.reset_index(drop=True).assign(mergeid=frame['mergeid'].astype(str).to_numpy())
+                    .sort_values(keys, kind='stable') for frame in (df, expected)]
+    assert df['mergeid'].tolist() == expected['mergeid'].tolist()
+    for column in NUMERIC_COLUMNS:
+        if column in expected:
+            np.testing.assert_array_equal(df[column].to_numpy(dtype=float, na_value=np.nan),
+                                          expected[column].to_numpy(dtype=float, na_value=np.nan), err_msg=column)
+
+
+def test_updates_match_a_full_cleaning(waves: Dict[str, str], tmp_path):
+    wave_paths = sorted(path for name, path in waves.items() if name.startswith('wave'))
+    dataset = IncrementalDataset(str(tmp_path), partitions=4)
+    dataset.update(wave_paths[:2], waves['deaths'])
+    dataset.save()
+
+    # a new run, with the next waves
+    dataset = IncrementalDataset(str(tmp_path), partitions=4)
+    dataset.update(wave_paths[2:])
+    df, panel_df = _cleaned(waves['easy_share'], waves['deaths'])
+    _assert_same_rows(dataset.df, df)
+    _assert_same_rows(dataset.panel_df, panel_df)
+    dataset.save()
+
+    # corrected cover screens only clean the individuals they change again
+    dataset = IncrementalDataset(str(tmp_path), partitions=4)
+    affected = dataset.update(share_death_dta_path=waves['updated_deaths'])
+    assert 0 < len(affected) < len(dataset.df['mergeid'].unique())
+    df, panel_df = _cleaned(waves['easy_share'], waves['updated_deaths'])
+    _assert_same_rows(dataset.df, df)
+    _assert_same_rows(dataset.panel_df, panel_df)
+
+    # the rows of a corrected wave replace the ingested ones
+    dataset.update([waves['corrected_wave']])
+    df, panel_df = _cleaned(waves['corrected_easy_share'], waves['updated_deaths'])
+    _assert_same_rows(dataset.df, df)
+    _assert_same_rows(dataset.panel_df, panel_df)
+
+
+def test_an_update_only_writes_the_affected_partitions(waves: Dict[str, str], tmp_path):
+    wave_paths = sorted(path for name, path in waves.items() if name.startswith('wave'))
+    dataset = IncrementalDataset(str(tmp_path), partitions=8)
+    dataset.update(wave_paths, waves['deaths'])
+    dataset.save()
+    before = dict(dataset.paths)
+
+    # a single corrected individual
+    mergeid = str(dataset.df['mergeid'].iloc[0])
+    deaths = pd.read_stata(waves['deaths'], convert_categoricals=False)
+    deaths.loc[deaths['mergeid'] == mergeid, 'deceased_age'] = -2
+    path = os.path.join(str(tmp_path), 'corrected.dta')
+    deaths.to_stata(path, write_index=False, value_labels=synthetic.COVER_SCREENS_LABELS)
+
+    assert dataset.update(share_death_dta_path=path).tolist() == [mergeid]
+    dataset.save()
+    rewritten = {name for name in before if dataset.paths.get(name) != before[name]}
+    partitions = {name.rsplit('-', 1)[-1] for name in rewritten if name != 'deaths'}
+    assert 'deaths' in rewritten and len(partitions) == 1
+    assert not any(name.startswith('raw-') for name in rewritten)
+    assert sorted(os.listdir(os.path.join(str(tmp_path), 'frames'))) == sorted(
+        os.path.basename(path) for path in dataset.paths.values())
+
+    with pytest.raises(ValueError):
+        IncrementalDataset(str(tmp_path), partitions=4)
+
+
+def test_save_replaces_the_frames_of_a_crashed_save(waves: Dict[str, str], tmp_path):
+    dataset = IncrementalDataset(str(tmp_path), partitions=2)
+    dataset.update([waves['easy_share']], waves['deaths'])
+    # a previous save wrote some of the frames of the next version, but not the state
+    stale = sorted(name for name in dataset.changed if name in dataset.frames)[:3]
+    for name in stale:
+        cache.save_frame(dataset.frames[name].iloc[:1], os.path.join(str(tmp_path), 'frames', '{}.{}'.format(
+            name, dataset.version + 1)))
+    dataset.save()
+
+    loaded = IncrementalDataset(str(tmp_path), partitions=2)
+    for name in stale:
+        assert len(loaded.frames[name]) == len(dataset.frames[name]) > 1
+    _assert_same_rows(loaded.df, dataset.df)
+    _assert_same_rows(loaded.panel_df, dataset.panel_df)
+
+
+def test_a_new_wave_only_cleans_its_rows(waves: Dict[str, str], tmp_path, monkeypatch):
+    wave_paths = sorted(path for name, path in waves.items() if name.startswith('wave'))
+    dataset = IncrementalDataset(str(tmp_path), partitions=4)
+    dataset.update(wave_paths[:-1], waves['deaths'])
+    dataset.save()
+    before = dict(dataset.paths)
+
+    cleaned = []
+    prepare_dataset = DataManager.prepare_dataset
+
+    def counting_prepare_dataset(self, *args, **kwargs):
+        cleaned.append(len(self.df))
+        return prepare_dataset(self, *args, **kwargs)
+
+    monkeypatch.setattr(DataManager, 'prepare_dataset', counting_prepare_dataset)
+    dataset.update(wave_paths[-1:])
+    assert sum(cleaned) == len(DataManager.read_easy_share(wave_paths[-1]))
+    dataset.save()
+    # the stored rows are kept and the new ones appended, only the last panel rows of the dead are replaced
+    assert all(dataset.paths[name] == path for name, path in before.items() if not name.startswith('panel_tail'))
+
+    df, panel_df = _cleaned(waves['easy_share'], waves['deaths'])
+    _assert_same_rows(dataset.df, df)
+    _assert_same_rows(dataset.panel_df, panel_df)
@@ -0,0 +1,73 @@
+from math import comb
+from typing import List
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+from longevity.markov import is_survival_matrix, reward_moments, solve_survival_system
+from longevity.scoring import prevalence_matrix, survival_matrices, total_life_matrix
+
+
+def dense_moments(U: np.array, P: np.array, R: List[np.array]) -> List[np.array]:
+    """
+    The moments of the accumulated rewards of Caswell, Zarulli (2018), with the fundamental matrix
+    """
+    d = len(U)
+    N = np.linalg.inv(np.eye(d) - U)
+    Z = np.eye(d, d + 1)
+    rho = []
+    for n in range(1, len(R) + 1):
+        rhs = Z @ (P * R[n - 1]).T @ np.ones(d + 1)
+        for i in range(1, n):
+            rhs += comb(n, i) * (U * (Z @ R[i - 1] @ Z.T)).T @ rho[n - i - 1]
+        rho.append(N.T @ rhs)
+    return rho
+
+
+@pytest.fixture
+def chain():
+    rng = np.random.default_rng(0)
+    p_dead = np.sort(rng.uniform(.01, .4, 12))
+    U, P = survival_matrices(p_dead)
+    return U, P, rng.uniform(0, .5, 12)
+
+
+@pytest.mark.parametrize('healthy_life_only', [True, False])
+def test_survival_moments_match_the_fundamental_matrix(chain, healthy_life_only: bool):
+    U, P, prevalences = chain
+    assert is_survival_matrix(U)
+    R = prevalence_matrix(prevalences) if healthy_life_only else total_life_matrix(len(U))
+    # the k-th moment of a fixed reward is its k-th power
+    R = [R ** n for n in range(1, 4)]
+    for moment, expected in zip(reward_moments(U, P, R, k=3), dense_moments(U, P, R)):
+        assert_allclose(moment, expected, rtol=1e-10)
+
+
+def test_other_chains_use_the_dense_solution(chain):
+    U, P, prevalences = chain
+    # a chance of staying at the same age breaks the survival structure
+    U = U.copy()
+    U[np.arange(3), np.arange(3)] = .1
+    U[np.arange(1, 4), np.arange(3)] -= .1
+    P[:len(U), :len(U)] = U
+    assert not is_survival_matrix(U)
+    R = [prevalence_matrix(prevalences) ** n for n in range(1, 3)]
+    for moment, expected in zip(reward_moments(U, P, R, k=2), dense_moments(U, P, R)):
+        assert_allclose(moment, expected, rtol=1e-10)
+
+
+def test_stacked_chains_are_solved_at_once(chain):
+    U, P, prevalences = chain
+    stack = np.stack([U, U * .9])
+    b = np.random.default_rng(1).uniform(size=(2, len(U), 3))
+    expected = [np.linalg.solve((np.eye(len(U)) - u).T, b_i) for u, b_i in zip(stack, b)]
+    assert_allclose(solve_survival_system(stack, b), expected, rtol=1e-10)
+
+
+def test_low_survivorship_falls_back_to_the_recurrence():
+    # the survivorship underflows the closed form long before the end of the chain
+    U, P = survival_matrices(np.full(400, .8))
+    b = np.ones(400)
+    expected = np.linalg.solve((np.eye(400) - U).T, b)
+    assert_allclose(solve_survival_system(U, b), expected, rtol=1e-10)
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+from longevity.markov import reward_moments
+from longevity.multistate import DISABLED, HEALTHY, MultistateChain
+from longevity.scoring import survival_matrices, total_life_matrix
+
+
+@pytest.fixture
+def p_dead() -> np.array:
+    return np.sort(np.random.default_rng(0).uniform(.01, .4, 15))
+
+
+def test_single_state_chain_matches_the_survival_chain(p_dead: np.array):
+    chain = MultistateChain.from_survival(p_dead)
+    U, P = survival_matrices(p_dead)
+    expected = reward_moments(U, P, total_life_matrix(len(p_dead)), k=3)
+    for moment, expected_moment in zip(chain.reward_moments(*chain.total_rewards(), k=3), expected):
+        assert_allclose(moment[:, 0], expected_moment, rtol=1e-10)
+
+
+def test_health_states_with_the_same_mortality_match_the_survival_chain(p_dead: np.array):
+    # moving between health states does not change the total life when mortality does not depend on them
+    transitions = np.broadcast_to([[.8, .2], [.3, .7]], (len(p_dead), 2, 2))
+    chain = MultistateChain(np.column_stack([p_dead, p_dead]), transitions)
+    single = MultistateChain.from_survival(p_dead)
+    for moment, expected in zip(chain.reward_moments(*chain.total_rewards(), k=2),
+                                single.reward_moments(*single.total_rewards(), k=2)):
+        assert_allclose(moment, np.repeat(expected, 2, axis=1), rtol=1e-10)
+
+
+def test_healthy_life_of_health_states_without_transitions(p_dead: np.array):
+    chain = MultistateChain(np.column_stack([p_dead, p_dead * 1.5]))
+    healthy, _ = chain.reward_moments(*chain.healthy_rewards(), k=2)
+    total, _ = chain.reward_moments(*chain.total_rewards(), k=2)
+    assert_allclose(healthy[:, HEALTHY], total[:, HEALTHY], rtol=1e-10)
+    assert_allclose(healthy[:, DISABLED], 0, atol=1e-12)
+
+
+def test_finer_steps_keep_the_yearly_mortality():
+    # a constant mortality, as yearly steps and as quarter year steps over the same age range
+    yearly = MultistateChain.from_survival(np.full(40, .1))
+    quarterly = MultistateChain.from_survival(MultistateChain.step_probabilities(np.full(160, .1), .25), step=.25)
+    assert_allclose(quarterly.age_classes[::4], yearly.age_classes)
+    expected = yearly.reward_moments(*yearly.total_rewards(), k=1)[0][:, 0]
+    mean = quarterly.reward_moments(*quarterly.total_rewards(), k=1)[0][::4, 0]
+    # the chains only differ by when deaths happen within a year
+    assert_allclose(mean, expected, atol=.1)
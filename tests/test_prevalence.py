@@ -0,0 +1,82 @@
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.testing import assert_allclose
+
+from longevity.prevalence import PrevalenceTable, smooth_curves
+
+
+def test_table_counts_the_observations_of_each_cell():
+    df = pd.DataFrame({'is_aged': pd.array([65, 65, 65, 66, 67, 67, None, 90], dtype='Int16'),
+                       'income_dcl': pd.array([1, 1, 2, 1, 2, 2, 1, 1], dtype='Int8'),
+                       'disabled': np.array([1, 0, 0, 1, 1, 0, 1, 0], dtype='int8')})
+    table = PrevalenceTable.from_frame(df, max_age=88)
+    assert table.start_age == 65
+    assert table.income_dcls.tolist() == [1, 2]
+    # 66 has a disabled but no non-disabled observation of decile 1, and no observation of decile 2
+    assert_allclose(table.values, [[1., 0.], [np.nan, 0.], [0., 1.]])
+
+
+def test_table_is_shared_by_equal_frames(prepared: Tuple[pd.DataFrame, pd.DataFrame]):
+    df = prepared[0]
+    table = PrevalenceTable.for_frame(df)
+    assert PrevalenceTable.for_frame(df) is table
+    assert PrevalenceTable.for_frame(df.copy()) is table
+    assert PrevalenceTable.for_frame(df, max_age=None) is not table
+
+
+def test_table_follows_a_modified_frame(prepared: Tuple[pd.DataFrame, pd.DataFrame]):
+    df = prepared[0].copy()
+    table = PrevalenceTable.for_frame(df)
+    df['disabled'] = np.int8(1) - df['disabled']
+
+    modified = PrevalenceTable.for_frame(df)
+    assert modified is not table
+    assert_allclose(modified.values, PrevalenceTable.from_frame(df).values, equal_nan=True)
+    assert_allclose(modified.disabled, table.healthy)
+
+
+def test_table_follows_a_frame_modified_in_place(prepared: Tuple[pd.DataFrame, pd.DataFrame]):
+    df = prepared[0].copy()
+    table = PrevalenceTable.for_frame(df)
+    df.loc[df['disabled'] == 0, 'disabled'] = np.int8(1)
+
+    modified = PrevalenceTable.for_frame(df)
+    assert modified is not table
+    assert_allclose(modified.values, PrevalenceTable.from_frame(df).values, equal_nan=True)
+    assert_allclose(modified.disabled, table.disabled + table.healthy)
+
+
+def test_smoothing_recovers_exponential_curves():
+    ages = np.arange(65, 90)
+    curves = np.column_stack([.01 * np.exp(.1 * ages), 2 * np.exp(-.05 * ages)])
+    assert_allclose(smooth_curves(ages, curves, 1.), curves, rtol=1e-10)
+
+
+def test_smoothing_matches_a_weighted_fit_of_each_curve():
+    rng = np.random.default_rng(0)
+    ages = np.arange(65, 80)
+    curves = rng.uniform(0, 1, (len(ages), 3))
+    curves[[2, 5], 0] = 0
+    curves[7, 1] = np.nan
+    weights = rng.uniform(1, 5, curves.shape)
+    smoothed = smooth_curves(ages, curves, weights)
+    for i in range(curves.shape[1]):
+        used = curves[:, i] > 0
+        b, a = np.polyfit(ages[used], np.log(curves[used, i]), 1, w=np.sqrt(weights[used, i]))
+        assert_allclose(smoothed[:, i], np.exp(a + b * ages), rtol=1e-8)
+
+
+def test_smoothing_of_curves_with_few_values():
+    ages = np.arange(3)
+    curves = np.array([[0., 0.], [.2, 0.], [0., np.nan]])
+    assert_allclose(smooth_curves(ages, curves, 1.), [[.2, 0.], [.2, 0.], [.2, 0.]])
+
+
+def test_smoothed_table_is_built_once(prepared: Tuple[pd.DataFrame, pd.DataFrame]):
+    table = PrevalenceTable.from_frame(prepared[0])
+    smoothed = table.smoothed()
+    assert table.smoothed() is smoothed and smoothed.smoothed() is smoothed
+    assert np.isfinite(smoothed.values).all() and (smoothed.values > 0).all()
+    assert_allclose(smoothed.disabled, table.disabled)
@@ -0,0 +1,86 @@
+import json
+import tracemalloc
+from collections import Counter
+
+import pandas as pd
+
+from longevity.data_manager import DataManager
+from longevity.profiling import Profiler
+
+
+def test_rows_and_drops_match_the_events(raw: pd.DataFrame):
+    profiler = Profiler()
+    dm = DataManager.from_frame(raw.copy(deep=False), verbose=False, profiler=profiler)
+    df = dm.prepare_dataset()
+
+    drops = Counter()
+    for event in dm.events:
+        if event[0] == 'drop':
+            drops[event[1]] += event[2]
+    top, steps = profiler.records[0], profiler.records[1:]
+    assert (top.name, top.parent, top.rows_in, top.rows_out) == ('prepare_dataset', None, len(raw), len(df))
+    assert top.dropped == dict(drops)
+
+    assert [record.name for record in steps] == [step.__name__ for step, _ in dm.steps(65, 90, 10)]
+    assert all(record.parent == 'prepare_dataset' for record in steps)
+    assert [record.rows_in for record in steps[1:]] == [record.rows_out for record in steps[:-1]]
+    for record in steps:
+        assert record.rows_in - record.rows_out == sum(record.dropped.values()), record.name
+    assert sum((Counter(record.dropped) for record in steps), Counter()) == drops
+
+
+def test_nested_stages_record_their_parent():
+    profiler = Profiler()
+    with profiler.stage('outer', rows=10) as outer:
+        with profiler.stage('inner', rows=10) as inner:
+            profiler.drop('reason', 3)
+            inner.rows_out = 7
+        profiler.drop('other', 2)
+        outer.rows_out = 5
+    # outside of a stage, nothing is recorded
+    profiler.drop('reason', 1)
+
+    assert [(record.name, record.parent) for record in profiler.records] == [('outer', None), ('inner', 'outer')]
+    assert outer.dropped == {'reason': 3, 'other': 2}
+    assert inner.dropped == {'reason': 3}
+    assert outer.wall_time >= inner.wall_time >= 0
+
+
+def test_hook_wraps_a_step(raw: pd.DataFrame):
+    profiler = Profiler()
+    dm = DataManager.from_frame(raw.copy(deep=False), verbose=False)
+    process_country = dm.process_country
+    dm.process_country = profiler.hook(dm.process_country, rows=lambda: len(dm.df))
+    assert dm.process_country.__name__ == 'process_country'
+    dm.process_country()
+
+    record, = profiler.records
+    assert (record.name, record.parent, record.rows_in, record.rows_out) == (
+        'process_country', None, len(raw), len(dm.df))
+    assert sum(record.dropped.values()) == 0  # the DataManager has no profiler, its drops are not accounted
+
+    profiler.hook(process_country, name='country')()
+    assert profiler.records[-1].name == 'country'
+
+
+def test_json_round_trip(raw: pd.DataFrame, tmp_path):
+    tracing = tracemalloc.is_tracing()
+    profiler = Profiler(trace_memory=True)
+    try:
+        dm = DataManager.from_frame(raw.copy(deep=False), verbose=False, profiler=profiler)
+        dm.prepare_dataset_and_panel()
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+    path = str(tmp_path / 'profile.json')
+    report = profiler.to_json(path)
+    with open(path) as f:
+        assert f.read() == report
+    assert json.loads(report) == {'stages': profiler.to_dict()}
+    assert all(stage['traced_peak_memory'] is not None for stage in json.loads(report)['stages'])
+
+    frame = profiler.to_frame()
+    assert frame['name'].tolist() == [record.name for record in profiler.records]
+    dropped = [column for column in frame.columns if column.startswith('dropped_')]
+    assert frame.loc[0, dropped].sum() == sum(profiler.records[0].dropped.values())
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tracemalloc
+from typing import List
+
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from longevity import cache, synthetic
+from longevity.data_manager import DataManager, _concat_chunks
+from tests.conftest import ROWS
+
+
+def _peak_memory(*args, **kwargs) -> int:
+    """
+    The peak of the memory allocated by a call to DataManager.read_dataset
+    """
+    tracemalloc.start()
+    try:
+        DataManager.read_dataset(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize('chunksize', [777, ROWS // 4, 10 * ROWS])
+def test_streaming_matches_eager_loading(dta_paths: List[str], raw: pd.DataFrame, chunksize: int):
+    df = DataManager.read_dataset(*dta_paths, chunksize=chunksize)
+    assert_frame_equal(df, raw)
+    for column in df.columns[df.dtypes == 'category']:
+        assert df[column].cat.ordered == raw[column].cat.ordered
+
+
+def test_streaming_keeps_the_stata_order_of_categories(dta_paths: List[str], raw: pd.DataFrame):
+    # small chunks see only some of the labels of a column, in a different order than the file
+    df = DataManager.read_dataset(*dta_paths, chunksize=50)
+    for column in raw.columns[raw.dtypes == 'category'].drop('mergeid'):
+        assert df[column].dtype == raw[column].dtype
+
+
+def test_streaming_peak_memory_is_below_eager_loading(dta_paths: List[str]):
+    assert _peak_memory(*dta_paths, chunksize=ROWS // 4) < _peak_memory(*dta_paths)
+
+
+def test_released_chunks_are_freed_while_they_are_concatenated(raw: pd.DataFrame):
+    def peak(release: bool) -> int:
+        """
+        The memory allocated while the chunks are concatenated, above that of the chunks
+        """
+        tracemalloc.start()
+        try:
+            # the chunks are built while tracing, so that freeing them is accounted for
+            chunks = [raw.iloc[i:i + 1000].copy() for i in range(0, len(raw), 1000)]
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            df = _concat_chunks(chunks, release=release)
+            assert len(df) == len(raw) and len(chunks) == (0 if release else len(df) // 1000 + 1)
+            return tracemalloc.get_traced_memory()[1] - before
+        finally:
+            tracemalloc.stop()
+
+    # without releasing them, the chunks are held next to a whole copy of the data-set
+    assert peak(True) < .75 * peak(False)
+
+
+def _copy_dataset(dta_paths: List[str], directory) -> List[str]:
+    paths = [os.path.join(directory, os.path.basename(path)) for path in dta_paths]
+    for source, path in zip(dta_paths, paths):
+        shutil.copy(source, path)
+    return paths
+
+
+def test_cached_read_matches_an_uncached_read(dta_paths: List[str], raw: pd.DataFrame, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    assert_frame_equal(DataManager.read_dataset(*dta_paths, cache_dir=cache_dir), raw)
+
+    # a hit does not read the Stata files
+    def read_stata(*args, **kwargs):
+        raise AssertionError('the Stata files are read again')
+
+    monkeypatch.setattr(pd, 'read_stata', read_stata)
+    assert_frame_equal(DataManager.read_dataset(*dta_paths, cache_dir=cache_dir), raw)
+    assert_frame_equal(DataManager.read_dataset(*dta_paths, cache_dir=cache_dir, chunksize=ROWS // 4), raw)
+
+
+def test_cached_read_follows_the_files(dta_paths: List[str], raw: pd.DataFrame, tmp_path):
+    paths = _copy_dataset(dta_paths, tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    DataManager.read_dataset(*paths, cache_dir=cache_dir)
+
+    # a touched file is read again, its content has not changed
+    stat = os.stat(paths[0])
+    os.utime(paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert_frame_equal(DataManager.read_dataset(*paths, cache_dir=cache_dir), raw)
+    assert len([name for name in os.listdir(cache_dir) if name != 'file_hashes.json']) == 2
+
+    synthetic.write(*paths, rows=ROWS // 2, seed=1)
+    assert_frame_equal(DataManager.read_dataset(*paths, cache_dir=cache_dir), DataManager.read_dataset(*paths))
+
+
+def test_saved_frame_is_replaced(raw: pd.DataFrame, tmp_path):
+    directory = str(tmp_path / 'frame')
+    cache.save_frame(raw, directory)
+    cache.save_frame(raw.iloc[:10], directory)
+    assert_frame_equal(cache.load_frame(directory), raw.iloc[:10])
+    assert os.listdir(tmp_path) == ['frame']
+
+
+def test_cached_frame_is_not_replaced(raw: pd.DataFrame, tmp_path):
+    directory = str(tmp_path / 'frame')
+    cache.save_frame(raw, directory, replace=False)
+    # the keys of the caches depend on the content only, a frame saved at the same place again is discarded
+    cache.save_frame(raw.iloc[:10], directory, replace=False)
+    assert_frame_equal(cache.load_frame(directory), raw)
+    assert os.listdir(tmp_path) == ['frame']
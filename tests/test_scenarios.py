@@ -0,0 +1,83 @@
+import os
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.testing import assert_allclose
+
+from longevity.estimates import LongevityEstimator
+from longevity.scenarios import SCENARIO_COLUMNS, ScenarioGrid, read_scenarios, run_scenarios
+
+
+@pytest.fixture(scope='module')
+def results(raw: pd.DataFrame) -> pd.DataFrame:
+    scenarios = pd.DataFrame({'start_age': 65, 'end_age': 90, 'income_bins': 10, 'gender': ['female', 'male', 'male'],
+                              'income_dcl': [2, 5, 5], 'measure': ['healthy', 'healthy', 'total']})
+    return run_scenarios(raw, scenarios)
+
+
+def test_scenarios_are_read_with_their_defaults(tmp_path):
+    path = str(tmp_path / 'scenarios.csv')
+    with open(path, 'w') as f:
+        f.write('gender, income_dcl, measure, start_age\nMale, 3, total, 70\nfemale, 1,,\nfemale, 1, healthy, 65\n')
+    scenarios = read_scenarios(path)
+    assert list(scenarios.columns) == SCENARIO_COLUMNS
+    assert scenarios.values.tolist() == [[70, 90, 10, 'male', 3, 'total'], [65, 90, 10, 'female', 1, 'healthy']]
+
+    json_path = str(tmp_path / 'scenarios.jsonl')
+    scenarios.to_json(json_path, orient='records', lines=True)
+    pd.testing.assert_frame_equal(read_scenarios(json_path), scenarios)
+
+
+@pytest.mark.parametrize('content, message', [('gender\nmale\n', 'no column income_dcl'),
+                                              ('gender,income_dcl\nother,1\n', 'Unknown gender'),
+                                              ('gender,income_dcl,measure\nmale,1,sick\n', 'Unknown measure')])
+def test_invalid_scenarios_are_rejected(tmp_path, content: str, message: str):
+    path = str(tmp_path / 'scenarios.csv')
+    with open(path, 'w') as f:
+        f.write(content)
+    with pytest.raises(ValueError, match=message):
+        read_scenarios(path)
+
+
+def test_scenarios_match_the_grid_estimates(prepared: Tuple[pd.DataFrame, pd.DataFrame], results: pd.DataFrame):
+    df, panel_df = prepared
+    estimates = LongevityEstimator.compute_grid_estimates(df, panel_df, genders=['female', 'male'],
+                                                          income_dcls=[2, 5])
+    assert results[['gender', 'income_dcl', 'measure']].drop_duplicates().values.tolist() == [
+        ['female', 2, 'healthy'], ['male', 5, 'healthy'], ['male', 5, 'total']]
+    expected = results[['gender', 'income_dcl', 'measure', 'age']].astype({'gender': str, 'measure': str}).merge(
+        estimates, how='left')
+    assert expected['mean'].notna().all()
+    assert_allclose(results[['mean', 'std']].to_numpy(), expected[['mean', 'std']].to_numpy(), rtol=1e-12)
+
+
+def test_grid_lookups(results: pd.DataFrame):
+    grid = ScenarioGrid(results)
+    row = results[(results['gender'] == 'male') & (results['income_dcl'] == 5) & (results['measure'] == 'total') &
+                  (results['age'] == 70)].iloc[0]
+    assert grid.lookup('male', 5, 70, measure='total') == (row['mean'], row['std'])
+
+    ages, mean, std = grid.curve('female', 2)
+    curve = results[(results['gender'] == 'female') & (results['income_dcl'] == 2)]
+    assert ages.tolist() == curve['age'].tolist()
+    assert_allclose(mean, curve['mean'])
+    assert_allclose(std, curve['std'])
+
+    with pytest.raises(KeyError, match='No scenario'):
+        grid.lookup('female', 5, 70)
+    with pytest.raises(KeyError, match='No estimate at age'):
+        grid.lookup('female', 2, ages[-1] + 1)
+
+
+def test_saved_grid_is_loaded_and_replaced(results: pd.DataFrame, tmp_path):
+    directory = str(tmp_path / 'grid')
+    ScenarioGrid(results[results['gender'] == 'female'].reset_index(drop=True)).save(directory)
+    # running the scenarios again into the same directory replaces the previous results
+    ScenarioGrid(results).save(directory)
+    grid = ScenarioGrid.load(directory)
+    pd.testing.assert_frame_equal(grid.results, results)
+    assert grid.scenarios.keys() == ScenarioGrid(results).scenarios.keys()
+    assert grid.lookup('male', 5, 70) == ScenarioGrid(results).lookup('male', 5, 70)
+    assert os.listdir(tmp_path) == ['grid']
@@ -0,0 +1,87 @@
+import json
+import os
+import subprocess
+import sys
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.testing import assert_allclose
+
+from longevity import cache, scoring
+from longevity.estimates import HAZARD_FEATURES, LongevityEstimator
+from longevity.selection import build_hazard_model
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize('hazard_model', [None, build_hazard_model(('age_2', 'income_age'), 1.)])
+def test_export_coefficients_match_the_model(prepared: Tuple[pd.DataFrame, pd.DataFrame], hazard_model):
+    df, panel_df = prepared
+    estimator = LongevityEstimator(df, panel_df, 'female', 5, hazard_model=hazard_model)
+    coeffs = estimator.export_coefficients()
+    X = panel_df[HAZARD_FEATURES].to_numpy(dtype=float)
+    p_dead = scoring.death_probabilities(coeffs, X[:, 0], X[:, 1], X[:, 2])
+    assert_allclose(p_dead, estimator.clf.predict_proba(panel_df[HAZARD_FEATURES])[:, 1], rtol=1e-9)
+
+
+@pytest.mark.parametrize('healthy_life_only', [True, False])
+@pytest.mark.parametrize('gender, income_dcl', [('female', 5), ('male', 2)])
+def test_score_matches_the_estimator(prepared: Tuple[pd.DataFrame, pd.DataFrame], tmp_path, healthy_life_only: bool,
+                                     gender: str, income_dcl: int):
+    df, panel_df = prepared
+    path = str(tmp_path / 'hazard.json')
+    LongevityEstimator(df, panel_df, 'female', 5).export_scoring_artifact(path)
+
+    mean, std = scoring.score(scoring.load_artifact(path), gender, income_dcl, healthy_life_only)
+    expected_mean, expected_std = LongevityEstimator(df, panel_df, gender, income_dcl).compute_lifetime_estimates(
+        healthy_life_only)
+    assert_allclose(mean, expected_mean, rtol=1e-9, equal_nan=True)
+    assert_allclose(std, expected_std, rtol=1e-9, equal_nan=True)
+
+
+def test_artifact_round_trip(tmp_path):
+    path = str(tmp_path / 'hazard.json')
+    coeffs = {'age': .1, 'income_dcl': -.05, 'gender_num': -.4, 'intercept': -9.}
+    prevalences = np.array([[.1, .2, .3], [.05, .1, .15]])
+    scoring.save_artifact(path, coeffs, [65, 66, 67], [1, 2], prevalences)
+
+    artifact = scoring.load_artifact(path)
+    assert artifact['coeffs'] == coeffs
+    assert artifact['ages'].tolist() == [65, 66, 67]
+    assert artifact['income_dcls'].tolist() == [1, 2]
+    assert_allclose(artifact['prevalences'], prevalences)
+    assert os.listdir(tmp_path) == ['hazard.json']
+
+
+def test_unknown_artifact_format_is_rejected(tmp_path):
+    path = tmp_path / 'hazard.json'
+    path.write_text(json.dumps({'format': scoring.ARTIFACT_FORMAT_VERSION + 1, 'coeffs': {}}))
+    with pytest.raises(ValueError):
+        scoring.load_artifact(str(path))
+
+
+def test_scoring_does_not_import_heavy_modules():
+    code = ('import sys\n'
+            'import longevity.scoring\n'
+            'print(",".join(module for module in ("pandas", "scipy", "sklearn") if module in sys.modules))')
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True, cwd=ROOT)
+    assert output.stdout.strip() == ''
+
+
+def test_estimates_with_coeffs_do_not_import_heavy_modules(prepared: Tuple[pd.DataFrame, pd.DataFrame], tmp_path):
+    df, panel_df = prepared
+    cache.save_frame(df.reset_index(drop=True), str(tmp_path / 'df'))
+    cache.save_frame(panel_df, str(tmp_path / 'panel'))
+    coeffs = LongevityEstimator(df, panel_df, 'female', 5).export_coefficients()
+    code = ('import sys\n'
+            'from longevity.cache import load_frame\n'
+            'from longevity.estimates import LongevityEstimator\n'
+            'estimator = LongevityEstimator(load_frame({df!r}), load_frame({panel!r}), "female", 5, coeffs={coeffs!r})\n'
+            'for healthy_life_only in (True, False):\n'
+            '    estimator.compute_lifetime_estimates(healthy_life_only)\n'
+            'print(",".join(module for module in ("scipy", "sklearn") if module in sys.modules))').format(
+        df=str(tmp_path / 'df'), panel=str(tmp_path / 'panel'), coeffs=coeffs)
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True, cwd=ROOT)
+    assert output.stdout.strip() == ''
@@ -0,0 +1,61 @@
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.testing import assert_allclose
+
+from longevity.cache import ModelCache
+from longevity.estimates import HAZARD_FEATURES, LongevityEstimator
+from longevity.selection import build_hazard_model, select_hazard_model
+
+CS = [.01, 1., 100.]
+
+
+@pytest.fixture(scope='module')
+def selection(prepared: Tuple[pd.DataFrame, pd.DataFrame]):
+    return select_hazard_model(prepared[1], [(), ('age_2',)], CS, folds=3, workers=1, model_cache=ModelCache())
+
+
+def test_the_winner_has_the_lowest_log_loss(selection):
+    scores = selection.scores
+    assert len(scores) == 2 * len(CS)
+    best = scores.loc[scores['log_loss'].idxmin()]
+    assert (' + '.join(selection.terms) or 'none', selection.C) == (best['terms'], best['C'])
+    assert selection.model.get_params()['lr__C'] == selection.C
+
+
+def test_the_winner_does_not_depend_on_the_order_of_the_candidates(prepared, selection):
+    reordered = select_hazard_model(prepared[1], [('age_2',), ()], CS[::-1], folds=3, workers=1,
+                                    model_cache=ModelCache())
+    assert (reordered.terms, reordered.C) == (selection.terms, selection.C)
+
+
+def test_the_empty_specification_is_the_default_hazard_model(prepared: Tuple[pd.DataFrame, pd.DataFrame]):
+    df, panel_df = prepared
+    model = build_hazard_model((), 1.)
+    assert str(model.get_params()) == str(LongevityEstimator.build_hazard_model().get_params())
+
+    selection = select_hazard_model(panel_df, [()], [1.], folds=3, workers=1, model_cache=ModelCache())
+    default = LongevityEstimator(df, panel_df, 'female', 5, model_cache=ModelCache()).export_coefficients()
+    chosen = LongevityEstimator(df, panel_df, 'female', 5, model_cache=ModelCache(),
+                                hazard_model=selection.model).export_coefficients()
+    assert chosen.keys() == default.keys()
+    assert_allclose([chosen[name] for name in default], [default[name] for name in default])
+
+
+def test_the_chosen_model_is_shared_through_the_model_cache(prepared: Tuple[pd.DataFrame, pd.DataFrame]):
+    df, panel_df = prepared
+    model_cache = ModelCache()
+    selection = select_hazard_model(panel_df, [('age_2',)], [1.], folds=3, workers=1, model_cache=model_cache)
+    estimator = LongevityEstimator(df, panel_df, 'female', 5, model_cache=model_cache, hazard_model=selection.model)
+    estimator.export_coefficients()
+    assert estimator.clf is selection.fitted
+    assert_allclose(estimator.clf.predict_proba(panel_df[HAZARD_FEATURES])[:, 1],
+                    selection.fitted.predict_proba(panel_df[HAZARD_FEATURES])[:, 1])
+    assert np.all(np.isfinite(selection.scores['log_loss']))
+
+
+def test_unknown_terms_are_rejected(prepared: Tuple[pd.DataFrame, pd.DataFrame]):
+    with pytest.raises(ValueError):
+        select_hazard_model(prepared[1], [('age_3',)], workers=1)